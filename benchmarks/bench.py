@@ -0,0 +1,218 @@
+"""
+Benchmarks for scanning, previewing and renaming at scale.
+
+Synthetic directories of empty files are generated on tmpfs (/dev/shm when it exists)
+and every phase is timed, headless and through the Qt GUI on the offscreen platform.
+Results can be saved as a baseline and later runs compared against it.
+
+    python -m benchmarks.bench --sizes 1000,100000 --qt --save baseline.json
+    python -m benchmarks.bench --sizes 1000,100000 --qt --compare baseline.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from renamer.engine import RenameSpec, compile_spec
+from renamer.planner import check_plan, execute_plan
+from renamer.scan import scan_entries
+
+SIZES = [1_000, 10_000, 100_000]
+# A phase counts as a regression when it is this much slower than the baseline...
+TOLERANCE = 0.25
+# ...and slower by at least this many seconds, so tiny phases don't flag on noise.
+MIN_DELTA = 0.005
+SPEC = RenameSpec(replace_search='IMG', replace_with='photo', case='lower',
+                  remove_words='holiday', num_suffix=True, num_pad=7, num_sep='_')
+
+
+def make_tree(root: Path, count: int) -> Path:
+    """
+    Creates count empty files named like a camera dump, with spread out mtimes.
+    """
+    root.mkdir(parents=True)
+    now = time.time()
+    for i in range(count):
+        path = os.path.join(root, f'IMG_{i:07d} holiday.jpg')
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+        os.utime(path, (now - i * 60, now - i * 60))
+    return root
+
+
+def scratch_dir() -> Path:
+    shm = Path('/dev/shm')
+    return Path(tempfile.mkdtemp(prefix='renamer-bench-', dir=shm if shm.is_dir() else None))
+
+
+class Recorder:
+    """
+    Times phases, optionally tracing peak Python memory (which slows the phases down).
+    """
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.results: dict[str, dict] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - begin
+            result = {'seconds': round(elapsed, 6),
+                      'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+            if self.trace_memory:
+                result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+            self.results[name] = result
+
+
+def bench_headless(root: Path, recorder: Recorder) -> None:
+    with recorder.phase('scan'):
+        listing = list(scan_entries(root))
+    names = [stem for stem, _, _, _ in listing]
+    with recorder.phase('preview'):
+        new_names = compile_spec(SPEC).apply(names)
+    pairs = [(root / f'{stem}{suffix}', root / f'{new}{suffix}')
+             for (stem, suffix, _, _), new in zip(listing, new_names)]
+    with recorder.phase('plan'):
+        plan = check_plan(pairs, [source for source, _ in pairs])
+    with recorder.phase('rename'):
+        execute_plan(plan)
+
+
+def bench_qt(root: Path, recorder: Recorder) -> None:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    from renamer.main import RenameOptions, directory_table, files
+    from renamer.model import format_mtime
+
+    app = QApplication.instance() or QApplication([])
+    with recorder.phase('qt_files'):
+        model = files(root)
+    with recorder.phase('qt_reopen'):
+        # Unchanged, so listed from the snapshot the first open saved.
+        files(root).deleteLater()
+    with recorder.phase('qt_format_time'):
+        for mtime in model.mtimes:
+            format_mtime(mtime)
+    view = directory_table(model)
+    with recorder.phase('qt_sort'):
+        view.sortByColumn(3, view.horizontalHeader().sortIndicatorOrder())
+    opts = RenameOptions(model, view, str(root))
+    with recorder.phase('qt_select_all'):
+        view.selectAll()
+    with recorder.phase('qt_preview'):
+        opts.replace_entry_search.setText('IMG')
+        opts.replace_entry_text.setText('photo')
+        opts.num_suffix.setChecked(True)
+        if opts.preview_timer.isActive() or opts.preview_worker is not None:
+            # Large previews wait for typing to pause; time the preview itself.
+            opts.preview_now()
+    with recorder.phase('qt_finalize'):
+        opts.finalize()
+        if opts.worker is not None:
+            opts.worker.wait()
+        app.processEvents()
+    # Tear the widgets down while the application still exists.
+    opts.deleteLater()
+    view.deleteLater()
+    app.processEvents()
+
+
+def run_benchmarks(sizes=SIZES, qt: bool = False, headless: bool = True,
+                   trace_memory: bool = False, log=None) -> dict:
+    """
+    Runs the benchmarks and returns {'meta': ..., 'results': {size: {phase: result}}}.
+    """
+    scratch = scratch_dir()
+    previous_home = os.environ.get('RENAMER_HOME')
+    # Keep the benchmark's journals out of the user's own.
+    os.environ['RENAMER_HOME'] = str(scratch / 'home')
+    results = {}
+    try:
+        for size in sizes:
+            recorder = Recorder(trace_memory)
+            if headless:
+                bench_headless(make_tree(scratch / f'headless-{size}', size), recorder)
+            if qt:
+                bench_qt(make_tree(scratch / f'qt-{size}', size), recorder)
+            results[str(size)] = recorder.results
+            if log is not None:
+                for name, result in recorder.results.items():
+                    log(f'{size:>9} {name:<16} {result["seconds"]:>9.3f}s')
+    finally:
+        if previous_home is None:
+            os.environ.pop('RENAMER_HOME', None)
+        else:
+            os.environ['RENAMER_HOME'] = previous_home
+        shutil.rmtree(scratch, ignore_errors=True)
+    meta = {'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'scratch': str(scratch.parent)}
+    return {'meta': meta, 'results': results}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """
+    Lists every phase that got slower than the baseline by more than the tolerance.
+    """
+    regressions = []
+    for size, phases in current['results'].items():
+        for name, result in phases.items():
+            old = baseline['results'].get(size, {}).get(name)
+            if old is None:
+                continue
+            new_time, old_time = result['seconds'], old['seconds']
+            if new_time > old_time * (1 + tolerance) and new_time - old_time > MIN_DELTA:
+                regressions.append(f'{size} {name}: {old_time:.3f}s -> {new_time:.3f}s '
+                                   f'({new_time / old_time:.2f}x)')
+    return regressions
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark scanning, previewing and renaming')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='Comma separated numbers of files to generate')
+    parser.add_argument('--qt', action='store_true', help='Also benchmark the GUI on the offscreen platform')
+    parser.add_argument('--no-headless', action='store_true', help='Skip the headless phases')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Record peak Python memory per phase (makes timings slower)')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Allowed slowdown, 0.25 = 25%%')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = get_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_benchmarks(sizes, qt=args.qt, headless=not args.no_headless,
+                             trace_memory=args.trace_memory, log=print)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,6 @@
-from .main import main
\ No newline at end of file
+def main():
+    """
+    Launches the GUI. Qt is only imported here so the engine can be used without it.
+    """
+    from .main import main as gui_main
+    gui_main()
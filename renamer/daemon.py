@@ -0,0 +1,283 @@
+"""
+Long-running rename daemon.
+
+Listens on a Unix socket for rename jobs, so scripts can submit many small jobs
+without paying for interpreter start-up and a fresh directory listing each time.
+Every line a client sends is one JSON job:
+
+    {"directory": "/abs/path", "spec": {...rename options...}, "preset": "NAME",
+     "dry_run": false, "ext": "jpg,png", "dirs": false, "sort": "name", "id": 42,
+     "retries": 4, "deadline": 30}
+
+Only directory is required. The daemon streams back the same JSON Lines records as
+the command line, one per planned or renamed file, and ends every job with a line
+holding "done" (or "error") and the job's id, and with retries the latency percentiles
+of its renames. Jobs on one connection run in order;
+connections run in parallel. Directory listings are cached between jobs while the
+directory's inode and mtime stay the same.
+
+    python -m renamer.daemon [--socket PATH]
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from . import profile
+from .engine import RenameSpec, compile_spec
+from .executor import WORKERS, RetryPolicy
+from .journal import Journal
+from .metadata import MetadataCache
+from .presets import Presets
+from .renamer import SORTS, plan, run
+from .scan import parse_extensions, scan_entries
+from .settings import data_dir
+from .snapshots import RACY_NS
+
+# Directory listings kept in memory, least recently used dropped first.
+LISTINGS = 256
+
+PathLike = Union[Path, str]
+
+
+def socket_path() -> Path:
+    return data_dir() / 'renamer.sock'
+
+
+class ListingCache:
+    """
+    Directory listings by path, each used while the directory's inode and mtime are unchanged.
+    """
+    def __init__(self, size: int = LISTINGS) -> None:
+        self.size = size
+        self.listings: OrderedDict[str, tuple[int, int, list]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, directory: PathLike) -> list[tuple[str, str, bool, float]]:
+        key = os.fspath(directory)
+        before = os.stat(key)
+        with self.lock:
+            entry = self.listings.get(key)
+            if entry is not None and entry[:2] == (before.st_ino, before.st_mtime_ns):
+                self.listings.move_to_end(key)
+                self.hits += 1
+                profile.count('listing_hits')
+                return entry[2]
+            self.listings.pop(key, None)
+            self.misses += 1
+        started = time.time_ns()
+        listing = list(scan_entries(key))
+        after = os.stat(key)
+        if after.st_mtime_ns == before.st_mtime_ns and before.st_mtime_ns < started - RACY_NS:
+            with self.lock:
+                self.listings[key] = (before.st_ino, before.st_mtime_ns, listing)
+                self.listings.move_to_end(key)
+                while len(self.listings) > self.size:
+                    self.listings.popitem(last=False)
+        return listing
+
+    def forget(self, directory: PathLike) -> None:
+        with self.lock:
+            self.listings.pop(os.fspath(directory), None)
+
+
+class JobError(ValueError):
+    pass
+
+
+class RenameDaemon:
+    """
+    Runs the jobs sent to a socket. Jobs on the same directory wait for each other.
+    """
+    def __init__(self, path: Optional[PathLike] = None, workers: int = WORKERS, journal: bool = True) -> None:
+        self.path = Path(path) if path else socket_path()
+        self.workers = workers
+        self.journal = Journal() if journal else None
+        self.listings = ListingCache()
+        self.presets = Presets()
+        self.locks: dict[str, threading.Lock] = {}
+        self.locks_lock = threading.Lock()
+        self.server: Optional[socketserver.UnixStreamServer] = None
+
+    def bind(self) -> None:
+        """
+        Creates the socket, readable by the current user only. A socket left behind by
+        a daemon that is no longer running is replaced.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(os.fspath(self.path))
+            except OSError:
+                self.path.unlink()
+            else:
+                raise OSError(f'A daemon is already listening on {self.path}')
+            finally:
+                probe.close()
+        server = Server(os.fspath(self.path), Handler, bind_and_activate=False)
+        server.renamer = self
+        old_umask = os.umask(0o177)
+        try:
+            server.server_bind()
+        finally:
+            os.umask(old_umask)
+        server.server_activate()
+        self.server = server
+
+    def serve(self) -> None:
+        if self.server is None:
+            self.bind()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.path.unlink(missing_ok=True)
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+
+    def lock(self, directory: str) -> threading.Lock:
+        with self.locks_lock:
+            return self.locks.setdefault(directory, threading.Lock())
+
+    def spec(self, job: dict) -> RenameSpec:
+        data = {}
+        if job.get('preset'):
+            data = self.presets.load(job['preset']).to_dict()
+        data.update(job.get('spec') or {})
+        return RenameSpec.from_dict(data)
+
+    def run_job(self, job: dict, output) -> dict:
+        """
+        Runs one job, writing a record per file to output. Returns the closing record.
+        """
+        directory = job.get('directory')
+        if not isinstance(directory, str) or not os.path.isabs(directory):
+            raise JobError('directory must be an absolute path')
+        sort = job.get('sort', 'none')
+        if sort not in SORTS:
+            raise JobError(f'sort must be one of {SORTS}')
+        extensions = parse_extensions(job.get('ext'))
+        dry_run = bool(job.get('dry_run'))
+        retry = None
+        if job.get('retries'):
+            retry = RetryPolicy(retries=int(job['retries']),
+                                deadline=float(job.get('deadline', RetryPolicy.deadline)))
+        pipeline = compile_spec(self.spec(job))
+        directory = os.path.normpath(directory)
+
+        with self.lock(directory), profile.span('daemon_job', directory=directory):
+            listing = self.listings.get(directory)
+            cache = MetadataCache() if pipeline.uses_metadata else None
+            renamed = set()
+            try:
+                chunks = plan(directory, pipeline, skip=renamed, cache=cache, listing=listing,
+                              extensions=extensions, dirs=bool(job.get('dirs')), sort=sort)
+                report = run(chunks, output, dry_run=dry_run, workers=self.workers, journal=self.journal,
+                             renamed=renamed, folders=pipeline.destination is not None, retry=retry)
+            finally:
+                if cache is not None:
+                    cache.close()
+                if not dry_run:
+                    self.listings.forget(directory)
+        result = {'done': True, 'total': report.total, 'renamed': report.renamed, 'failed': len(report.failed),
+                  'seconds': round(report.elapsed, 6)}
+        if report.latencies:
+            result['retries'] = report.retries
+            result['latency'] = {name: round(seconds, 6) for name, seconds in report.percentiles().items()}
+        return result
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    renamer: RenameDaemon
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Reads jobs line by line and answers each with its records and a closing line.
+    """
+    def handle(self) -> None:
+        output = self.connection.makefile('w', encoding='utf-8', newline='\n')
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                job_id = None
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise JobError('a job must be a JSON object')
+                    job_id = job.get('id')
+                    result = self.server.renamer.run_job(job, output)
+                except (OSError, ValueError, TypeError) as e:
+                    result = {'error': str(e)}
+                output.write(json.dumps({'id': job_id, **result}) + '\n')
+                output.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            try:
+                output.close()
+            except OSError:
+                pass
+
+
+def submit(job: dict, path: Optional[PathLike] = None) -> Iterator[dict]:
+    """
+    Sends one job to a running daemon and yields its records, the closing one last.
+    """
+    with socket.socket(socket.AF_UNIX) as client:
+        client.connect(os.fspath(path or socket_path()))
+        client.sendall((json.dumps(job) + '\n').encode())
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile('r', encoding='utf-8') as replies:
+            for line in replies:
+                record = json.loads(line)
+                yield record
+                if 'done' in record or 'error' in record:
+                    return
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve rename jobs sent as JSON lines over a Unix socket')
+    parser.add_argument('--socket', help=f'Socket path (default {socket_path()})')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help='Parallel renames per job')
+    parser.add_argument('--no-journal', action='store_true', help='Do not journal the renames for undo')
+    parser.add_argument('--profile', metavar='FILE', help='Write a profile of the jobs to FILE on exit')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = get_args(argv)
+    profile.enable_from_env(args.profile)
+    daemon = RenameDaemon(args.socket, args.workers, journal=not args.no_journal)
+    try:
+        daemon.bind()
+    except OSError as e:
+        print(f'Could not listen: {e}', file=sys.stderr)
+        return 2
+    print(f'Listening on {daemon.path}', file=sys.stderr)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profile.profiler.export()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
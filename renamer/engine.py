@@ -0,0 +1,556 @@
+"""
+Qt-free rename engine.
+
+A RenameSpec holds the values of every rename box. compile_spec turns a spec into a
+Pipeline of stage objects once, which can then be applied to whole lists of names.
+The Name and Add boxes may contain metadata tokens such as {date}, see metadata.py;
+their values are passed in alongside the names. A spec may also move the files to
+another folder, given as a template such as 'sorted/{date}' that is expanded per file.
+"""
+
+import os
+import re
+from dataclasses import asdict, dataclass, fields
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Mapping, Optional, Sequence
+
+from . import profile
+from .metadata import expand_tokens, used_tokens
+
+CASES = ['same', 'upper', 'lower', 'title', 'sentence']
+CASE_FUNCS = {'upper': str.upper, 'lower': str.lower,
+              'title': str.title, 'sentence': str.capitalize}
+CROP_POSITIONS = ['before', 'after']
+# Compiled patterns are kept for this many (text, regex) pairs, so typing into a box
+# and toggling between specs does not recompile.
+PATTERN_CACHE = 128
+# Spec fields that may hold metadata tokens.
+TOKEN_FIELDS = ['name', 'add_prefix', 'add_insert', 'add_suffix', 'move_to']
+# Spec fields read by each box, in the order the boxes are applied.
+BOX_FIELDS = [
+    ('name',),
+    ('replace_search', 'replace_with', 'replace_regex'),
+    ('case', 'case_except', 'case_regex'),
+    ('add_prefix', 'add_insert', 'add_insert_pos', 'add_suffix'),
+    ('remove_first', 'remove_last', 'remove_from', 'remove_to',
+     'remove_chars', 'remove_words', 'remove_crop_pos', 'remove_crop', 'remove_regex'),
+    ('num_prefix', 'num_suffix', 'num_insert', 'num_pos',
+     'num_start', 'num_incr', 'num_pad', 'num_sep'),
+]
+# Names a stage runs on at a time in a preview that can be cancelled.
+CANCEL_CHUNK = 10_000
+
+
+@dataclass
+class RenameSpec:
+    """
+    Values of the rename boxes, in the order they are applied.
+    Every field at its default leaves the names untouched. With the regex flags
+    replace_search, case_except, remove_words and remove_crop are regular expressions,
+    and replace_with may refer to groups as \\1 or \\g<name>. move_to is the folder
+    files are moved to, relative to their own folder unless absolute.
+    """
+    # Name
+    name: str = ''
+    # Replace
+    replace_search: str = ''
+    replace_with: str = ''
+    replace_regex: bool = False
+    # Case
+    case: str = 'same'
+    case_except: str = ''
+    case_regex: bool = False
+    # Add
+    add_prefix: str = ''
+    add_insert: str = ''
+    add_insert_pos: int = 0
+    add_suffix: str = ''
+    # Remove
+    remove_first: int = 0
+    remove_last: int = 0
+    remove_from: int = 0
+    remove_to: int = 0
+    remove_chars: str = ''
+    remove_words: str = ''
+    remove_crop_pos: str = 'before'
+    remove_crop: str = ''
+    remove_regex: bool = False
+    # Auto Number
+    num_prefix: bool = False
+    num_suffix: bool = False
+    num_insert: bool = False
+    num_pos: int = 0
+    num_start: int = 1
+    num_incr: int = 1
+    num_pad: int = 0
+    num_sep: str = ''
+    # Move
+    move_to: str = ''
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def tokens(self) -> frozenset[str]:
+        """
+        The metadata tokens used by the boxes.
+        """
+        return frozenset().union(*(used_tokens(getattr(self, field)) for field in TOKEN_FIELDS))
+
+    def box_keys(self) -> list[tuple]:
+        """
+        The values of each box, for spotting which boxes differ between two specs.
+        """
+        return [tuple(getattr(self, field) for field in box) for box in BOX_FIELDS]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RenameSpec':
+        """
+        Builds a spec from a (possibly partial) dictionary, rejecting unknown keys and
+        values of the wrong type.
+        """
+        types = {f.name: f.type for f in fields(cls)}
+        unknown = set(data) - set(types)
+        if unknown:
+            raise ValueError(f'Unknown rename option(s): {", ".join(sorted(unknown))}')
+        for key, value in data.items():
+            # bool is an int too, but not a valid count or position.
+            if type(value) is not types[key]:
+                raise ValueError(f'{key} must be {types[key].__name__}, not {value!r}')
+        spec = cls(**data)
+        if spec.case not in CASES:
+            raise ValueError(f'Case must be one of {CASES}, not {spec.case!r}')
+        if spec.remove_crop_pos not in CROP_POSITIONS:
+            raise ValueError(f'Crop position must be one of {CROP_POSITIONS}, not {spec.remove_crop_pos!r}')
+        return spec
+
+
+class PatternError(ValueError):
+    """
+    A box holds a regular expression (or replacement) that does not compile.
+    """
+    def __init__(self, box: str, pattern: str, error: Exception) -> None:
+        super().__init__(f'Invalid pattern {pattern!r} in {box}: {error}')
+        self.box = box
+        self.pattern = pattern
+
+
+@lru_cache(maxsize=PATTERN_CACHE)
+def compile_pattern(text: str, regex: bool = True) -> re.Pattern:
+    """
+    Compiles text as a regular expression, or as literal text when regex is False.
+    Raises re.error for invalid expressions.
+    """
+    return re.compile(text if regex else re.escape(text))
+
+
+def box_pattern(box: str, text: str, regex: bool) -> re.Pattern:
+    try:
+        return compile_pattern(text, regex)
+    except re.error as e:
+        raise PatternError(box, text, e) from None
+
+
+class Stage:
+    """
+    A single transform applied to a batch of names.
+    Positional stages also take the offset of the batch within the whole run,
+    and stages using tokens take the metadata of each name.
+    """
+    title = ''
+    positional = False
+    tokens: frozenset[str] = frozenset()
+
+    @property
+    def uses_metadata(self) -> bool:
+        return bool(self.tokens)
+
+    def apply(self, names: Sequence[str]) -> list[str]:
+        raise NotImplementedError
+
+
+class NameStage(Stage):
+    title = 'Name'
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.tokens = used_tokens(name)
+
+    def apply(self, names: Sequence[str], metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[str]:
+        if not self.uses_metadata:
+            return [self.name] * len(names)
+        return [expand_tokens(self.name, meta) for meta in _metadata(metadata, len(names))]
+
+
+class ReplaceStage(Stage):
+    title = 'Replace'
+
+    def __init__(self, search: str, replace: str, regex: bool = False) -> None:
+        self.search = search
+        self.replace = replace
+        self.pattern = box_pattern(self.title, search, True) if regex else None
+        if self.pattern is not None:
+            try:
+                # Checks the group references of the replacement once, up front.
+                self.pattern.sub(replace, '')
+            except (re.error, IndexError) as e:
+                raise PatternError(self.title, replace, e) from None
+
+    def apply(self, names: Sequence[str]) -> list[str]:
+        search, replace = self.search, self.replace
+        if self.pattern is None:
+            return [name.replace(search, replace) for name in names]
+        sub = self.pattern.sub
+        return [sub(replace, name) for name in names]
+
+
+class CaseStage(Stage):
+    title = 'Case'
+
+    def __init__(self, case: Callable[[str], str], exception: str = '', regex: bool = False) -> None:
+        self.case = case
+        self.exception = exception
+        self.pattern = box_pattern(self.title, exception, regex) if exception else None
+
+    def apply(self, names: Sequence[str]) -> list[str]:
+        case = self.case
+        if self.pattern is None:
+            return [case(name) for name in names]
+        finditer = self.pattern.finditer
+        new_names = []
+        for name in names:
+            # Exceptions are found before the case change and put back as they were after.
+            spans = [m.span() for m in finditer(name) if m.end() > m.start()]
+            new_name = case(name)
+            for start, end in spans:
+                new_name = new_name[:start] + name[start:end] + new_name[end:]
+            new_names.append(new_name)
+        return new_names
+
+
+class AddStage(Stage):
+    title = 'Add'
+
+    def __init__(self, prefix: str, insert: str, insert_pos: int, suffix: str) -> None:
+        self.prefix = prefix
+        self.insert = insert if insert_pos else ''
+        self.insert_pos = insert_pos
+        self.suffix = suffix
+        self.tokens = used_tokens(prefix) | used_tokens(self.insert) | used_tokens(suffix)
+
+    def apply(self, names: Sequence[str], metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[str]:
+        if self.uses_metadata:
+            return [self.add(name, expand_tokens(self.prefix, meta), expand_tokens(self.insert, meta),
+                             expand_tokens(self.suffix, meta))
+                    for name, meta in zip(names, _metadata(metadata, len(names)))]
+        prefix, suffix = self.prefix, self.suffix
+        if not self.insert:
+            return [f'{prefix}{name}{suffix}' for name in names]
+        return [self.add(name, prefix, self.insert, suffix) for name in names]
+
+    def add(self, name: str, prefix: str, insert: str, suffix: str) -> str:
+        name = prefix + name
+        if insert:
+            pos = self.insert_pos
+            name = f'{name[:pos]}{insert}{name[pos:]}'
+        return name + suffix
+
+
+def _metadata(metadata: Optional[Sequence[Mapping[str, str]]], count: int) -> Sequence[Mapping[str, str]]:
+    # Without metadata every token is left empty.
+    return metadata if metadata is not None else [{}] * count
+
+
+class RemoveStage(Stage):
+    title = 'Remove'
+
+    def __init__(self, first: int = 0, last: int = 0, from_: int = 0, to: int = 0,
+                 chars: str = '', words: str = '', crop_pos: str = 'before', crop: str = '',
+                 regex: bool = False) -> None:
+        self.first = first
+        self.last = last
+        self.from_ = from_
+        self.to = max(to, from_)
+        self.chars = str.maketrans('', '', chars) if chars else None
+        # In regex mode words is one pattern whose matches are removed.
+        self.words = [] if regex else words.split()
+        self.words_pattern = box_pattern(self.title, words, True) if regex and words else None
+        self.crop_pos = crop_pos
+        self.crop = crop
+        self.crop_pattern = box_pattern(self.title, crop, True) if regex and crop else None
+
+    def apply(self, names: Sequence[str]) -> list[str]:
+        first, last = self.first, self.last
+        from_, to = self.from_, self.to
+        chars, words = self.chars, self.words
+        words_sub = self.words_pattern.sub if self.words_pattern is not None else None
+        crop, crop_len, before = self.crop, len(self.crop), self.crop_pos == 'before'
+        crop_search = self.crop_pattern.search if self.crop_pattern is not None else None
+        new_names = []
+        for name in names:
+            if first:
+                name = name[first:]
+            if last:
+                name = name[:-last]
+            if from_:
+                name = name[:from_] + name[to + 1:]
+            if chars:
+                name = name.translate(chars)
+            for word in words:
+                name = name.replace(word, '')
+            if words_sub is not None:
+                name = words_sub('', name)
+            if crop_search is not None:
+                match = crop_search(name)
+                if match is not None:
+                    name = name[match.start():] if before else name[:match.end()]
+            elif crop:
+                pos = name.find(crop)
+                # Nothing to crop against if the text is missing.
+                if pos >= 0:
+                    name = name[pos:] if before else name[:pos + crop_len]
+            new_names.append(name)
+        return new_names
+
+
+class NumberStage(Stage):
+    title = 'Auto Number'
+    positional = True
+
+    def __init__(self, prefix: bool, suffix: bool, insert_pos: int,
+                 start: int = 1, incr: int = 1, pad: int = 0, sep: str = '') -> None:
+        self.prefix = prefix
+        self.suffix = suffix
+        self.insert_pos = insert_pos
+        self.start = start
+        self.incr = incr
+        self.pad = pad
+        self.sep = sep
+
+    def numbers(self, count: int, offset: int = 0) -> list[str]:
+        """
+        The formatted numbers for count names, starting offset names into the batch.
+        """
+        start, incr, pad = self.start + offset * self.incr, self.incr, self.pad
+        return [f'{start + i * incr:0>{pad}}' for i in range(count)]
+
+    def apply(self, names: Sequence[str], offset: int = 0) -> list[str]:
+        sep, pos = self.sep, self.insert_pos
+        new_names = []
+        for name, num in zip(names, self.numbers(len(names), offset)):
+            if self.prefix:
+                name = f'{num}{sep}{name}'
+            if self.suffix:
+                name = f'{name}{sep}{num}'
+            if pos:
+                name = f'{name[:pos]}{sep}{num}{sep}{name[pos:]}'
+            new_names.append(name)
+        return new_names
+
+
+class MoveStage(Stage):
+    """
+    Picks the folder each file is moved to. Unlike the other stages it leaves the
+    names alone, so it is kept apart from them as the pipeline's destination.
+    """
+    title = 'Move'
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.tokens = used_tokens(template)
+
+    def apply(self, names: Sequence[str], metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[str]:
+        """
+        The folder template expanded for each name.
+        """
+        if not self.uses_metadata:
+            return [self.template] * len(names)
+        # A token value names one folder; slashes in it must not nest further folders.
+        return [expand_tokens(self.template, {key: value.replace('/', '_').replace(os.sep, '_')
+                                              for key, value in meta.items()})
+                for meta in _metadata(metadata, len(names))]
+
+    def folders(self, directory: Path, names: Sequence[str],
+                metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[Path]:
+        """
+        The folder each name in directory moves to. A template that expands to nothing
+        leaves the file where it is.
+        """
+        resolved: dict[str, Path] = {}
+        folders = []
+        for folder in self.apply(names, metadata):
+            path = resolved.get(folder)
+            if path is None:
+                path = resolved[folder] = Path(os.path.normpath(directory / os.path.expanduser(folder)))
+            folders.append(path)
+        return folders
+
+
+class Pipeline:
+    """
+    A compiled, ordered list of stages. Stages that would not change anything are left out.
+    destination, if set, moves the files to other folders.
+    """
+    def __init__(self, stages: list[Stage], destination: Optional[MoveStage] = None) -> None:
+        self.stages = stages
+        self.destination = destination
+
+    def __len__(self) -> int:
+        return len(self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    @property
+    def tokens(self) -> frozenset[str]:
+        stages = self.stages if self.destination is None else self.stages + [self.destination]
+        return frozenset().union(*(stage.tokens for stage in stages))
+
+    @property
+    def uses_metadata(self) -> bool:
+        return bool(self.tokens)
+
+    def apply(self, names: Sequence[str], offset: int = 0,
+              metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[str]:
+        """
+        Applies every stage to names. offset is the number of names that came before
+        this batch, so that a long run can be applied chunk by chunk. metadata holds
+        the token values of each name, if any stage uses tokens.
+        """
+        new_names = list(names)
+        with profile.span('pipeline', rows=len(new_names)):
+            for stage in self.stages:
+                new_names = run_stage(stage, new_names, offset, metadata)
+        profile.count('rows_previewed', len(new_names))
+        return new_names
+
+
+def run_stage(stage: Stage, names: Sequence[str], offset: int = 0,
+              metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[str]:
+    if stage.positional:
+        return stage.apply(names, offset)
+    if stage.uses_metadata:
+        return stage.apply(names, metadata)
+    return stage.apply(names)
+
+
+def run_chunks(stage: Stage, names: Sequence[str], metadata: Optional[Sequence[Mapping[str, str]]],
+               cancelled: Callable[[], bool]) -> Optional[list[str]]:
+    """
+    Like run_stage, CANCEL_CHUNK names at a time. None once cancelled() is true.
+    """
+    new_names = []
+    for start in range(0, len(names), CANCEL_CHUNK):
+        if cancelled():
+            return None
+        stop = start + CANCEL_CHUNK
+        new_names += run_stage(stage, names[start:stop], start, metadata[start:stop] if metadata else None)
+    return new_names
+
+
+def compile_stages(spec: RenameSpec) -> list[Optional[Stage]]:
+    """
+    Compiles every box of the spec, using None for boxes that would not change a name.
+    The result always has one entry per box, in application order.
+    Raises PatternError if a regular expression does not compile.
+    """
+    name = NameStage(spec.name) if spec.name else None
+
+    replace = None
+    if spec.replace_search or spec.replace_with:
+        replace = ReplaceStage(spec.replace_search, spec.replace_with, spec.replace_regex)
+
+    case = None
+    if spec.case != 'same':
+        case = CaseStage(CASE_FUNCS[spec.case], spec.case_except, spec.case_regex)
+
+    add = None
+    if spec.add_prefix or spec.add_suffix or (spec.add_insert and spec.add_insert_pos):
+        add = AddStage(spec.add_prefix, spec.add_insert, spec.add_insert_pos, spec.add_suffix)
+
+    remove = None
+    if (spec.remove_first or spec.remove_last or spec.remove_from or spec.remove_chars
+            or (spec.remove_words if spec.remove_regex else spec.remove_words.strip()) or spec.remove_crop):
+        remove = RemoveStage(spec.remove_first, spec.remove_last, spec.remove_from, spec.remove_to,
+                             spec.remove_chars, spec.remove_words, spec.remove_crop_pos, spec.remove_crop,
+                             spec.remove_regex)
+
+    number = None
+    insert_pos = spec.num_pos if spec.num_insert else 0
+    if spec.num_prefix or spec.num_suffix or insert_pos > 0:
+        number = NumberStage(spec.num_prefix, spec.num_suffix, max(insert_pos, 0),
+                             spec.num_start, spec.num_incr, spec.num_pad, spec.num_sep)
+
+    return [name, replace, case, add, remove, number]
+
+
+def compile_spec(spec: RenameSpec) -> Pipeline:
+    """
+    Compiles a spec into a Pipeline ready to be applied to batches of names.
+    """
+    destination = MoveStage(spec.move_to.strip()) if spec.move_to.strip() else None
+    return Pipeline([stage for stage in compile_stages(spec) if stage is not None], destination)
+
+
+def preview(spec: RenameSpec, names: Sequence[str],
+            metadata: Optional[Sequence[Mapping[str, str]]] = None) -> list[str]:
+    """
+    Convenience wrapper to compile a spec and apply it to names in one go.
+    """
+    return compile_spec(spec).apply(names, metadata=metadata)
+
+
+class PreviewCache:
+    """
+    Keeps the output of every box for the last batch of names. When only one box
+    changes, that box and the ones after it are rerun on the cached input.
+    The returned lists are shared with the cache and must not be modified.
+    """
+    def __init__(self) -> None:
+        self.names: Optional[list[str]] = None
+        self.metadata = None
+        self.keys: list[tuple] = []
+        self.outputs: list[list[str]] = []
+        self.last_start = 0
+
+    def clear(self) -> None:
+        self.names = None
+
+    def apply(self, spec: RenameSpec, names: Sequence[str],
+              metadata: Optional[Sequence[Mapping[str, str]]] = None,
+              cancelled: Optional[Callable[[], bool]] = None) -> Optional[list[str]]:
+        """
+        The new names for names under spec. metadata, if given, is compared by identity:
+        pass a new list whenever the token values change. With cancelled, the stages run
+        CANCEL_CHUNK names at a time and None is returned as soon as cancelled() is true.
+        """
+        keys = spec.box_keys()
+        if self.names is None or names != self.names or metadata is not self.metadata:
+            base = list(names)
+            start = 0
+        else:
+            base = self.names
+            start = next((i for i, (new, old) in enumerate(zip(keys, self.keys)) if new != old),
+                         len(keys))
+
+        # Nothing is stored until every stage has run, so a PatternError leaves the cache as it was.
+        stages = compile_stages(spec)
+        outputs = self.outputs[:start]
+        current = outputs[-1] if outputs else base
+        with profile.span('preview', rows=len(base), start=start):
+            for stage in stages[start:]:
+                if stage is not None:
+                    if cancelled is None:
+                        current = run_stage(stage, current, 0, metadata)
+                    else:
+                        current = run_chunks(stage, current, metadata, cancelled)
+                        if current is None:
+                            return None
+                outputs.append(current)
+        profile.count('rows_previewed', len(base))
+        self.names = base
+        self.metadata = metadata
+        self.keys = keys
+        self.outputs = outputs
+        self.last_start = start
+        return current
@@ -0,0 +1,402 @@
+"""
+Parallel execution of renames.
+
+Renames run in batches on a thread pool. A rename to another filesystem fails with
+EXDEV; such files are moved by transfer_file instead, each as its own task so that
+large copies run side by side instead of queueing behind each other in one batch.
+
+Given a RetryPolicy, renames run one by one from an asyncio loop instead, so that
+renames failing with a transient error (a scanner or sync client holding the file on a
+network share) can wait and retry without holding up a thread or the rest of the batch.
+"""
+
+import asyncio
+import errno
+import itertools
+import os
+import random
+import shutil
+import stat
+import time
+import uuid
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Union
+from pathlib import Path
+
+from . import profile
+
+PathLike = Union[Path, str]
+Pair = tuple[PathLike, PathLike]
+Failure = tuple[str, str, str]
+
+WORKERS = 8
+BATCH_SIZE = 64
+# Bytes handed to the kernel per copy call when moving a file across filesystems.
+COPY_BLOCK = 1 << 26
+# Errors meaning a kernel copy call is unavailable for these two files, not that the copy failed.
+COPY_FALLBACK = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+# Errors worth retrying: the file is held open or locked for a moment by another program.
+TRANSIENT = frozenset({errno.EBUSY, errno.EACCES, errno.EAGAIN, errno.ETXTBSY})
+# Renames queued per allowed in-flight rename by the asyncio executor, so huge inputs stream.
+QUEUED = 4
+# Seconds between progress calls of the asyncio executor, which finishes renames one at a time.
+PROGRESS_INTERVAL = 0.1
+
+
+@dataclass
+class RenameReport:
+    """
+    Outcome of a batch of renames. Failures are kept as (source, target, reason).
+    """
+    total: int = 0
+    renamed: int = 0
+    failed: list[tuple[str, str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+    # Kept by the asyncio executor: retried attempts and the seconds each rename took, retries included.
+    retries: int = 0
+    latencies: array = field(default_factory=lambda: array('d'))
+
+    @property
+    def rate(self) -> float:
+        """
+        Renames per second.
+        """
+        return self.renamed / self.elapsed if self.elapsed else 0.0
+
+    def percentiles(self) -> dict[str, float]:
+        """
+        The 50th, 90th and 99th percentile and the maximum of the rename latencies in
+        seconds, or nothing if they were not measured.
+        """
+        if not self.latencies:
+            return {}
+        ordered = sorted(self.latencies)
+        last = len(ordered) - 1
+        found = {f'p{point}': ordered[min(last, len(ordered) * point // 100)] for point in (50, 90, 99)}
+        found['max'] = ordered[last]
+        return found
+
+    def summary(self) -> str:
+        text = f'Renamed {self.renamed} of {self.total} in {self.elapsed:.2f}s ({self.rate:.0f}/s)'
+        if self.failed:
+            text += f', {len(self.failed)} failed'
+        if self.retries:
+            text += f', {self.retries} retries'
+        if self.latencies:
+            text += ', latency ' + ' '.join(f'{name} {seconds * 1000:.1f}ms'
+                                            for name, seconds in self.percentiles().items())
+        return text
+
+    def failures(self) -> str:
+        """
+        One line per failed rename.
+        """
+        return '\n'.join(f'{source} -> {target}: {reason}' for source, target, reason in self.failed)
+
+
+def rename_file(source: PathLike, target: PathLike) -> None:
+    """
+    Renames source to target without ever replacing an existing file.
+    A target that is the source itself (a case-only rename) is allowed.
+    """
+    if os.path.lexists(target) and not _same_file(source, target):
+        raise FileExistsError(f'{target} already exists')
+    os.rename(source, target)
+
+
+def _same_file(source: PathLike, target: PathLike) -> bool:
+    try:
+        return os.path.samefile(source, target)
+    except OSError:
+        return False
+
+
+def transfer_file(source: PathLike, target: PathLike) -> None:
+    """
+    Moves a file to another filesystem without ever replacing an existing file.
+    The content is copied in the kernel to a temporary name next to target, synced and
+    checked against source, then renamed into place before source is unlinked, so
+    target never shows a partial copy. Symbolic links are recreated; folders are refused.
+    """
+    source, target = os.fspath(source), os.fspath(target)
+    if os.path.lexists(target):
+        raise FileExistsError(f'{target} already exists')
+    before = os.lstat(source)
+    if stat.S_ISLNK(before.st_mode):
+        os.symlink(os.readlink(source), target)
+        _unlink_moved(source, target)
+        return
+    if not stat.S_ISREG(before.st_mode):
+        raise OSError(errno.EXDEV, 'Only files can be moved to another filesystem', source)
+    directory, name = os.path.split(target)
+    temp = os.path.join(directory, f'.{name}.{uuid.uuid4().hex[:8]}.moving')
+    with profile.span('transfer', size=before.st_size), open(source, 'rb') as f:
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            try:
+                copied = copy_fd(f.fileno(), fd, before.st_size)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            after = os.fstat(f.fileno())
+            if copied != before.st_size or (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                raise OSError(errno.EIO, 'File changed while it was copied', source)
+            shutil.copystat(source, temp)
+            rename_file(temp, target)
+        except BaseException:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+    profile.count('bytes_transferred', copied)
+    _unlink_moved(source, target)
+
+
+def _unlink_moved(source: str, target: str) -> None:
+    # If the original can not be removed the copy goes again, so the file is never in two places.
+    try:
+        os.unlink(source)
+    except OSError:
+        os.unlink(target)
+        raise
+
+
+def copy_fd(source_fd: int, target_fd: int, size: int) -> int:
+    """
+    Copies up to size bytes from the start of one file to another, with
+    copy_file_range (which may share blocks instead of copying them), else sendfile,
+    else pread and write. Returns the number of bytes copied.
+    """
+    for copy in _COPIES:
+        copied = 0
+        try:
+            while copied < size:
+                n = copy(source_fd, target_fd, copied, min(size - copied, COPY_BLOCK))
+                if not n:
+                    # The file got shorter; the caller checks the size.
+                    break
+                copied += n
+            return copied
+        except OSError as e:
+            # Only an unsupported call is retried another way, and only before it wrote anything.
+            if copied or e.errno not in COPY_FALLBACK:
+                raise
+    return 0
+
+
+def _copy_file_range(source_fd: int, target_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(source_fd, target_fd, count, offset, offset)
+
+
+def _sendfile(source_fd: int, target_fd: int, offset: int, count: int) -> int:
+    # sendfile writes at the target's position, which is where the previous call stopped.
+    return os.sendfile(target_fd, source_fd, offset, count)
+
+
+def _read_write(source_fd: int, target_fd: int, offset: int, count: int) -> int:
+    data = os.pread(source_fd, min(count, 1 << 20), offset)
+    view = memoryview(data)
+    while view:
+        view = view[os.pwrite(target_fd, view, offset + len(data) - len(view)):]
+    return len(data)
+
+
+_COPIES = ([_copy_file_range] if hasattr(os, 'copy_file_range') else []) + \
+          ([_sendfile] if hasattr(os, 'sendfile') else []) + [_read_write]
+
+
+def _failure(source: PathLike, target: PathLike, error: OSError) -> Failure:
+    if isinstance(error, FileExistsError):
+        return str(source), str(target), 'target already exists'
+    return str(source), str(target), error.strerror or str(error)
+
+
+def _rename_batch(batch: Sequence[Pair]) -> tuple[int, list[Failure], list[Pair]]:
+    """
+    Renames a batch, returning the number renamed, the failures and the pairs that
+    have to be moved to another filesystem instead.
+    """
+    renamed = 0
+    failed = []
+    transfers = []
+    for source, target in batch:
+        try:
+            rename_file(source, target)
+            renamed += 1
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                transfers.append((source, target))
+            else:
+                failed.append(_failure(source, target, e))
+    return renamed, failed, transfers
+
+
+def _transfer(source: PathLike, target: PathLike) -> tuple[int, list[Failure], list[Pair]]:
+    try:
+        transfer_file(source, target)
+    except OSError as e:
+        return 0, [_failure(source, target, e)], []
+    return 1, [], []
+
+
+def batches(pairs: Iterable[Pair], size: int) -> Iterator[list[Pair]]:
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def execute_renames(pairs: Iterable[Pair], workers: int = WORKERS, batch_size: int = BATCH_SIZE,
+                    progress: Optional[Callable[[RenameReport], None]] = None,
+                    cancelled: Optional[Callable[[], bool]] = None,
+                    retry: Optional['RetryPolicy'] = None) -> RenameReport:
+    """
+    Renames (source, target) pairs in batches on a bounded thread pool. Pairs on
+    different filesystems are then moved one file per task with transfer_file.
+    Failures never stop the run; they are collected in the returned report.
+    progress is called with the running report after each batch completes, and
+    no new batches are started once cancelled() returns True. With retry, the
+    renames run on asyncio instead, see execute_renames_async.
+    """
+    if retry is not None:
+        return execute_renames_async(pairs, retry, workers, progress, cancelled)
+    report = RenameReport()
+    begin = time.perf_counter()
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def collect(done):
+            for future in done:
+                renamed, failed, transfers = future.result()
+                report.renamed += renamed
+                report.failed.extend(failed)
+                pending.update(pool.submit(_transfer, source, target) for source, target in transfers)
+            report.elapsed = time.perf_counter() - begin
+            if progress is not None:
+                progress(report)
+
+        for batch in batches(pairs, batch_size):
+            if cancelled is not None and cancelled():
+                break
+            report.total += len(batch)
+            pending.add(pool.submit(_rename_batch, batch))
+            # Keep a bounded number of batches in flight so huge inputs stay streaming.
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    report.elapsed = time.perf_counter() - begin
+    return report
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How renames failing with a transient error are retried. Before retry n the rename
+    waits a random time of up to min(cap, base * 2 ** n) seconds, so renames that failed
+    together do not all come back at once. No retry starts once deadline seconds have
+    passed since the first attempt. An attempt in progress is never abandoned: the call
+    can not be interrupted, and the file may have moved by the time it returns.
+    """
+    retries: int = 4
+    base: float = 0.05
+    cap: float = 2.0
+    deadline: float = 30.0
+    transient: frozenset[int] = TRANSIENT
+
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** retry))
+
+
+def execute_renames_async(pairs: Iterable[Pair], retry: Optional[RetryPolicy] = None, limit: int = WORKERS,
+                          progress: Optional[Callable[[RenameReport], None]] = None,
+                          cancelled: Optional[Callable[[], bool]] = None) -> RenameReport:
+    """
+    Renames (source, target) pairs from an asyncio loop with at most limit renames in
+    flight, retrying transient errors according to retry. The report has the latency
+    of every rename. Runs its own event loop, so it must not be called from one.
+    """
+    with profile.span('execute_async', limit=limit):
+        report = asyncio.run(_execute_async(pairs, retry or RetryPolicy(), limit, progress, cancelled))
+    profile.count('rename_retries', report.retries)
+    return report
+
+
+async def _execute_async(pairs: Iterable[Pair], retry: RetryPolicy, limit: int,
+                         progress: Optional[Callable[[RenameReport], None]],
+                         cancelled: Optional[Callable[[], bool]]) -> RenameReport:
+    report = RenameReport()
+    begin = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(limit)
+    reported = begin
+
+    async def attempt(call: Callable[[PathLike, PathLike], None], source: PathLike, target: PathLike) -> None:
+        # The slot is only held for the call itself, not while waiting to retry.
+        async with slots:
+            await loop.run_in_executor(pool, call, source, target)
+
+    async def move(source: PathLike, target: PathLike) -> Optional[Failure]:
+        started = time.perf_counter()
+        call = rename_file
+        try:
+            for n in itertools.count():
+                try:
+                    await attempt(call, source, target)
+                    return None
+                except OSError as e:
+                    if e.errno == errno.EXDEV and call is rename_file:
+                        call = transfer_file
+                        continue
+                    if e.errno not in retry.transient or n >= retry.retries:
+                        return _failure(source, target, e)
+                    delay = retry.delay(n)
+                    if time.perf_counter() + delay - started > retry.deadline:
+                        source, target, reason = _failure(source, target, e)
+                        return source, target, f'{reason} (gave up after {retry.deadline:g}s)'
+                    report.retries += 1
+                    await asyncio.sleep(delay)
+        finally:
+            report.latencies.append(time.perf_counter() - started)
+
+    def collect(done) -> None:
+        nonlocal reported
+        for task in done:
+            failure = task.result()
+            if failure is None:
+                report.renamed += 1
+            else:
+                report.failed.append(failure)
+        now = time.perf_counter()
+        report.elapsed = now - begin
+        if progress is not None and now - reported >= PROGRESS_INTERVAL:
+            reported = now
+            progress(report)
+
+    pending = set()
+    with ThreadPoolExecutor(max_workers=limit) as pool:
+        for source, target in pairs:
+            if cancelled is not None and cancelled():
+                break
+            report.total += 1
+            pending.add(loop.create_task(move(source, target)))
+            if len(pending) >= limit * QUEUED:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+    report.elapsed = time.perf_counter() - begin
+    if progress is not None:
+        progress(report)
+    return report
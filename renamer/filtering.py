@@ -0,0 +1,119 @@
+"""
+Filtering of directory listings by name.
+
+A FilterIndex keeps what filters test precomputed for a whole listing: the lower
+case file name of every row and, once an extension filter is used, a map from
+extension to rows. Matching runs the compiled test over the names with map() and
+compress(), so a million rows are filtered without a Python loop per row.
+
+    index = FilterIndex()
+    index.extend(names, suffixes, is_dir)
+    rows = index.match('*.jpg', 'glob')
+"""
+
+import fnmatch
+import re
+from itertools import compress
+from typing import Callable, Iterable, Optional, Sequence
+
+from .scan import parse_extensions
+
+# glob: shell wildcards over the whole file name, or a plain substring without any.
+# regex: a regular expression searched for in the file name.
+# ext: a comma separated list of extensions.
+MODES = ['glob', 'regex', 'ext']
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def compile_filter(text: str, mode: str = 'glob') -> Callable[[str], object]:
+    """
+    A test for lower case file names, true for the names a glob or regex filter matches.
+    Filters are case insensitive. Raises FilterError for invalid regular expressions.
+    """
+    if mode == 'regex':
+        try:
+            return re.compile(text, re.IGNORECASE).search
+        except re.error as e:
+            raise FilterError(f'Invalid filter: {e}') from None
+    if mode != 'glob':
+        raise FilterError(f'Filter mode must be one of {MODES}, not {mode!r}')
+    if not GLOB_CHARS.search(text):
+        return re.compile(re.escape(text.lower())).search
+    return re.compile(fnmatch.translate(text.lower())).match
+
+
+class FilterIndex:
+    """
+    Lower case names and extensions of a listing, in row order, for filtering it.
+    Remembers the last match so that typing on in a plain text filter only tests
+    the rows that matched before.
+    """
+    def __init__(self) -> None:
+        self.lower: list[str] = []
+        self.extensions: list[str] = []
+        self._by_extension: Optional[dict[str, list[int]]] = None
+        self.last: Optional[tuple[str, str, list[int]]] = None
+
+    def __len__(self) -> int:
+        return len(self.lower)
+
+    def extend(self, names: Sequence[str], suffixes: Sequence[str], is_dir: Iterable[bool]) -> None:
+        """
+        Adds rows to the end of the index.
+        """
+        first = len(self.lower)
+        extensions = ['' if folder else suffix.lower() for suffix, folder in zip(suffixes, is_dir)]
+        self.lower.extend(map(str.lower, map(str.__add__, names, suffixes)))
+        self.extensions.extend(extensions)
+        if self._by_extension is not None:
+            for row, extension in enumerate(extensions, start=first):
+                self._by_extension.setdefault(extension, []).append(row)
+        self.last = None
+
+    @property
+    def by_extension(self) -> dict[str, list[int]]:
+        """
+        The rows of each extension, in row order. Built the first time it is needed.
+        """
+        if self._by_extension is None:
+            by_extension: dict[str, list[int]] = {}
+            for row, extension in enumerate(self.extensions):
+                by_extension.setdefault(extension, []).append(row)
+            self._by_extension = by_extension
+        return self._by_extension
+
+    def match(self, text: str, mode: str = 'glob', start: int = 0) -> Optional[list[int]]:
+        """
+        The rows from start on matching a filter, in row order, or None for an empty
+        filter (every row).
+        """
+        text = text.strip()
+        if not text:
+            self.last = None
+            return None
+        if mode == 'ext':
+            extensions = parse_extensions(text) or set()
+            if start:
+                return [row for row in range(start, len(self.extensions)) if self.extensions[row] in extensions]
+            if len(extensions) > 1:
+                return list(compress(range(len(self.extensions)), map(extensions.__contains__, self.extensions)))
+            return list(self.by_extension.get(next(iter(extensions)), [])) if extensions else []
+        test = compile_filter(text, mode)
+        if start:
+            return [row for row in range(start, len(self.lower)) if test(self.lower[row])]
+        within = None
+        if self.last is not None and mode == self.last[0] == 'glob':
+            last_text = self.last[1]
+            if not GLOB_CHARS.search(text) and not GLOB_CHARS.search(last_text) and last_text.lower() in text.lower():
+                # Names containing the longer text contain the shorter one too.
+                within = self.last[2]
+        if within is None:
+            rows = list(compress(range(len(self.lower)), map(test, self.lower)))
+        else:
+            rows = list(compress(within, map(test, map(self.lower.__getitem__, within))))
+        self.last = (mode, text, rows)
+        return rows
@@ -0,0 +1,58 @@
+"""
+Content hashes of files.
+
+Files are hashed with SHA-256, reading large files through a memory map so their
+pages go straight from the page cache into the digest. hashlib releases the GIL
+while it digests, so hash_files() hashes on every core from a thread pool.
+"""
+
+import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Union
+
+WORKERS = 8
+# Files from this size on are memory mapped instead of read.
+MMAP_SIZE = 1 << 20
+# Hex digits of the hash used by the {hash} token.
+HASH_LENGTH = 16
+
+PathLike = Union[Path, str]
+
+
+def hash_file(path: PathLike) -> str:
+    """
+    The SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if hasattr(data, 'madvise'):
+                    data.madvise(mmap.MADV_SEQUENTIAL)
+                digest.update(data)
+        else:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def hash_files(paths: Sequence[PathLike], workers: int = WORKERS,
+               cancelled: Optional[Callable[[], bool]] = None) -> list[Optional[str]]:
+    """
+    The digest of each path, in order, or None for files that could not be read.
+    """
+    def digest(path: PathLike) -> Optional[str]:
+        if cancelled is not None and cancelled():
+            return None
+        try:
+            return hash_file(path)
+        except (OSError, ValueError):
+            return None
+
+    if len(paths) <= 1:
+        return [digest(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(digest, paths))
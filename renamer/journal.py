@@ -0,0 +1,309 @@
+"""
+Append-only journal of rename batches.
+
+Each batch is one JSON Lines file. The plan, one [source, target] line per rename,
+is written and fsynced before anything is renamed. Failures and an end record are
+appended once the batch finishes, so a file without an end record is a batch that
+was interrupted. Any batch can be undone by replaying it in reverse.
+"""
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+from pathlib import Path
+
+from . import profile
+from .executor import Pair, PathLike, RenameReport
+from .planner import RenamePlan, check_plan, execute_plan
+from .settings import data_dir
+
+# Journals of this many batches are kept, older finished ones are pruned.
+KEEP = 100
+# Plan lines are written in blocks of this many and fsynced once the whole plan is down.
+BLOCK = 50_000
+
+
+@dataclass
+class BatchInfo:
+    id: str
+    path: Path
+    count: int
+    started: float
+    complete: bool
+    undone: bool
+    undo_of: Optional[str] = None
+
+
+class JournalBatch:
+    """
+    The journal file of one batch that is being executed. A batch can be planned
+    in one go or chunk by chunk, each chunk synced before it is executed.
+    """
+    def __init__(self, path: Path, count: Optional[int] = None, undo_of: Optional[str] = None) -> None:
+        self.path = path
+        self.id = path.stem
+        self.count = 0
+        self.file = open(path, 'a', encoding='utf-8')
+        self.write({'batch': self.id, 'started': time.time(), 'count': count, 'cwd': os.getcwd(),
+                    'undo_of': undo_of})
+
+    def plan(self, pairs: Iterable[Pair]) -> None:
+        """
+        Appends renames to the plan and syncs them to disk.
+        """
+        with profile.span('journal'):
+            dumps = json.dumps
+            lines = []
+            for source, target in pairs:
+                lines.append(dumps([os.fspath(source), os.fspath(target)]))
+                if len(lines) >= BLOCK:
+                    self.file.write('\n'.join(lines) + '\n')
+                    self.count += len(lines)
+                    lines = []
+            if lines:
+                self.file.write('\n'.join(lines) + '\n')
+                self.count += len(lines)
+            self.sync()
+
+    def write(self, record) -> None:
+        self.file.write(json.dumps(record) + '\n')
+
+    def sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def second_phase(self) -> None:
+        """
+        Records that the first phase of everything planned so far has completed.
+        """
+        self.write({'phase': 2})
+        self.sync()
+
+    def failed(self, sources: Iterable[str]) -> None:
+        """
+        Records the sources of planned renames that did not take effect.
+        """
+        for source in sources:
+            self.write({'failed': source})
+
+    def finish(self) -> None:
+        self.write({'end': time.time(), 'count': self.count})
+        self.sync()
+        self.file.close()
+
+
+class Journal:
+    """
+    The set of batch journals kept in one directory.
+    """
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = Path(directory) if directory else data_dir() / 'journal'
+
+    def open(self, count: Optional[int] = None, undo_of: Optional[str] = None) -> JournalBatch:
+        """
+        Starts a new, still empty batch.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        batch_id = f'{time.time_ns()}-{os.getpid()}'
+        return JournalBatch(self.directory / f'{batch_id}.jsonl', count, undo_of)
+
+    def begin(self, pairs: Iterable[Pair], undo_of: Optional[str] = None) -> JournalBatch:
+        """
+        Writes the plan of a new batch to disk before it is executed.
+        """
+        pairs = list(pairs)
+        batch = self.open(len(pairs), undo_of)
+        batch.plan(pairs)
+        return batch
+
+    def run(self, pairs: Iterable[Pair], existing: Optional[Iterable[PathLike]] = None,
+            **kwargs) -> RenameReport:
+        """
+        Checks, journals and executes a batch of renames. Keyword arguments go to execute_renames.
+        """
+        return self.run_plan(check_plan(pairs, existing), **kwargs)
+
+    def run_plan(self, plan: RenamePlan, undo_of: Optional[str] = None, **kwargs) -> RenameReport:
+        """
+        Journals every step of a checked plan, then executes it.
+        """
+        batch = self.begin(plan.steps(), undo_of)
+        try:
+            report, undone = execute_plan(plan, between=batch.second_phase, **kwargs)
+            batch.failed(undone)
+        finally:
+            batch.finish()
+        self.prune()
+        return report
+
+    def batches(self) -> list[BatchInfo]:
+        """
+        All journalled batches, oldest first.
+        """
+        if not self.directory.is_dir():
+            return []
+        batches = []
+        for path in sorted(self.directory.glob('*.jsonl')):
+            try:
+                batches.append(self.info(path))
+            except (ValueError, KeyError):
+                # Torn header: the crash came before the plan was synced, nothing was renamed.
+                continue
+        return batches
+
+    def info(self, path: Path) -> BatchInfo:
+        with open(path, encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        count = header['count']
+        complete = undone = False
+        for record in _tail_records(path):
+            if isinstance(record, dict):
+                complete = complete or 'end' in record
+                undone = undone or 'undone' in record
+                count = record.get('count', count)
+        return BatchInfo(path.stem, path, count or 0, header['started'], complete, undone, header.get('undo_of'))
+
+    def incomplete(self) -> list[BatchInfo]:
+        """
+        Batches that were interrupted before they finished and have not been dealt with.
+        """
+        return [info for info in self.batches() if not info.complete and not info.undone]
+
+    def last(self) -> Optional[BatchInfo]:
+        """
+        The most recent batch that has not been undone yet. Undo batches themselves are
+        skipped, so undoing repeatedly walks further back in time.
+        """
+        for info in reversed(self.batches()):
+            if not info.undone and not info.undo_of:
+                return info
+        return None
+
+    def close(self, batch_id: str) -> None:
+        """
+        Marks an interrupted batch as dealt with without undoing it.
+        """
+        _append(self.directory / f'{batch_id}.jsonl', {'end': time.time(), 'interrupted': True})
+
+    def undo(self, batch_id: str, **kwargs) -> RenameReport:
+        """
+        Moves every file of a batch back to where it started. The reverse renames are
+        checked and journalled like any other batch, so swaps and chains undo in parallel.
+        For an interrupted batch only the renames that are visible on disk are reverted.
+        Keyword arguments go to execute_renames.
+        """
+        path = self.directory / f'{batch_id}.jsonl'
+        pairs = [(current, source) for source, current in _journeys(path)]
+        # Files moved out of a folder that has since been removed get it back.
+        report = self.run_plan(check_plan(pairs, folders=True), undo_of=batch_id, **kwargs)
+        _append(path, {'undone': time.time(), 'renamed': report.renamed})
+        return report
+
+    def prune(self, keep: int = KEEP) -> None:
+        """
+        Removes the oldest finished journals beyond the newest keep batches.
+        """
+        paths = sorted(self.directory.glob('*.jsonl'))
+        for path in paths[:-keep] if keep else paths:
+            try:
+                complete = self.info(path).complete
+            except (ValueError, KeyError):
+                complete = True
+            if complete:
+                path.unlink()
+
+
+def _append(path: Path, record: dict) -> None:
+    """
+    Appends and syncs one record, starting a fresh line if the file ends in a torn one.
+    """
+    with open(path, 'ab+') as f:
+        f.seek(0, os.SEEK_END)
+        torn = False
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b'\n'
+        f.write((b'\n' if torn else b'') + json.dumps(record).encode() + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read(path: Path) -> tuple[list[tuple[str, str]], set[str], bool, int]:
+    """
+    Reads a journal into its steps, the failed step sources, whether it finished and
+    how many of its steps were planned before the last second phase began.
+    """
+    steps = []
+    failed = set()
+    complete = False
+    second_phase = 0
+    with open(path, encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line torn by a crash mid-write.
+                continue
+            if isinstance(record, list):
+                steps.append(tuple(record))
+            elif 'failed' in record:
+                failed.add(record['failed'])
+            elif 'phase' in record:
+                second_phase = len(steps)
+            elif 'end' in record:
+                # Interrupted batches that were closed still need checking against the disk.
+                complete = not record.get('interrupted')
+    return steps, failed, complete, second_phase
+
+
+def _journeys(path: Path) -> Iterator[tuple[str, str]]:
+    """
+    Yields (source, current) for every file a batch moved, following renames through
+    temporary names. Interrupted batches are checked against the disk.
+    """
+    steps, failed, complete, second_phase = _read(path)
+    finals = {}
+    targets = set()
+    first = []
+    for n, (source, target) in enumerate(steps):
+        if source in targets:
+            finals[source] = target
+        else:
+            first.append((n, source, target))
+        targets.add(target)
+
+    lexists = os.path.lexists
+    for n, source, target in first:
+        if source in failed:
+            continue
+        if target in finals:
+            temp, final = target, finals[target]
+            if temp in failed or (not complete and n >= second_phase):
+                current = temp if lexists(temp) else None
+            elif complete:
+                current = final
+            else:
+                current = temp if lexists(temp) else final
+        elif complete or lexists(target) and not lexists(source):
+            current = target
+        else:
+            current = None
+        if current is not None:
+            yield source, current
+
+
+def _tail_records(path: Path, size: int = 4096) -> list:
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        lines = f.read().splitlines()[1:]
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            pass
+    return records
@@ -1,57 +1,190 @@
 # cspell: ignore unpolish
 
+import argparse
+import bisect
 import os
-import re
+import sqlite3
 import sys
-import time
-from typing import Union
+from typing import Callable, Optional, Sequence, Union
 from pathlib import Path
 
-from PySide6.QtCore import QDir, QModelIndex, Slot, Qt, Signal
-from PySide6.QtGui import QStandardItem, QStandardItemModel
+from PySide6.QtCore import QDir, QFileSystemWatcher, QModelIndex, QThread, QTimer, Slot, Qt, Signal
 from PySide6.QtWidgets import (QAbstractItemView, QApplication, QCheckBox, QComboBox,
-                               QFileSystemModel, QFrame, QGridLayout, QHBoxLayout,
-                               QLabel, QLineEdit, QMainWindow, QMessageBox, QPushButton, QSpinBox, QTableView,
-                               QToolButton, QTreeView, QWidget)
+                               QFileSystemModel, QFrame, QGridLayout, QHBoxLayout, QHeaderView,
+                               QInputDialog, QLabel, QLineEdit, QMainWindow, QMessageBox, QPushButton, QSpinBox, QTableView,
+                               QToolButton, QTreeView, QVBoxLayout, QWidget)
 
+from . import profile
+from .engine import CASES, CROP_POSITIONS, PatternError, PreviewCache, RenameSpec, compile_spec
+from .executor import RenameReport
+from .journal import Journal
+from .metadata import MetadataCache, extract
+from .planner import check_plan
+from .filtering import FilterError
+from .model import FilesModel, FilterProxy, RowRanges, format_mtime
+from .presets import Presets
+from .profile import profiler
+from .scan import scan_changes
+from .snapshots import SnapshotCache, cached_chunks
 
-def files(path: str, parent=None) -> QStandardItemModel:
+STYLE = Path(__file__).with_name('style.qss')
+# Milliseconds to wait for a burst of filesystem events to settle before syncing the listing.
+SYNC_DELAY = 250
+# Milliseconds of typing pause before the filter is applied.
+FILTER_DELAY = 100
+# Previews of fewer rows run at once; larger ones wait for a pause in typing of
+# PREVIEW_DELAY milliseconds and run on a worker thread.
+PREVIEW_ROWS = 5000
+PREVIEW_DELAY = 150
+FILTER_MODES = [('Glob', 'glob'), ('Regex', 'regex'), ('Extension', 'ext')]
+
+
+def files(path: str, parent=None) -> FilesModel:
     """
     Creates a model listing for the files in a directory.
     These include the current file name, the new name (for use with RenameBox),
     the file type and the last modified date / time.
     """
-    model = QStandardItemModel(parent)
-    model.setHorizontalHeaderLabels(['Name', 'New Name', 'Type', 'Modified'])
-    model.setColumnCount(4)
-    path = Path(path)
-    for row, child in enumerate(path.iterdir()):
-        name = QStandardItem(str(child.stem))
-        new_name = QStandardItem(str(child.stem))
-        if child.is_dir():
-            ext = QStandardItem('File Folder')
-        else:
-            ext = QStandardItem(str(child.suffix))
-        modified = QStandardItem(format_time(child))
-        ext.setTextAlignment(Qt.AlignCenter)
-        modified.setTextAlignment(Qt.AlignCenter)
-        row_data = [name, new_name, ext, modified]
-        for col, item in enumerate(row_data):
-            item.setEditable(False)
-            model.setItem(row, col, item)
+    model = FilesModel(parent)
+    cache = SnapshotCache()
+    try:
+        with profile.span('files'):
+            for chunk in cached_chunks(path, cache):
+                model.append_chunk(chunk)
+    finally:
+        cache.close()
     return model
 
 
+class DirectoryScanner(QThread):
+    """
+    Scans a directory on a worker thread, streaming chunks of entries for a FilesModel.
+    An unchanged directory is listed from its saved snapshot instead.
+    """
+    chunk = Signal(object)
+    progress = Signal(int)
+    failed = Signal(str)
+
+    def __init__(self, path: str, parent=None) -> None:
+        super().__init__(parent)
+        self.path = path
+        self.count = 0
+        self.error = None
+
+    def run(self) -> None:
+        cache = SnapshotCache()
+        try:
+            with profile.span('scan'):
+                for chunk in cached_chunks(self.path, cache, cancelled=self.isInterruptionRequested):
+                    if self.isInterruptionRequested():
+                        return
+                    self.count += len(chunk[0])
+                    self.chunk.emit(chunk)
+                    self.progress.emit(self.count)
+        except (OSError, sqlite3.Error) as e:
+            self.error = str(e)
+            self.failed.emit(self.error)
+        finally:
+            cache.close()
+
+
+class DirectorySync(QThread):
+    """
+    Works out on a worker thread how a directory differs from the names already
+    listed for it: the entries that were added and the names that are gone.
+    """
+    def __init__(self, path: str, known: set[str], model: FilesModel, parent=None) -> None:
+        super().__init__(parent)
+        self.path = path
+        self.known = known
+        self.model = model
+        self.added = []
+        self.gone = set()
+        self.error = None
+
+    def run(self) -> None:
+        try:
+            with profile.span('sync', known=len(self.known)):
+                self.added, self.gone = scan_changes(self.path, self.known)
+        except OSError as e:
+            self.error = str(e)
+
+
+class MetadataLoader(QThread):
+    """
+    Reads the token metadata of files on a worker thread, through the on-disk cache.
+    With hashes the content of the files is hashed as well.
+    """
+    def __init__(self, path: Path, filenames: list[str], hashes: bool = False, parent=None) -> None:
+        super().__init__(parent)
+        self.path = path
+        self.filenames = filenames
+        self.hashes = hashes
+        self.results = {}
+
+    def run(self) -> None:
+        cache = MetadataCache()
+        try:
+            with profile.span('metadata', files=len(self.filenames)):
+                found = extract([self.path / name for name in self.filenames], cache=cache,
+                                cancelled=self.isInterruptionRequested, hashes=self.hashes)
+        finally:
+            cache.close()
+        if not self.isInterruptionRequested():
+            if self.hashes:
+                # Files that could not be hashed are not asked for again.
+                for metadata in found:
+                    metadata.setdefault('hash', '')
+            self.results = dict(zip(self.filenames, found))
+
+
+class PreviewWorker(QThread):
+    """
+    Works out the new names of a preview on a worker thread. The rows on screen are
+    worked out first and sent through shown; the rest is in new_names (or error) once
+    the thread finishes. Gives up, leaving new_names None, once cancelled() is true.
+    """
+    shown = Signal(object, object)
+
+    def __init__(self, cache: PreviewCache, spec: RenameSpec, rows: Sequence[int], originals: list[str],
+                 metadata: Optional[list[dict]], visible: Sequence[int], cancelled: Callable[[], bool],
+                 parent=None) -> None:
+        super().__init__(parent)
+        self.cache = cache
+        self.spec = spec
+        self.rows = rows
+        self.originals = originals
+        self.metadata = metadata
+        self.visible = visible
+        self.cancelled = cancelled
+        self.new_names = None
+        self.error = None
+
+    def run(self) -> None:
+        with profile.span('preview_worker', rows=len(self.rows)):
+            try:
+                self.show_visible()
+                self.new_names = self.cache.apply(self.spec, self.originals, self.metadata, self.cancelled)
+            except PatternError as e:
+                self.error = e
+
+    def show_visible(self) -> None:
+        # rows ascend, and so do the visible rows, which are next to each other in the table.
+        if not self.visible:
+            return
+        start = bisect.bisect_left(self.rows, self.visible[0])
+        stop = bisect.bisect_right(self.rows, self.visible[-1])
+        if start < stop and not self.cancelled():
+            metadata = self.metadata[start:stop] if self.metadata else None
+            names = compile_spec(self.spec).apply(self.originals[start:stop], start, metadata)
+            self.shown.emit(self.rows[start:stop], names)
+
+
 def format_time(path: Union[Path, str]) -> str:
     """
     Takes a path and returns the last modified time in m/d/YYYY H:mm:ss AM/PM format
     """
-    mod = os.path.getmtime(path)
-    formatted = time.localtime(mod)
-    clean = time.strftime('%m/%d/%Y %I:%M:%S %p', formatted).replace('/0', '/')
-    if clean.startswith('0'):
-        return clean[1:]
-    return clean
+    return format_mtime(os.path.getmtime(path))
 
 
 def blank_spinbox(parent=None) -> QSpinBox:
@@ -64,12 +197,12 @@ def blank_spinbox(parent=None) -> QSpinBox:
     return spin
 
 
-def directory_table(model: QStandardItemModel, parent=None) -> QTableView:
+def directory_table(model: FilesModel, parent=None) -> QTableView:
     """
-    Creates a new QTableView from a "files" model.
+    Creates a new QTableView from a "files" model, shown through a FilterProxy.
     """
     table = QTableView(parent)
-    table.setModel(model)
+    table.setModel(FilterProxy(model, table))
     table.setShowGrid(False)
     table.verticalHeader().hide()
     table.setSelectionBehavior(QAbstractItemView.SelectRows)
@@ -79,11 +212,66 @@ def directory_table(model: QStandardItemModel, parent=None) -> QTableView:
     table.setColumnWidth(2, 75)
     table.setColumnWidth(3, 175)
     table.setFixedSize(1050, 400)
-    table.resizeRowsToContents()
+    # Uniform row heights so the view never has to measure every row.
+    table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+    table.verticalHeader().setDefaultSectionSize(table.fontMetrics().height() + 6)
 
     return table
 
 
+class FilterBar(QHBoxLayout):
+    """
+    Filter above the file table: a glob, regular expression or list of extensions,
+    and whether to rename every matching row rather than the selected ones.
+    """
+    changed = Signal(str, str)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.entry = QLineEdit()
+        self.entry.setPlaceholderText('Filter, e.g. *.jpg')
+        self.entry.setClearButtonEnabled(True)
+        self.mode = QComboBox()
+        self.mode.addItems([title for title, _ in FILTER_MODES])
+        self.all_matching = QCheckBox('Rename all matching')
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(FILTER_DELAY)
+        self.timer.timeout.connect(self.apply)
+        self.entry.textChanged.connect(self.timer.start)
+        self.mode.currentIndexChanged.connect(self.apply)
+        self.addWidget(QLabel('Filter:'))
+        self.addWidget(self.entry)
+        self.addWidget(self.mode)
+        self.addWidget(self.all_matching)
+
+    def filter(self) -> tuple[str, str]:
+        return self.entry.text(), FILTER_MODES[self.mode.currentIndex()][1]
+
+    @Slot()
+    def apply(self):
+        self.timer.stop()
+        self.changed.emit(*self.filter())
+
+
+class RenameWorker(QThread):
+    """
+    Runs a rename job on a worker thread. The job is called with a progress
+    callback and returns the RenameReport of the batch.
+    """
+    progress = Signal(object)
+
+    def __init__(self, job: Callable[..., RenameReport], total: int, parent=None) -> None:
+        super().__init__(parent)
+        self.job = job
+        self.total = total
+        self.report = None
+
+    def run(self) -> None:
+        with profile.span('rename_job', total=self.total):
+            self.report = self.job(progress=self.progress.emit)
+
+
 class RenameBox(QFrame):
     change_signal = Signal(bool)
     """
@@ -163,40 +351,83 @@ class RenameBox(QFrame):
 
 class RenameOptions(QGridLayout):
     change_signal = Signal(bool)
+    status = Signal(str)
 
-    def __init__(self, model: QStandardItemModel, view: QTableView, path: str, parent=None) -> None:
+    def __init__(self, model: FilesModel, view: QTableView, path: str, parent=None) -> None:
         super().__init__(parent)
         self.path = Path(path)
         self.model = model
         self.view = view
+        self.preview_cache = PreviewCache()
+        self.pattern_error = False
+        self.worker = None
+        # {old file name: new file name} of the batch being renamed, to update the rows in place after,
+        # and the file names moved out of the folder, whose rows go.
+        self.renames = None
+        self.moved = set()
+        # Token metadata by file name, filled in by a MetadataLoader when the boxes use tokens.
+        self.metadata = {}
+        self.metadata_loader = None
+        # Rename every row matching the filter instead of the selected rows.
+        self.all_matching = False
+        self.journal = Journal()
+        # Bumped by every change the preview depends on; a preview started before is stale.
+        self.generation = 0
+        self.preview_worker = None
+        # Rows on screen given new names ahead of the rest of their preview.
+        self.shown_early = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.preview_timer.timeout.connect(self.start_preview)
         self.selection()
         self.reset = QPushButton('Reset')
         self.reset.clicked.connect(self.reset_all)
         self.rename = QPushButton('Rename')
         self.rename.clicked.connect(self.finalize)
-        for btn in [self.reset, self.rename]:
+        self.undo = QPushButton('Undo')
+        self.undo.clicked.connect(self.undo_last)
+        for btn in [self.reset, self.rename, self.undo]:
             btn.setFixedWidth(50)
 
+        self.presets = Presets()
+        self.preset_select = QComboBox()
+        self.preset_select.setPlaceholderText('Preset')
+        self.preset_select.addItems(self.presets.names())
+        self.preset_select.setCurrentIndex(-1)
+        self.preset_select.activated.connect(lambda index: self.load_preset(self.preset_select.itemText(index)))
+        self.preset_save = QPushButton('Save')
+        self.preset_save.clicked.connect(self.ask_preset_name)
+        self.preset_delete = QPushButton('Delete')
+        self.preset_delete.clicked.connect(self.delete_preset)
+        preset_buttons = QHBoxLayout()
+        preset_buttons.addWidget(self.preset_save)
+        preset_buttons.addWidget(self.preset_delete)
+
         self.name_entry = QLineEdit()
         self.name_box = RenameBox('Name', [self.name_entry])
         self.name_entry.textChanged.connect(lambda: self.changed(self.name_box))
 
         self.replace_entry_search = QLineEdit()
         self.replace_entry_text = QLineEdit()
+        self.replace_regex = QCheckBox()
         self.replace_box = RenameBox('Replace',
-                                     [self.replace_entry_search, self.replace_entry_text],
-                                     ['Replace', 'With'])
+                                     [self.replace_entry_search, self.replace_entry_text, self.replace_regex],
+                                     ['Replace', 'With', 'Regex'])
         self.replace_entry_search.textChanged.connect(lambda: self.changed(self.replace_box))
         self.replace_entry_text.textChanged.connect(lambda: self.changed(self.replace_box))
+        self.replace_regex.stateChanged.connect(lambda: self.changed(self.replace_box))
 
         self.case_select = QComboBox()
         self.case_select.addItems(['Same', 'Upper', 'Lower', 'Title', 'Sentence'])
         self.case_select.setEditable(False)
         self.case_except = QLineEdit()
-        self.case_box = RenameBox('Case', [self.case_select, self.case_except],
-                                  ['', 'Except'])
+        self.case_regex = QCheckBox()
+        self.case_box = RenameBox('Case', [self.case_select, self.case_except, self.case_regex],
+                                  ['', 'Except', 'Regex'])
         self.case_select.currentIndexChanged.connect(lambda: self.changed(self.case_box))
         self.case_except.textChanged.connect(lambda: self.changed(self.case_box))
+        self.case_regex.stateChanged.connect(lambda: self.changed(self.case_box))
 
         self.add_prefix = QLineEdit()
         self.add_insert = QLineEdit()
@@ -221,10 +452,11 @@ class RenameOptions(QGridLayout):
         self.remove_crop_pos.addItems(['Before', 'After'])
         self.remove_crop_pos.setEditable(False)
         self.remove_crop = QLineEdit()
+        self.remove_regex = QCheckBox()
         self.remove_box = RenameBox('Remove',
                                     [self.remove_first, self.remove_from,
-                                     self.remove_chars, self.remove_crop_pos],
-                                    ['First', 'From', 'Chars', 'Crop'],
+                                     self.remove_chars, self.remove_crop_pos, self.remove_regex],
+                                    ['First', 'From', 'Chars', 'Crop', 'Regex'],
                                     [self.remove_last, self.remove_to,
                                      self.remove_words, self.remove_crop],
                                     ['Last', 'To', 'Words', ''])
@@ -234,6 +466,7 @@ class RenameOptions(QGridLayout):
         for widget in [self.remove_chars, self.remove_words, self.remove_crop]:
             widget.textChanged.connect(lambda: self.changed(self.remove_box))
         self.remove_crop_pos.currentIndexChanged.connect(lambda: self.changed(self.remove_box))
+        self.remove_regex.stateChanged.connect(lambda: self.changed(self.remove_box))
 
         self.num_prefix = QCheckBox()
         self.num_suffix = QCheckBox()
@@ -258,8 +491,14 @@ class RenameOptions(QGridLayout):
             widget.valueChanged.connect(lambda: self.changed(self.num_box))
         self.num_sep.textChanged.connect(lambda: self.changed(self.num_box))
 
-        for box in [self.name_box, self.replace_box, self.case_box,
-                    self.add_box, self.remove_box, self.num_box]:
+        self.move_to = QLineEdit()
+        self.move_to.setPlaceholderText('e.g. sorted/{date}')
+        self.move_box = RenameBox('Move', [self.move_to], ['To'])
+        self.move_to.textChanged.connect(lambda: self.changed(self.move_box))
+
+        self.boxes = [self.name_box, self.replace_box, self.case_box,
+                      self.add_box, self.remove_box, self.num_box, self.move_box]
+        for box in self.boxes:
             box.change_signal.connect(self.preview_changes)
 
         self.addWidget(self.name_box,    0, 0)
@@ -268,8 +507,13 @@ class RenameOptions(QGridLayout):
         self.addWidget(self.add_box,     0, 1, 2, 1)
         self.addWidget(self.remove_box,  0, 2, 2, 1)
         self.addWidget(self.num_box,     0, 3, 2, 1)
-        self.addWidget(self.reset,       2, 3, Qt.AlignRight)
-        self.addWidget(self.rename,      3, 3, Qt.AlignRight)
+        buttons = QVBoxLayout()
+        for btn in [self.undo, self.reset, self.rename]:
+            buttons.addWidget(btn, alignment=Qt.AlignRight)
+        self.addWidget(self.preset_select, 2, 1)
+        self.addLayout(preset_buttons,   3, 1)
+        self.addWidget(self.move_box,    2, 2, 2, 1)
+        self.addLayout(buttons,          2, 3, 2, 1)
         self.setColumnStretch(0, 1)
         self.setColumnStretch(1, 1)
         self.setColumnStretch(2, 0)
@@ -277,117 +521,453 @@ class RenameOptions(QGridLayout):
 
     def selection(self):
         selection_model = self.view.selectionModel()
-        selection_model.selectionChanged.connect(self.preview_changes)
+        selection_model.selectionChanged.connect(self.selection_changed)
+        # Filtering drops hidden rows from the selection, or changes the matching rows.
+        self.view.model().filtered.connect(self.preview_changes)
+        # Sorting moves rows around, so the previewed rows are no longer known.
+        self.model.layoutChanged.connect(self.forget_preview)
+        # So do rows added or removed by syncing with the directory and by moves.
+        self.model.rowsInserted.connect(self.forget_preview)
+        self.model.rowsRemoved.connect(self.forget_preview)
+        self.model.dataChanged.connect(self.names_changed)
+        self.forget_preview()
+
+    def forget_preview(self):
+        running = self.preview_worker is not None
+        self.cancel_preview()
+        # The model rows of the last preview, in table order; finalize renames exactly these.
+        self.previewed = None
+        self.shown_early = None
+        self.preview_cache.clear()
+        if running:
+            # It was previewing the rows as they were.
+            self.preview_changes()
+
+    @Slot(QModelIndex, QModelIndex)
+    def names_changed(self, top_left, bottom_right):
+        # Entries renamed on disk: their previews were reset with them.
+        if top_left.column() == 0:
+            self.forget_preview()
+
+    @Slot()
+    def selection_changed(self):
+        if not self.all_matching:
+            self.preview_changes()
+
+    @Slot(bool)
+    def set_all_matching(self, state: bool):
+        self.all_matching = state
+        self.preview_changes()
+
+    def target_rows(self) -> Sequence[int]:
+        """
+        The model rows to rename, in table order: every row the filter shows with
+        'Rename all matching' ticked, the selected rows otherwise. Every row of an
+        unfiltered table comes back as a range.
+        """
+        proxy = self.view.model()
+        if self.all_matching:
+            return proxy.matching_rows()
+        # The selection's ranges, not selectedRows(), which builds an index for every selected cell.
+        return proxy.source_ranges(RowRanges.from_selection(self.view.selectionModel().selection()))
 
     def change_dir(self, model, path):
+        self.cancel_preview()
         self.path = Path(path)
         self.model = model
+        self.metadata = {}
         self.selection()
 
     def reset_all(self):
-        for box in [self.name_box, self.replace_box, self.case_box,
-                    self.add_box, self.remove_box, self.num_box]:
+        for box in self.boxes:
             box.clear_fields()
-        for index in range(self.model.rowCount()):
-            self.model.item(index, 1).setText(self.model.item(index, 0).text())
+        self.preset_select.setCurrentIndex(-1)
+        self.model.reset_new_names()
 
     def finalize(self):
-        replacements = self.preview_changes()
-        for index in self.view.selectionModel().selectedRows():
-            row = index.row()
-            ext = self.model.item(row, 2).text()
-            original = self.path / f'{self.model.item(row, 0).text()}{ext}'
-            new = self.path / f'{replacements[self.model.item(row, 0).text()]}{ext}'
-            try:
-                original.rename(new)
-            except FileExistsError:
-                error = QMessageBox()
-                error.setIcon(error.Icon.Critical)
-                error.setText(f'Could not rename {original}.\n{new} already exists.\nFile skipped')
-                error.setWindowTitle('Error')
-                error.exec_()
+        if self.worker is not None:
+            return
+        with profile.span('finalize'):
+            # The preview on screen is what gets renamed, unless the rows moved since or a
+            # large preview has yet to catch up with the boxes.
+            if (self.preview_worker is not None or self.preview_timer.isActive()
+                    or self.previewed is None or self.previewed != self.target_rows()):
+                self.preview_now()
+            if self.metadata_loader is not None:
+                self.status.emit('Still reading file metadata, rename again in a moment')
+                return
+            if self.pattern_error:
+                return
+            model = self.model
+            rows = self.previewed
+            destination = compile_spec(self.spec()).destination
+            # Only names are read here; the paths and the plan are worked out on the worker thread.
+            sources = [model.filename(row) for row in rows]
+            targets = [model.new_filename(row) for row in rows]
+            if destination is None:
+                changed = [(source, target) for source, target in zip(sources, targets) if source != target]
+                if not changed:
+                    return
+                filenames = model.filenames()
+            else:
+                # Read by the preview already.
+                metadata = self.row_metadata(rows) if destination.uses_metadata else None
+                names = [model.names[row] for row in rows]
+        path = self.path
+
+        def job(progress):
+            if destination is None:
+                base = os.path.join(path, '')
+                pairs = [(base + source, base + target) for source, target in changed]
+                # Checked against the whole listing up front, so clashes never reach the disk.
+                existing = [base + filename for filename in filenames]
+            else:
+                folders = destination.folders(path, names, metadata)
+                pairs = [(path / source, folder / target) for source, target, folder in zip(sources, targets, folders)
+                         if folder != path or source != target]
+                # Other folders are not listed, their targets are looked up on disk.
+                existing = None
+            plan = check_plan(pairs, existing, folders=destination is not None)
+            # Read by rename_finished once the worker is done.
+            self.renames = {source.name: target.name for source, target in plan.pairs() if target.parent == path}
+            self.moved = {source.name for source, target in plan.pairs() if target.parent != path}
+            return self.journal.run_plan(plan, progress=progress)
+        self.start_worker(job, len(changed) if destination is None else len(rows))
+
+    def undo_last(self):
+        if self.worker is not None:
+            return
+        batch = self.journal.last()
+        if batch is None:
+            self.status.emit('Nothing to undo')
+            return
+        self.start_worker(lambda progress: self.journal.undo(batch.id, progress=progress), batch.count)
+
+    def start_worker(self, job, total):
+        for btn in [self.rename, self.undo]:
+            btn.setEnabled(False)
+        self.worker = RenameWorker(job, total, self)
+        self.worker.progress.connect(self.rename_progress)
+        self.worker.finished.connect(self.rename_finished)
+        self.worker.start()
+
+    @Slot(object)
+    def rename_progress(self, report):
+        self.status.emit(f'Renaming... {report.renamed + len(report.failed)} of {self.worker.total}')
+
+    @Slot()
+    def rename_finished(self):
+        worker, self.worker = self.worker, None
+        renames, self.renames = self.renames, None
+        worker.deleteLater()
+        for btn in [self.rename, self.undo]:
+            btn.setEnabled(True)
+        report = worker.report
+        if renames is not None:
+            failed = {Path(source).name for source, _, _ in report.failed}
+            for name in failed:
+                renames.pop(name, None)
+            self.model.rename_entries(renames)
+            # Metadata moves with its file, and names freed by a swap must not keep their old values.
+            moved = {renames[name]: self.metadata.pop(name) for name in list(renames) if name in self.metadata}
+            self.metadata.update(moved)
+            gone = self.moved - failed
+            self.model.remove_entries(gone)
+            for name in gone:
+                self.metadata.pop(name, None)
+            self.moved = set()
+        else:
+            self.metadata = {}
+        self.status.emit(report.summary())
+        if report.failed:
+            error = QMessageBox()
+            error.setIcon(error.Icon.Warning)
+            error.setText(f'{len(report.failed)} of {report.total} files could not be renamed and were skipped.')
+            error.setDetailedText(report.failures())
+            error.setWindowTitle('Error')
+            error.exec_()
         self.change_signal.emit(True)
         self.reset_all()
 
-    def preview_changes(self) -> dict[str, str]:
-        replacements = {}
-
-        # Values for auto-numbering
-        sep = self.num_sep.text()
-        pad = self.num_pad.value()
-        start = self.num_start.value()
-        incr = self.num_incr.value()
-        for row in range(self.model.rowCount()):
-            self.model.item(row, 1).setText(self.model.item(row, 0).text())
-
-        for index in self.view.selectionModel().selectedRows():
-            row = index.row()
-            original = self.model.item(row, 0).text()
-            new_text = self.model.item(row, 1).text()
-
-            if self.name_box.property('changed'):
-                new_text = self.name_entry.text()
-
-            if self.replace_box.property('changed'):
-                new_text = new_text.replace(self.replace_entry_search.text(), self.replace_entry_text.text())
-
-            if self.case_box.property('changed'):
-                cases = [str.upper, str.lower, str.title, str.capitalize]
-                index = self.case_select.currentIndex() - 1
-                case = cases[index]
-                exceptions = self.case_except.text()
-                exception_locs = [m.start() for m in re.finditer(exceptions, new_text)]
-                exceptions_len = len(exceptions)
-                new_text = case(new_text)
-                for loc in exception_locs:
-                    new_text = new_text[:loc] + exceptions + new_text[loc + exceptions_len:]
-
-            if self.add_box.property('changed'):
-                new_text = self.add_prefix.text() + new_text
-                if self.add_insert_pos.value():
-                    new_text = (new_text[:self.add_insert_pos.value()] +
-                                self.add_insert.text() +
-                                new_text[self.add_insert_pos.value():])
-                new_text += self.add_suffix.text()
-
-            if self.remove_box.property('changed'):
-                if self.remove_first.value():
-                    new_text = new_text[self.remove_first.value():]
-                if self.remove_last.value():
-                    new_text = new_text[:-self.remove_last.value()]
-                if self.remove_from.value():
-                    new_text = (new_text[:self.remove_from.value()] +
-                                new_text[self.remove_to.value() + 1:])
-                for char in self.remove_chars.text():
-                    new_text = new_text.replace(char, '')
-                for word in self.remove_words.text().split():
-                    new_text = new_text.replace(word, '')
-                if self.remove_crop.text():
-                    pos = new_text.find(self.remove_crop.text())
-                    if self.remove_crop_pos.currentText() == 'Before':
-                        new_text = new_text[pos:]
-                    else:
-                        new_text = new_text[:pos + len(self.remove_crop.text())]
-
-            if self.num_box.property('changed'):
-                if self.num_prefix.isChecked():
-                    new_text = f'{start:0>{pad}}{sep}{new_text}'
-                if self.num_suffix.isChecked():
-                    new_text = f'{new_text}{sep}{start:0>{pad}}'
-                if self.num_insert.isChecked() and self.num_pos.value() > 0:
-                    pos = self.num_pos.value()
-                    new_text = f'{new_text[:pos]}{sep}{start:0>{pad}}{sep}{new_text[pos:]}'
-                start += incr
-
-            self.model.item(row, 1).setText(new_text)
-
-            replacements[original] = new_text
-
-        return replacements
+    def spec(self) -> RenameSpec:
+        """
+        Reads the rename boxes that have been changed into a RenameSpec.
+        """
+        spec = RenameSpec()
+        if self.name_box.property('changed'):
+            spec.name = self.name_entry.text()
+        if self.replace_box.property('changed'):
+            spec.replace_search = self.replace_entry_search.text()
+            spec.replace_with = self.replace_entry_text.text()
+            spec.replace_regex = self.replace_regex.isChecked()
+        if self.case_box.property('changed'):
+            spec.case = CASES[self.case_select.currentIndex()]
+            spec.case_except = self.case_except.text()
+            spec.case_regex = self.case_regex.isChecked()
+        if self.add_box.property('changed'):
+            spec.add_prefix = self.add_prefix.text()
+            spec.add_insert = self.add_insert.text()
+            spec.add_insert_pos = self.add_insert_pos.value()
+            spec.add_suffix = self.add_suffix.text()
+        if self.remove_box.property('changed'):
+            spec.remove_first = self.remove_first.value()
+            spec.remove_last = self.remove_last.value()
+            spec.remove_from = self.remove_from.value()
+            spec.remove_to = self.remove_to.value()
+            spec.remove_chars = self.remove_chars.text()
+            spec.remove_words = self.remove_words.text()
+            spec.remove_crop_pos = self.remove_crop_pos.currentText().lower()
+            spec.remove_crop = self.remove_crop.text()
+            spec.remove_regex = self.remove_regex.isChecked()
+        if self.num_box.property('changed'):
+            spec.num_prefix = self.num_prefix.isChecked()
+            spec.num_suffix = self.num_suffix.isChecked()
+            spec.num_insert = self.num_insert.isChecked()
+            spec.num_pos = self.num_pos.value()
+            spec.num_start = self.num_start.value()
+            spec.num_incr = self.num_incr.value()
+            spec.num_pad = self.num_pad.value()
+            spec.num_sep = self.num_sep.text()
+        if self.move_box.property('changed'):
+            spec.move_to = self.move_to.text()
+        return spec
+
+    def set_spec(self, spec: RenameSpec) -> None:
+        """
+        Fills every rename box from a spec and previews the result once.
+        """
+        values = [
+            (self.name_entry, spec.name),
+            (self.replace_entry_search, spec.replace_search), (self.replace_entry_text, spec.replace_with),
+            (self.replace_regex, spec.replace_regex),
+            (self.case_select, CASES.index(spec.case)), (self.case_except, spec.case_except),
+            (self.case_regex, spec.case_regex),
+            (self.add_prefix, spec.add_prefix), (self.add_insert, spec.add_insert),
+            (self.add_insert_pos, spec.add_insert_pos), (self.add_suffix, spec.add_suffix),
+            (self.remove_first, spec.remove_first), (self.remove_last, spec.remove_last),
+            (self.remove_from, spec.remove_from), (self.remove_to, spec.remove_to),
+            (self.remove_chars, spec.remove_chars), (self.remove_words, spec.remove_words),
+            (self.remove_crop_pos, CROP_POSITIONS.index(spec.remove_crop_pos)), (self.remove_crop, spec.remove_crop),
+            (self.remove_regex, spec.remove_regex),
+            (self.num_prefix, spec.num_prefix), (self.num_suffix, spec.num_suffix),
+            (self.num_insert, spec.num_insert), (self.num_pos, spec.num_pos), (self.num_start, spec.num_start),
+            (self.num_incr, spec.num_incr), (self.num_pad, spec.num_pad), (self.num_sep, spec.num_sep),
+            (self.move_to, spec.move_to),
+        ]
+        # Every widget would preview on its own otherwise.
+        silenced = [widget for widget, _ in values] + self.boxes
+        for widget in silenced:
+            widget.blockSignals(True)
+        try:
+            for widget, value in values:
+                if isinstance(widget, QLineEdit):
+                    widget.setText(value)
+                elif isinstance(widget, QComboBox):
+                    widget.setCurrentIndex(value)
+                elif isinstance(widget, QSpinBox):
+                    widget.setValue(value)
+                else:  # QCheckBox
+                    widget.setChecked(value)
+            for box in self.boxes:
+                self.changed(box)
+        finally:
+            for widget in silenced:
+                widget.blockSignals(False)
+        self.preview_changes()
+
+    def load_preset(self, name: str) -> None:
+        try:
+            spec = self.presets.load(name)
+        except (OSError, ValueError, TypeError) as e:
+            self.status.emit(f'Could not load preset {name}: {e}')
+            return
+        self.set_spec(spec)
+        self.preset_select.setCurrentText(name)
+
+    def ask_preset_name(self):
+        name, ok = QInputDialog.getText(self.parentWidget(), 'Save preset', 'Preset name:',
+                                        text=self.preset_select.currentText())
+        if ok and name.strip():
+            self.save_preset(name.strip())
+
+    def save_preset(self, name: str) -> None:
+        try:
+            self.presets.save(name, self.spec())
+        except (OSError, ValueError) as e:
+            self.status.emit(f'Could not save preset {name}: {e}')
+            return
+        self.refresh_presets(name)
+        self.status.emit(f'Saved preset {name}')
+
+    def delete_preset(self):
+        name = self.preset_select.currentText()
+        if self.preset_select.currentIndex() < 0 or not name:
+            return
+        self.presets.delete(name)
+        self.refresh_presets()
+
+    def refresh_presets(self, current: str = '') -> None:
+        self.preset_select.clear()
+        self.preset_select.addItems(self.presets.names())
+        self.preset_select.setCurrentIndex(self.preset_select.findText(current))
+
+    @Slot()
+    def preview_changes(self) -> None:
+        """
+        Previews the boxes on the rows to rename: at once for a few rows, otherwise on
+        a worker thread once typing pauses, dropping any preview already running.
+        """
+        self.generation += 1
+        rows = self.target_rows()
+        if len(rows) < PREVIEW_ROWS:
+            self.preview_now(rows)
+        else:
+            self.preview_timer.start()
+
+    def preview_now(self, rows: Optional[Sequence[int]] = None) -> None:
+        """
+        Previews on the GUI thread, replacing any preview waiting or running.
+        """
+        self.cancel_preview()
+        rows = self.target_rows() if rows is None else rows
+        with profile.span('preview_changes', rows=len(rows)):
+            spec, originals, metadata = self.preview_input(rows)
+            try:
+                new_names, error = self.preview_cache.apply(spec, originals, metadata), None
+            except PatternError as e:
+                new_names, error = None, e
+            self.show_preview(rows, originals, new_names, error)
+
+    @Slot()
+    def start_preview(self) -> None:
+        if self.preview_worker is not None:
+            # Started again once the stale one has stopped.
+            return
+        rows = self.target_rows()
+        spec, originals, metadata = self.preview_input(rows)
+        generation = self.generation
+        worker = PreviewWorker(self.preview_cache, spec, rows, originals, metadata, self.visible_rows(),
+                               lambda: self.generation != generation, self)
+        worker.shown.connect(self.show_visible)
+        worker.finished.connect(self.preview_finished)
+        self.preview_worker = worker
+        worker.start()
+
+    def cancel_preview(self) -> None:
+        """
+        Stops a preview that is waiting or running, waiting the moment a running one
+        takes to notice, so that the preview cache is free again.
+        """
+        self.preview_timer.stop()
+        worker, self.preview_worker = self.preview_worker, None
+        if worker is not None:
+            self.generation += 1
+            worker.wait()
+
+    def preview_input(self, rows: Sequence[int]) -> tuple[RenameSpec, list[str], Optional[list[dict]]]:
+        model = self.model
+        if isinstance(rows, range):
+            originals = model.names[rows.start:rows.stop]
+        else:
+            originals = [model.names[row] for row in rows]
+        spec = self.spec()
+        tokens = spec.tokens()
+        metadata = self.row_metadata(rows, 'hash' in tokens) if tokens else None
+        return spec, originals, metadata
+
+    def visible_rows(self) -> list[int]:
+        """
+        The model rows on screen, top to bottom.
+        """
+        proxy = self.view.model()
+        top = self.view.rowAt(0)
+        if top < 0:
+            return []
+        bottom = self.view.rowAt(self.view.viewport().height() - 1)
+        if bottom < 0:
+            bottom = proxy.rowCount() - 1
+        return [proxy.mapToSource(proxy.index(row, 0)).row() for row in range(top, bottom + 1)]
+
+    @Slot(object, object)
+    def show_visible(self, rows, new_names):
+        if self.sender() is self.preview_worker and not self.preview_worker.cancelled():
+            self.model.set_new_names(rows, new_names)
+            self.shown_early = rows
+
+    @Slot()
+    def preview_finished(self):
+        worker = self.sender()
+        worker.deleteLater()
+        if worker is not self.preview_worker:
+            return
+        self.preview_worker = None
+        if worker.cancelled():
+            if not self.preview_timer.isActive():
+                self.start_preview()
+            return
+        with profile.span('preview_changes', rows=len(worker.rows)):
+            self.show_preview(worker.rows, worker.originals, worker.new_names, worker.error)
+
+    def show_preview(self, rows: Sequence[int], originals: list[str], new_names: Optional[list[str]],
+                     error: Optional[PatternError]) -> None:
+        """
+        Puts the new names of a preview in the table.
+        """
+        model = self.model
+        if error is None:
+            if self.pattern_error:
+                self.pattern_error = False
+                self.status.emit('')
+        else:
+            # Show the names unchanged until the pattern is fixed, so nothing half-typed gets renamed.
+            self.pattern_error = True
+            self.status.emit(str(error))
+            new_names = originals
+
+        # Rows that dropped out of the selection go back to their own name.
+        previewed = self.previewed
+        if previewed is None:
+            if len(rows) < model.rowCount():
+                selected = set(rows)
+                model.reset_new_names(row for row in range(model.rowCount()) if row not in selected)
+        elif previewed != rows:
+            model.reset_new_names(set(previewed).difference(rows))
+        if self.shown_early is not None:
+            # Shown by a preview that was dropped before it finished.
+            model.reset_new_names(set(self.shown_early).difference(rows))
+            self.shown_early = None
+        model.set_new_names(rows, new_names)
+        self.previewed = rows
+
+    def row_metadata(self, rows: list[int], hashes: bool = False) -> list[dict]:
+        """
+        The token metadata of rows, with content hashes if hashes. Rows not read yet are
+        read in the background and previewed again once they are in; until then their
+        tokens are empty.
+        """
+        filenames = [self.model.filename(row) for row in rows]
+        metadata = self.metadata
+        missing = [name for name in filenames if name not in metadata or hashes and 'hash' not in metadata[name]]
+        if missing and self.metadata_loader is None:
+            self.status.emit(f'{"Hashing" if hashes else "Reading metadata of"} {len(missing)} files...')
+            self.metadata_loader = MetadataLoader(self.path, missing, hashes, self)
+            self.metadata_loader.finished.connect(self.metadata_finished)
+            self.metadata_loader.start()
+        return [metadata.get(name, {}) for name in filenames]
+
+    @Slot()
+    def metadata_finished(self):
+        loader, self.metadata_loader = self.metadata_loader, None
+        loader.deleteLater()
+        if loader.path == self.path:
+            self.metadata.update(loader.results)
+            self.status.emit('')
+        # After a change of folder this reads the new folder's metadata instead.
+        self.preview_changes()
 
     def changed(self, box):
-        box.setChanged()
-        # Check if widgets are in default state
+        profile.count('box_changes')
+        # The box counts as changed unless every widget is in its default state.
         for widget in box.all:
             if isinstance(widget, QLineEdit) and widget.text():
                 break
@@ -399,29 +979,69 @@ class RenameOptions(QGridLayout):
                 break
         else:
             box.setChanged(False)
+            return
+        box.setChanged()
 
     def min_remove(self):
         if self.remove_to.value() < self.remove_from.value():
             self.remove_to.setValue(self.remove_from.value())
 
 
+class StatsPanel(QLabel):
+    """
+    Shows the profiler's spans and counters, refreshed every second.
+    """
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    @Slot()
+    def refresh(self):
+        summary = profiler.summary()
+        spans = sorted(summary['spans'].items(), key=lambda item: -item[1]['total'])
+        parts = [f'{name} {span["count"]}x {span["total"]:.2f}s' for name, span in spans[:5]]
+        parts += [f'{name} {value}' for name, value in summary['counters'].items()]
+        self.setText(' | '.join(parts) or 'Profiling')
+
+
 class main_window(QMainWindow):
     def __init__(self, path):
         super().__init__()
         self.setWindowTitle('Bulk Rename')
         self.path = str(path)
+        # The root path is only set in start(), once the window is up.
         self.tree_model = QFileSystemModel()
-        self.tree_model.setRootPath(self.path)
         self.tree_model.setFilter(QDir.AllDirs | QDir.NoDotAndDotDot)
-        self.files_model = files(self.path)
+        self.files_model = FilesModel()
+        self.scanner = None
+        self.syncer = None
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_sync)
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(SYNC_DELAY)
+        self.sync_timer.timeout.connect(self.sync_files)
         self.dir_entry = QLineEdit(self.path)
         self.dir_btn = QToolButton()
         self.dir_btn.setArrowType(Qt.RightArrow)
         self.tree = QTreeView()
         self.tree.setModel(self.tree_model)
         self.files = directory_table(self.files_model)
+        self.filter_bar = FilterBar()
         self.rename_opts = RenameOptions(self.files_model, self.files, self.path)
-        self.rename_opts.change_signal.connect(self.update_files)
+        self.filter_bar.changed.connect(self.apply_filter)
+        self.filter_bar.all_matching.toggled.connect(self.rename_opts.set_all_matching)
+        self.rename_opts.change_signal.connect(self.schedule_sync)
+        self.rename_status = QLabel()
+        self.rename_opts.status.connect(self.rename_status.setText)
+        self.statusBar().addPermanentWidget(self.rename_status)
+        self.stats = None
+        if profiler.enabled:
+            self.stats = StatsPanel()
+            self.statusBar().addWidget(self.stats)
 
         # Set tree to only show the directories, no other information.
         self.tree.setIndentation(10)
@@ -436,9 +1056,18 @@ class main_window(QMainWindow):
         self.dir_entry.returnPressed.connect(self.set_tree)
         self.tree.clicked.connect(self.set_dir)
 
-        self.set_tree()
         self.setMaximumSize(self.width(), self.height())
 
+    @Slot()
+    def start(self):
+        """
+        Everything that touches the disk, left out of __init__ so the window shows
+        first: the folder tree, recovering interrupted batches and the first scan.
+        """
+        self.tree_model.setRootPath(self.path)
+        self.recover()
+        self.set_tree()
+
     def initUI(self):
         centralWidget = QWidget()
         grid = QGridLayout()
@@ -448,9 +1077,10 @@ class main_window(QMainWindow):
         dir_box.addWidget(self.dir_entry)
         dir_box.addWidget(self.dir_btn)
         grid.addLayout(dir_box, 0, 0, 1, 3)
-        grid.addWidget(self.tree, 1, 0)
-        grid.addWidget(self.files, 1, 1)
-        grid.addLayout(self.rename_opts, 2, 0, 1, 3)
+        grid.addLayout(self.filter_bar, 1, 1)
+        grid.addWidget(self.tree, 2, 0)
+        grid.addWidget(self.files, 2, 1)
+        grid.addLayout(self.rename_opts, 3, 0, 1, 3)
 
         centralWidget.setLayout(grid)
         self.setCentralWidget(centralWidget)
@@ -471,25 +1101,162 @@ class main_window(QMainWindow):
         self.update_files()
 
     def update_files(self):
-        self.files_model = files(self.path)
-        self.files.setModel(self.files_model)
+        self.cancel_scan()
+        self.sync_timer.stop()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self.watcher.addPath(self.path)
+        self.files_model = FilesModel()
+        proxy = FilterProxy(self.files_model, self.files)
+        proxy.text, proxy.mode = self.files.model().text, self.files.model().mode
+        self.files.model().deleteLater()
+        self.files.setModel(proxy)
         self.rename_opts.change_dir(self.files_model, self.path)
 
+        self.scanner = DirectoryScanner(self.path, self)
+        self.scanner.chunk.connect(self.files_model.append_chunk)
+        self.scanner.progress.connect(self.scan_progress)
+        self.scanner.failed.connect(self.scan_failed)
+        self.scanner.finished.connect(self.scan_finished)
+        self.scanner.finished.connect(self.scanner.deleteLater)
+        self.statusBar().showMessage('Scanning...')
+        self.scanner.start()
+
+    def cancel_scan(self, wait: bool = False):
+        """
+        Stops the running scan, if any. Its remaining chunks are dropped.
+        """
+        if self.scanner is None:
+            return
+        scanner, self.scanner = self.scanner, None
+        for signal in [scanner.chunk, scanner.progress, scanner.failed]:
+            signal.disconnect()
+        scanner.requestInterruption()
+        if wait:
+            scanner.wait()
+
+    @Slot(int)
+    def scan_progress(self, count):
+        self.statusBar().showMessage(f'Scanning... {count} items')
+
+    @Slot(str)
+    def scan_failed(self, message):
+        self.statusBar().showMessage(f'Could not scan {self.path}: {message}')
+
+    @Slot()
+    def scan_finished(self):
+        if self.sender() is not self.scanner:
+            return
+        scanner, self.scanner = self.scanner, None
+        if self.files.isSortingEnabled():
+            header = self.files.horizontalHeader()
+            self.files.sortByColumn(header.sortIndicatorSection(), header.sortIndicatorOrder())
+        if scanner.error is None:
+            self.statusBar().showMessage(f'{scanner.count} items')
+
+    @Slot(str, str)
+    def apply_filter(self, text, mode):
+        try:
+            self.files.model().set_filter(text, mode)
+        except FilterError as e:
+            self.statusBar().showMessage(str(e))
+            return
+        shown, total = self.files.model().rowCount(), self.files_model.rowCount()
+        self.statusBar().showMessage(f'{shown} of {total} items' if text.strip() else f'{total} items')
+
+    @Slot()
+    def schedule_sync(self):
+        """
+        Syncs the listing with the directory once changes have settled for a moment.
+        """
+        self.sync_timer.start()
+
+    @Slot()
+    def sync_files(self):
+        """
+        Applies what changed in the directory to the listing in place, rather than
+        rescanning it, so selection and scroll position are kept.
+        """
+        if self.scanner is not None or self.syncer is not None or self.rename_opts.worker is not None:
+            # Try again once the listing has settled.
+            self.sync_timer.start()
+            return
+        known = set(self.files_model.filenames())
+        self.syncer = DirectorySync(self.path, known, self.files_model, self)
+        self.syncer.finished.connect(self.sync_finished)
+        self.syncer.finished.connect(self.syncer.deleteLater)
+        self.syncer.start()
+
+    @Slot()
+    def sync_finished(self):
+        if self.sender() is not self.syncer:
+            return
+        syncer, self.syncer = self.syncer, None
+        if syncer.model is not self.files_model:
+            # The directory was changed while this ran.
+            return
+        if syncer.error is not None:
+            self.statusBar().showMessage(f'Could not scan {self.path}: {syncer.error}')
+            return
+        removed = syncer.model.remove_entries(syncer.gone)
+        added = syncer.model.add_entries(syncer.added)
+        if removed or added:
+            self.statusBar().showMessage(f'{syncer.model.rowCount()} items')
+
+    def recover(self):
+        """
+        Offers to undo batches that were interrupted last time the program ran.
+        """
+        for batch in self.rename_opts.journal.incomplete():
+            started = format_mtime(batch.started)
+            answer = QMessageBox.question(
+                self, 'Interrupted rename',
+                f'A rename started {started} did not finish.\n'
+                'Undo the part of it that was done?')
+            if answer == QMessageBox.Yes:
+                report = self.rename_opts.journal.undo(batch.id)
+                self.rename_status.setText(report.summary())
+            else:
+                self.rename_opts.journal.close(batch.id)
+
+    def closeEvent(self, event):
+        self.cancel_scan(wait=True)
+        self.rename_opts.cancel_preview()
+        self.sync_timer.stop()
+        if self.syncer is not None:
+            self.syncer.wait()
+        for worker in [self.rename_opts.worker, self.rename_opts.metadata_loader]:
+            if worker is not None:
+                worker.requestInterruption()
+                worker.wait()
+        super().closeEvent(event)
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Rename files in a chosen directory')
+    parser.add_argument('path', nargs='?', help='Optional starting directory')
+    parser.add_argument('-d', '--directory', help='Optional starting directory')
+    parser.add_argument('--profile', metavar='FILE',
+                        help=f'Time each phase and write the profile to FILE on exit, '
+                             f'as a Chrome trace if FILE ends in {profile.CHROME_SUFFIX} '
+                             f'(also enabled by {profile.ENV}=FILE)')
+    # Anything else is left for Qt.
+    return parser.parse_known_args(argv)[0]
+
 
 def main():
-    app_path = Path(sys.argv[0]).absolute().parent
-    try:
-        path = Path(sys.argv[1])
-    except IndexError:
-        path = Path().absolute()
+    args = get_args(sys.argv[1:])
+    profile.enable_from_env(args.profile)
+    path = Path(args.directory or args.path or Path().absolute())
     app = QApplication(sys.argv)
+    # Styled before any widget exists, so nothing is drawn twice.
+    app.setStyleSheet(STYLE.read_text(encoding='utf-8'))
     window = main_window(path)
     window.show()
-
-    with open(app_path / 'renamer' / 'style.qss', 'r') as f:
-        _style = f.read()
-        app.setStyleSheet(_style)
-    sys.exit(app.exec_())
+    QTimer.singleShot(0, window.start)
+    code = app.exec_()
+    profiler.export()
+    sys.exit(code)
 
 
 if __name__ == "__main__":
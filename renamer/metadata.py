@@ -0,0 +1,384 @@
+"""
+Per-file metadata for rename tokens.
+
+Tokens such as {date} or {artist} in the Name and Add boxes are filled in from
+each file's metadata. Only file headers are read: the EXIF block and frame
+header of JPEGs, the IHDR of PNGs, the logical screen of GIFs and the ID3
+tags of MP3s. The {hash} token is the start of the file's content hash, see
+hashing.py. extract() reads many files on a thread pool and keeps what it found
+in a MetadataCache on disk, keyed by (device, inode, size, mtime), so a folder
+only has to be parsed (and hashed) once. find_duplicates() uses the same cache.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Mapping, Optional, Sequence, Union
+
+from .hashing import HASH_LENGTH, WORKERS, hash_files
+from .settings import data_dir
+
+# Token names available in the boxes, e.g. 'IMG {date} {time}' or '{track} {title}'.
+TOKENS = ['date', 'time', 'width', 'height', 'artist', 'title', 'album', 'track', 'size', 'hash']
+TOKEN_RE = re.compile(r'\{(' + '|'.join(TOKENS) + r')\}')
+# Bytes read from the start of a file; EXIF and ID3 headers live well within this.
+HEADER_SIZE = 128 * 1024
+# Cache rows are looked up this many at a time.
+LOOKUP_BATCH = 500
+
+PathLike = Union[Path, str]
+Metadata = dict[str, str]
+# (device, inode, size, mtime_ns) of a file, what cache entries are validated against.
+FileKey = tuple[int, int, int, int]
+
+
+def has_tokens(text: str) -> bool:
+    return TOKEN_RE.search(text) is not None
+
+
+def used_tokens(text: str) -> frozenset[str]:
+    return frozenset(TOKEN_RE.findall(text))
+
+
+def expand_tokens(text: str, metadata: Mapping[str, str]) -> str:
+    """
+    Replaces every token in text with the file's value, or nothing if it has none.
+    Other text in braces is left alone.
+    """
+    return TOKEN_RE.sub(lambda m: metadata.get(m.group(1), ''), text)
+
+
+def read_metadata(path: PathLike, size: Optional[int] = None) -> Metadata:
+    """
+    Reads the metadata of one file from its header. Unknown formats only get a size.
+    """
+    metadata = {}
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+        if head.startswith(b'\xff\xd8'):
+            metadata.update(_jpeg(head))
+        elif head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            metadata.update(width=str(width), height=str(height))
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            width, height = struct.unpack('<HH', head[6:10])
+            metadata.update(width=str(width), height=str(height))
+        elif head.startswith(b'ID3'):
+            metadata.update(_id3v2(head, f))
+        elif str(path).lower().endswith('.mp3'):
+            metadata.update(_id3v1(f))
+    if size is None:
+        size = os.stat(path).st_size
+    metadata['size'] = str(size)
+    return metadata
+
+
+def _jpeg(head: bytes) -> Metadata:
+    metadata = {}
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            break
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            # Fill byte.
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        segment = head[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and segment.startswith(b'Exif\0\0'):
+            metadata.update(_exif(segment[6:]))
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) and len(segment) >= 5:
+            height, width = struct.unpack('>HH', segment[1:5])
+            metadata.update(width=str(width), height=str(height))
+        if marker == 0xDA or 'width' in metadata:
+            # Image data follows the frame header, there is nothing more to read.
+            break
+        pos += 2 + length
+    return metadata
+
+
+def _exif(tiff: bytes) -> Metadata:
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return {}
+
+    def entries(offset: int) -> dict[int, tuple[int, int, bytes]]:
+        if offset + 2 > len(tiff):
+            return {}
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+        found = {}
+        for i in range(count):
+            start = offset + 2 + 12 * i
+            if start + 12 > len(tiff):
+                break
+            tag, kind, n = struct.unpack(order + 'HHI', tiff[start:start + 8])
+            found[tag] = (kind, n, tiff[start + 8:start + 12])
+        return found
+
+    def ascii(entry) -> str:
+        kind, n, value = entry
+        if kind != 2:
+            return ''
+        data = value[:n] if n <= 4 else tiff[struct.unpack(order + 'I', value)[0]:][:n]
+        return data.split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+
+    try:
+        ifd0 = entries(struct.unpack(order + 'I', tiff[4:8])[0])
+        stamp = ''
+        if 0x8769 in ifd0:
+            exif = entries(struct.unpack(order + 'I', ifd0[0x8769][2])[0])
+            if 0x9003 in exif:
+                stamp = ascii(exif[0x9003])
+        if not stamp and 0x0132 in ifd0:
+            stamp = ascii(ifd0[0x0132])
+    except struct.error:
+        return {}
+    # 'YYYY:MM:DD HH:MM:SS', written with dashes as colons are not allowed in names everywhere.
+    if len(stamp) >= 19 and stamp[4] == ':' and stamp[10] == ' ':
+        return {'date': stamp[:10].replace(':', '-'), 'time': stamp[11:19].replace(':', '-')}
+    return {}
+
+
+ID3_FRAMES = {'TPE1': 'artist', 'TIT2': 'title', 'TALB': 'album', 'TRCK': 'track',
+              'TP1': 'artist', 'TT2': 'title', 'TAL': 'album', 'TRK': 'track'}
+
+
+def _id3v2(head: bytes, f) -> Metadata:
+    major, flags = head[3], head[5]
+    size = _syncsafe(head[6:10])
+    if 10 + size > len(head):
+        head = head + f.read(10 + size - len(head))
+    tags = head[10:10 + size]
+    pos = 0
+    if major >= 3 and flags & 0x40:
+        # Extended header.
+        extended = _syncsafe(tags[:4]) if major == 4 else struct.unpack('>I', tags[:4])[0] + 4
+        pos = extended
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    metadata = {}
+    while pos + header_size <= len(tags):
+        frame = tags[pos:pos + id_size]
+        if not frame.strip(b'\0'):
+            # Padding.
+            break
+        if major == 2:
+            frame_size = int.from_bytes(tags[pos + 3:pos + 6], 'big')
+        elif major == 4:
+            frame_size = _syncsafe(tags[pos + 4:pos + 8])
+        else:
+            frame_size = struct.unpack('>I', tags[pos + 4:pos + 8])[0]
+        key = ID3_FRAMES.get(frame.decode('latin-1'))
+        if key and key not in metadata:
+            text = _id3_text(tags[pos + header_size:pos + header_size + frame_size])
+            if text:
+                metadata[key] = text
+        pos += header_size + frame_size
+    if 'track' in metadata:
+        metadata['track'] = _track(metadata['track'])
+    return metadata
+
+
+def _id3v1(f) -> Metadata:
+    try:
+        f.seek(-128, os.SEEK_END)
+    except OSError:
+        return {}
+    tag = f.read(128)
+    if not tag.startswith(b'TAG'):
+        return {}
+
+    def text(data: bytes) -> str:
+        return data.split(b'\0', 1)[0].decode('latin-1').strip()
+    metadata = {'title': text(tag[3:33]), 'artist': text(tag[33:63]), 'album': text(tag[63:93])}
+    if tag[125] == 0 and tag[126]:
+        metadata['track'] = _track(str(tag[126]))
+    return {key: value for key, value in metadata.items() if value}
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _id3_text(data: bytes) -> str:
+    if not data:
+        return ''
+    encoding = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}.get(data[0], 'latin-1')
+    try:
+        return data[1:].decode(encoding).split('\0', 1)[0].strip()
+    except UnicodeDecodeError:
+        return ''
+
+
+def _track(text: str) -> str:
+    # '3/12' -> '03', so tracks sort by name.
+    number = text.split('/', 1)[0].strip()
+    return number.zfill(2) if number.isdigit() else number
+
+
+class MetadataCache:
+    """
+    Metadata and content hashes found so far, in an SQLite file keyed by (device, inode).
+    An entry is only used while the file's size and mtime still match.
+    """
+    def __init__(self, path: Optional[PathLike] = None) -> None:
+        self.path = Path(path) if path else data_dir() / 'metadata.sqlite'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS metadata (dev INTEGER, ino INTEGER, size INTEGER, '
+                        'mtime INTEGER, data TEXT, PRIMARY KEY (dev, ino))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS hashes (dev INTEGER, ino INTEGER, size INTEGER, '
+                        'mtime INTEGER, data TEXT, PRIMARY KEY (dev, ino))')
+
+    def get_many(self, keys: Sequence[FileKey]) -> list[Optional[Metadata]]:
+        """
+        Looks up (dev, ino, size, mtime_ns) keys, returning None for misses and stale entries.
+        """
+        return [json.loads(data) if data is not None else None for data in self._get('metadata', keys)]
+
+    def put_many(self, items: Iterable[tuple[FileKey, Metadata]]) -> None:
+        self._put('metadata', ((key, json.dumps(metadata)) for key, metadata in items))
+
+    def get_hashes(self, keys: Sequence[FileKey]) -> list[Optional[str]]:
+        """
+        Like get_many(), for content hashes.
+        """
+        return self._get('hashes', keys)
+
+    def put_hashes(self, items: Iterable[tuple[FileKey, str]]) -> None:
+        self._put('hashes', items)
+
+    def _get(self, table: str, keys: Sequence[FileKey]) -> list[Optional[str]]:
+        found = {}
+        by_dev: dict[int, list[int]] = {}
+        for dev, ino, _, _ in keys:
+            by_dev.setdefault(dev, []).append(ino)
+        for dev, inodes in by_dev.items():
+            for i in range(0, len(inodes), LOOKUP_BATCH):
+                batch = inodes[i:i + LOOKUP_BATCH]
+                rows = self.db.execute(f'SELECT ino, size, mtime, data FROM {table} WHERE dev = ? AND ino IN '
+                                       f'({",".join("?" * len(batch))})', [dev, *batch])
+                for ino, size, mtime, data in rows:
+                    found[dev, ino] = (size, mtime, data)
+        results = []
+        for dev, ino, size, mtime in keys:
+            entry = found.get((dev, ino))
+            results.append(entry[2] if entry and entry[:2] == (size, mtime) else None)
+        return results
+
+    def _put(self, table: str, items: Iterable[tuple[FileKey, str]]) -> None:
+        with self.db:
+            self.db.executemany(f'INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)',
+                                [(*key, data) for key, data in items])
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def file_keys(paths: Sequence[PathLike]) -> list[Optional[FileKey]]:
+    """
+    The cache key of each path, or None for paths that can not be stat'ed.
+    """
+    keys = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            keys.append((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            keys.append(None)
+    return keys
+
+
+def extract(paths: Sequence[PathLike], workers: int = WORKERS, cache: Optional[MetadataCache] = None,
+            cancelled: Optional[Callable[[], bool]] = None, hashes: bool = False) -> list[Metadata]:
+    """
+    The metadata of each path, in order. Cached entries are used where the file is
+    unchanged; the rest are parsed on a thread pool and added to the cache.
+    With hashes, the content hash is added as well.
+    Files that can not be read get an empty dictionary.
+    """
+    keys = file_keys(paths)
+    results: list[Optional[Metadata]] = [None] * len(paths)
+    if cache is not None:
+        known = [i for i, key in enumerate(keys) if key is not None]
+        for i, metadata in zip(known, cache.get_many([keys[i] for i in known])):
+            results[i] = metadata
+
+    missing = [i for i, key in enumerate(keys) if key is not None and results[i] is None]
+
+    def parse(i: int) -> Optional[Metadata]:
+        if cancelled is not None and cancelled():
+            return None
+        try:
+            return read_metadata(paths[i], keys[i][2])
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parsed = list(pool.map(parse, missing))
+    for i, metadata in zip(missing, parsed):
+        results[i] = metadata
+    if cache is not None:
+        cache.put_many((keys[i], metadata) for i, metadata in zip(missing, parsed) if metadata is not None)
+    results = [metadata or {} for metadata in results]
+    if hashes:
+        for metadata, digest in zip(results, content_hashes(paths, keys, workers, cache, cancelled)):
+            if digest is not None:
+                metadata['hash'] = digest[:HASH_LENGTH]
+    return results
+
+
+def content_hashes(paths: Sequence[PathLike], keys: Optional[Sequence[Optional[FileKey]]] = None,
+                   workers: int = WORKERS, cache: Optional[MetadataCache] = None,
+                   cancelled: Optional[Callable[[], bool]] = None) -> list[Optional[str]]:
+    """
+    The content hash of each path, or None if it can not be read. Hashes of unchanged
+    files come from the cache, the rest are hashed and added to it.
+    """
+    if keys is None:
+        keys = file_keys(paths)
+    results: list[Optional[str]] = [None] * len(paths)
+    known = [i for i, key in enumerate(keys) if key is not None]
+    if cache is not None:
+        for i, digest in zip(known, cache.get_hashes([keys[i] for i in known])):
+            results[i] = digest
+    missing = [i for i in known if results[i] is None]
+    for i, digest in zip(missing, hash_files([paths[i] for i in missing], workers, cancelled)):
+        results[i] = digest
+    if cache is not None:
+        cache.put_hashes((keys[i], results[i]) for i in missing if results[i] is not None)
+    return results
+
+
+def find_duplicates(paths: Sequence[PathLike], workers: int = WORKERS,
+                    cache: Optional[MetadataCache] = None) -> list[list[Path]]:
+    """
+    Groups of paths with the same content, each group in the order given.
+    Only files sharing their size with another file are hashed; empty files,
+    folders and hard links to a file already listed are left out.
+    """
+    by_size: dict[int, list[int]] = {}
+    keys = file_keys(paths)
+    seen = set()
+    for i, key in enumerate(keys):
+        if key is None or not key[2] or key[:2] in seen or not os.path.isfile(paths[i]):
+            continue
+        seen.add(key[:2])
+        by_size.setdefault(key[2], []).append(i)
+    candidates = [i for group in by_size.values() if len(group) > 1 for i in group]
+    digests = content_hashes([paths[i] for i in candidates], [keys[i] for i in candidates], workers, cache)
+    groups: dict[tuple[int, str], list[Path]] = {}
+    for i, digest in zip(candidates, digests):
+        if digest is not None:
+            groups.setdefault((keys[i][2], digest), []).append(Path(paths[i]))
+    return [group for group in groups.values() if len(group) > 1]
@@ -0,0 +1,526 @@
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import chain, compress, starmap
+from operator import itemgetter, ne
+from typing import Iterable, Iterator, Optional, Sequence
+
+from PySide6.QtCore import (QAbstractProxyModel, QAbstractTableModel, QItemSelection, QModelIndex,
+                            QPersistentModelIndex, Qt, Signal)
+
+from . import profile
+from .filtering import FilterIndex
+from .scan import split_name
+
+FOLDER = 'File Folder'
+# data() returns the raw value a column sorts by for this role, e.g. the mtime as a float.
+SORT_ROLE = Qt.UserRole
+# Formatted Modified cells are cached; a screenful of rows is only a few dozen of them.
+MTIME_CACHE = 4096
+
+
+def format_mtime(mtime: float) -> str:
+    """
+    Formats a timestamp in m/d/YYYY H:mm:ss AM/PM format
+    """
+    profile.count('mtimes_formatted')
+    formatted = time.localtime(mtime)
+    clean = time.strftime('%m/%d/%Y %I:%M:%S %p', formatted).replace('/0', '/')
+    if clean.startswith('0'):
+        return clean[1:]
+    return clean
+
+
+display_mtime = lru_cache(maxsize=MTIME_CACHE)(format_mtime)
+
+
+class RowRanges:
+    """
+    A set of rows kept as sorted, disjoint (start, stop) ranges, so that a selection of
+    every row is a single range however many rows the table has.
+    """
+    def __init__(self, ranges: Iterable[tuple[int, int]] = ()) -> None:
+        merged: list[tuple[int, int]] = []
+        for start, stop in sorted(ranges):
+            if start >= stop:
+                continue
+            if merged and start <= merged[-1][1]:
+                if stop > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], stop)
+            else:
+                merged.append((start, stop))
+        self.ranges = merged
+        self.count = sum(stop - start for start, stop in merged)
+
+    @classmethod
+    def from_selection(cls, selection: QItemSelection) -> 'RowRanges':
+        """
+        The rows of a selection, read from its ranges without visiting a single index.
+        """
+        return cls((selected.top(), selected.bottom() + 1) for selected in selection)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[int]:
+        return chain.from_iterable(starmap(range, self.ranges))
+
+    def __contains__(self, row: int) -> bool:
+        i = bisect_right(self.ranges, (row, float('inf'))) - 1
+        return i >= 0 and row < self.ranges[i][1]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RowRanges) and self.ranges == other.ranges
+
+    def __repr__(self) -> str:
+        return f'RowRanges({self.ranges})'
+
+
+class FilesModel(QAbstractTableModel):
+    """
+    Table model of a directory listing backed by one array per column.
+    Cells are produced on demand in data() instead of being stored as Qt objects;
+    mtimes stay numbers and are only formatted for the rows that are displayed.
+    """
+    headers = ['Name', 'New Name', 'Type', 'Modified']
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.names: list[str] = []
+        self.new_names: list[str] = []
+        self.suffixes: list[str] = []
+        self.is_dir = bytearray()
+        self.mtimes = array('d')
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.names)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if role == Qt.DisplayRole:
+            if col == 0:
+                return self.names[row]
+            if col == 1:
+                return self.new_names[row]
+            if col == 2:
+                return self.type(row)
+            return display_mtime(self.mtimes[row])
+        if role == SORT_ROLE:
+            if col == 0:
+                return self.names[row].lower()
+            if col == 1:
+                return self.new_names[row].lower()
+            if col == 2:
+                return self.type(row).lower()
+            return self.mtimes[row]
+        if role == Qt.TextAlignmentRole and col >= 2:
+            return Qt.AlignCenter
+        return None
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
+        if len(self.names) < 2:
+            return
+        with profile.span('sort', rows=len(self.names), column=column):
+            self._sort(column, order)
+
+    def _sort(self, column: int, order: Qt.SortOrder) -> None:
+        rows = sorted(range(len(self.names)), key=self.sort_keys(column).__getitem__,
+                      reverse=order == Qt.DescendingOrder)
+        # One C level gather per column rather than a Python loop over the rows.
+        gather = itemgetter(*rows)
+        self.layoutAboutToBeChanged.emit()
+        self.names = list(gather(self.names))
+        self.new_names = list(gather(self.new_names))
+        self.suffixes = list(gather(self.suffixes))
+        self.is_dir = bytearray(gather(self.is_dir))
+        self.mtimes = array('d', gather(self.mtimes))
+        old_indexes = self.persistentIndexList()
+        if old_indexes:
+            new_rows = [0] * len(rows)
+            for new_row, old_row in enumerate(rows):
+                new_rows[old_row] = new_row
+            new_indexes = [self.index(new_rows[index.row()], index.column()) for index in old_indexes]
+            self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def sort_keys(self, column: int) -> list:
+        """
+        The values a column sorts by, one per row: lower case text, or the raw mtime.
+        """
+        if column == 0:
+            return list(map(str.lower, self.names))
+        if column == 1:
+            return list(map(str.lower, self.new_names))
+        if column == 2:
+            folder = FOLDER.lower()
+            return [folder if is_dir else suffix.lower() for is_dir, suffix in zip(self.is_dir, self.suffixes)]
+        return self.mtimes.tolist()
+
+    def append_rows(self, names: Sequence[str], suffixes: Sequence[str],
+                    is_dir: Iterable[bool], mtimes: Iterable[float]) -> None:
+        """
+        Adds a batch of directory entries to the end of the model.
+        """
+        if not names:
+            return
+        first = len(self.names)
+        self.beginInsertRows(QModelIndex(), first, first + len(names) - 1)
+        self.names.extend(names)
+        self.new_names.extend(names)
+        self.suffixes.extend(suffixes)
+        self.is_dir.extend(is_dir)
+        self.mtimes.extend(mtimes)
+        self.endInsertRows()
+
+    def append_chunk(self, chunk: tuple) -> None:
+        """
+        Adds a (names, suffixes, is_dir, mtimes) chunk as produced by scan.scan_chunks.
+        """
+        self.append_rows(*chunk)
+
+    def add_entries(self, entries: Sequence[tuple[str, str, bool, float]]) -> int:
+        """
+        Appends (stem, suffix, is_dir, mtime) entries that are not listed yet. Returns the number added.
+        """
+        known = set(self.filenames())
+        new = [entry for entry in entries if f'{entry[0]}{entry[1]}' not in known]
+        if new:
+            names, suffixes, is_dir, mtimes = zip(*new)
+            self.append_rows(list(names), list(suffixes), is_dir, mtimes)
+        return len(new)
+
+    def type(self, row: int) -> str:
+        return FOLDER if self.is_dir[row] else self.suffixes[row]
+
+    def filename(self, row: int) -> str:
+        return f'{self.names[row]}{self.suffixes[row]}'
+
+    def new_filename(self, row: int) -> str:
+        return f'{self.new_names[row]}{self.suffixes[row]}'
+
+    def set_new_names(self, rows: Sequence[int], new_names: Sequence[str]) -> None:
+        """
+        Sets the New Name column for the given rows. Only rows whose text actually
+        changes are updated and reported, one dataChanged per run of adjacent rows.
+        """
+        current = self.new_names
+        if isinstance(rows, range) and rows.step == 1:
+            # A block of rows, e.g. every row: compared and replaced as slices.
+            changed = list(compress(rows, map(ne, current[rows.start:rows.stop], new_names)))
+            current[rows.start:rows.stop] = new_names
+        else:
+            changed = list(compress(rows, map(ne, map(current.__getitem__, rows), new_names)))
+            for row, new_name in zip(rows, new_names):
+                current[row] = new_name
+        self.emit_new_names(changed)
+
+    def reset_new_names(self, rows: Optional[Iterable[int]] = None) -> None:
+        """
+        Sets the New Name of the given rows, or of every row, back to the current name.
+        """
+        rows = range(len(self.names)) if rows is None else list(rows)
+        names = self.names
+        self.set_new_names(rows, [names[row] for row in rows])
+
+    def filenames(self) -> list[str]:
+        return [f'{name}{suffix}' for name, suffix in zip(self.names, self.suffixes)]
+
+    def rename_entries(self, renames: dict[str, str]) -> int:
+        """
+        Applies renames done on disk, given as {old file name: new file name}, in place.
+        Rows keep their position, so selection and scroll position are kept too.
+        Returns the number of rows updated.
+        """
+        rows = []
+        for row, filename in enumerate(self.filenames()):
+            new = renames.get(filename)
+            if new is None:
+                continue
+            if self.is_dir[row]:
+                self.names[row], self.suffixes[row] = new, ''
+            else:
+                self.names[row], self.suffixes[row] = split_name(new)
+            self.new_names[row] = self.names[row]
+            rows.append(row)
+        self.emit_rows(rows, 0, 2)
+        return len(rows)
+
+    def remove_entries(self, filenames: set[str]) -> int:
+        """
+        Removes the rows of entries that are no longer on disk. Returns the number removed.
+        """
+        rows = [row for row, filename in enumerate(self.filenames()) if filename in filenames]
+        # Runs of adjacent rows are removed together, last run first so earlier rows keep their numbers.
+        for first, last in reversed(list(_runs(rows))):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.names[first:last + 1]
+            del self.new_names[first:last + 1]
+            del self.suffixes[first:last + 1]
+            del self.is_dir[first:last + 1]
+            del self.mtimes[first:last + 1]
+            self.endRemoveRows()
+        return len(rows)
+
+    def emit_new_names(self, rows: list[int]) -> None:
+        self.emit_rows(rows, 1, 1)
+
+    def emit_rows(self, rows: list[int], first_col: int, last_col: int) -> None:
+        """
+        Reports changes to rows with one dataChanged per run of adjacent rows.
+        """
+        for first, last in _runs(rows):
+            self.dataChanged.emit(self.index(first, first_col), self.index(last, last_col), [Qt.DisplayRole])
+
+
+class FilterProxy(QAbstractProxyModel):
+    """
+    Shows the rows of a FilesModel whose file name matches a filter, in the model's order.
+    rows holds the model row of every shown row in ascending order, or is None while
+    every row is shown, so mapping a row either way is a list lookup or a bisect.
+    Sorting is done by the model itself; the filter is applied again afterwards.
+    Rows that are renamed stay shown until the filter is next applied.
+    """
+    filtered = Signal()
+
+    def __init__(self, model: Optional[FilesModel] = None, parent=None) -> None:
+        super().__init__(parent)
+        self.rows: Optional[list[int]] = None
+        self.count = 0
+        self.text = ''
+        self.mode = 'glob'
+        self.filter_index: Optional[FilterIndex] = None
+        self.saved: list[tuple[QPersistentModelIndex, QPersistentModelIndex]] = []
+        if model is not None:
+            self.setSourceModel(model)
+
+    def setSourceModel(self, model: FilesModel) -> None:
+        old = self.sourceModel()
+        if old is not None:
+            old.disconnect(self)
+        self.beginResetModel()
+        super().setSourceModel(model)
+        model.rowsInserted.connect(self.source_rows_inserted)
+        model.rowsRemoved.connect(self.source_rows_removed)
+        model.dataChanged.connect(self.source_data_changed)
+        model.layoutAboutToBeChanged.connect(self.source_layout_about_to_change)
+        model.layoutChanged.connect(self.source_layout_changed)
+        model.modelReset.connect(self.source_reset)
+        self.filter_index = None
+        self.rows = self.matching()
+        self.count = model.rowCount() if self.rows is None else len(self.rows)
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.count
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(FilesModel.headers)
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if parent.isValid() or not (0 <= row < self.count and 0 <= column < len(FilesModel.headers)):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index: Optional[QModelIndex] = None):
+        if index is None:
+            return super().parent()
+        return QModelIndex()
+
+    def mapToSource(self, index: QModelIndex) -> QModelIndex:
+        if not index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self.source_row(index.row()), index.column())
+
+    def mapFromSource(self, index: QModelIndex) -> QModelIndex:
+        if not index.isValid():
+            return QModelIndex()
+        row = self.proxy_row(index.row())
+        return QModelIndex() if row is None else self.index(row, index.column())
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        model = self.sourceModel()
+        return model.data(model.index(self.source_row(index.row()), index.column()), role)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        return self.sourceModel().headerData(section, orientation, role)
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
+        self.sourceModel().sort(column, order)
+
+    def source_row(self, row: int) -> int:
+        return row if self.rows is None else self.rows[row]
+
+    def proxy_row(self, row: int) -> Optional[int]:
+        if self.rows is None:
+            return row if row < self.count else None
+        i = bisect_left(self.rows, row)
+        return i if i < len(self.rows) and self.rows[i] == row else None
+
+    def source_rows(self, rows: Iterable[int]) -> list[int]:
+        """
+        The model rows of shown rows.
+        """
+        if self.rows is None:
+            return list(rows)
+        return [self.rows[row] for row in rows]
+
+    def source_ranges(self, ranges: RowRanges) -> Sequence[int]:
+        """
+        The model rows of shown rows given as ranges, in order. A single range of an
+        unfiltered table stays a range.
+        """
+        if self.rows is None:
+            return range(*ranges.ranges[0]) if len(ranges.ranges) == 1 else list(ranges)
+        return list(chain.from_iterable(self.rows[start:stop] for start, stop in ranges.ranges))
+
+    def matching_rows(self) -> Sequence[int]:
+        """
+        The model row of every shown row, in order: a range while every row is shown.
+        """
+        return range(self.count) if self.rows is None else list(self.rows)
+
+    def set_filter(self, text: str, mode: str = 'glob') -> None:
+        """
+        Shows only the rows matching text, see filtering.MODES. Selected rows that stay
+        shown stay selected. Raises FilterError for an invalid filter and keeps the old one.
+        """
+        with profile.span('filter', rows=self.sourceModel().rowCount(), mode=mode):
+            rows = self.matching(text, mode)
+            self.text, self.mode = text, mode
+            self.layoutAboutToBeChanged.emit()
+            saved = self.save_persistent()
+            self.rows = rows
+            self.count = self.sourceModel().rowCount() if rows is None else len(rows)
+            self.restore_persistent(saved)
+            self.layoutChanged.emit()
+        self.filtered.emit()
+
+    def matching(self, text: Optional[str] = None, mode: Optional[str] = None) -> Optional[list[int]]:
+        text = self.text if text is None else text
+        if not text.strip():
+            return None
+        model = self.sourceModel()
+        if self.filter_index is None or len(self.filter_index) != model.rowCount():
+            self.filter_index = FilterIndex()
+            self.filter_index.extend(model.names, model.suffixes, model.is_dir)
+        return self.filter_index.match(text, self.mode if mode is None else mode)
+
+    def save_persistent(self) -> list[tuple[QModelIndex, QPersistentModelIndex]]:
+        return [(index, QPersistentModelIndex(self.mapToSource(index))) for index in self.persistentIndexList()]
+
+    def restore_persistent(self, saved: list[tuple[QModelIndex, QPersistentModelIndex]]) -> None:
+        if saved:
+            old = [index for index, _ in saved]
+            new = [self.mapFromSource(self.sourceModel().index(source.row(), source.column()))
+                   if source.isValid() else QModelIndex() for _, source in saved]
+            self.changePersistentIndexList(old, new)
+
+    def source_rows_inserted(self, parent: QModelIndex, first: int, last: int) -> None:
+        model = self.sourceModel()
+        n = last - first + 1
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+            self.count += n
+            self.endInsertRows()
+            if self.filter_index is not None and first == len(self.filter_index):
+                self.filter_index.extend(model.names[first:], model.suffixes[first:], model.is_dir[first:])
+            return
+        if self.filter_index is not None and first == len(self.filter_index):
+            # Rows appended by a scan: only they need testing.
+            self.filter_index.extend(model.names[first:], model.suffixes[first:], model.is_dir[first:])
+            new = self.filter_index.match(self.text, self.mode, start=first) or []
+            position = len(self.rows)
+        else:
+            # Rows inserted in the middle, or the index is gone: it is rebuilt by matching().
+            self.filter_index = None
+            position = bisect_left(self.rows, first)
+            self.rows[position:] = [row + n for row in self.rows[position:]]
+            new = [row for row in self.matching() or [] if first <= row <= last]
+        if new:
+            self.beginInsertRows(QModelIndex(), position, position + len(new) - 1)
+            self.rows[position:position] = new
+            self.count = len(self.rows)
+            self.endInsertRows()
+
+    def source_rows_removed(self, parent: QModelIndex, first: int, last: int) -> None:
+        self.filter_index = None
+        n = last - first + 1
+        if self.rows is None:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            self.count -= n
+            self.endRemoveRows()
+            return
+        lo, hi = bisect_left(self.rows, first), bisect_right(self.rows, last)
+        if lo < hi:
+            self.beginRemoveRows(QModelIndex(), lo, hi - 1)
+        del self.rows[lo:hi]
+        self.rows[lo:] = [row - n for row in self.rows[lo:]]
+        self.count = len(self.rows)
+        if lo < hi:
+            self.endRemoveRows()
+
+    def source_data_changed(self, top_left: QModelIndex, bottom_right: QModelIndex, roles=()) -> None:
+        if top_left.column() == 0:
+            # Names changed, the index is rebuilt when the filter is next applied.
+            self.filter_index = None
+        first, last = top_left.row(), bottom_right.row()
+        if self.rows is not None:
+            first, last = bisect_left(self.rows, first), bisect_right(self.rows, last) - 1
+            if first > last:
+                return
+        self.dataChanged.emit(self.index(first, top_left.column()), self.index(last, bottom_right.column()), roles)
+
+    def source_layout_about_to_change(self) -> None:
+        self.layoutAboutToBeChanged.emit()
+        self.saved = self.save_persistent()
+
+    def source_layout_changed(self) -> None:
+        # Rows moved, so the index is stale and the matching rows have new numbers.
+        self.filter_index = None
+        self.rows = self.matching()
+        self.count = self.sourceModel().rowCount() if self.rows is None else len(self.rows)
+        saved, self.saved = self.saved, []
+        self.restore_persistent(saved)
+        self.layoutChanged.emit()
+
+    def source_reset(self) -> None:
+        self.setSourceModel(self.sourceModel())
+
+
+def _runs(rows: list[int]) -> Iterator[tuple[int, int]]:
+    """
+    Yields the (first, last) row of each run of adjacent distinct rows, sorting rows in place.
+    """
+    if not rows:
+        return
+    rows.sort()
+    if rows[-1] - rows[0] == len(rows) - 1:
+        # Distinct rows spanning exactly their count are one run.
+        yield rows[0], rows[-1]
+        return
+    first = last = rows[0]
+    for row in rows[1:]:
+        if row != last + 1:
+            yield first, last
+            first = row
+        last = row
+    yield first, last
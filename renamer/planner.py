@@ -0,0 +1,251 @@
+"""
+Up-front checks of a rename plan.
+
+check_plan indexes every source, target and existing name once and, before anything
+touches the disk, flags duplicate targets and clashes with files that stay where they
+are. Renames that depend on each other (chains like a -> b, b -> c and cycles like
+a -> b, b -> a) are routed through temporary names so they succeed in any order.
+"""
+
+import os
+import sys
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Optional
+from pathlib import Path
+
+from . import profile
+from .executor import PathLike, Pair, RenameReport, execute_renames, rename_file
+
+
+@dataclass
+class Conflict:
+    source: str
+    target: str
+    reason: str
+
+
+@dataclass
+class RenamePlan:
+    """
+    A checked plan. direct renames can run in any order; each linked rename goes
+    source -> temp in the first phase and temp -> target in the second. folders are
+    the target folders that do not exist yet and are created first.
+    """
+    direct: list[tuple[Path, Path]] = field(default_factory=list)
+    linked: list[tuple[Path, Path, Path]] = field(default_factory=list)
+    conflicts: list[Conflict] = field(default_factory=list)
+    cycles: int = 0
+    folders: list[Path] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.direct) + len(self.linked)
+
+    def pairs(self) -> list[tuple[Path, Path]]:
+        """
+        The (source, target) of every rename that will be attempted.
+        """
+        return self.direct + [(source, target) for source, target, _ in self.linked]
+
+    def steps(self) -> list[tuple[Path, Path]]:
+        """
+        Every single rename on disk, in execution order, temporary names included.
+        """
+        return (self.direct + [(source, temp) for source, _, temp in self.linked]
+                + [(temp, target) for _, target, temp in self.linked])
+
+
+def is_case_insensitive(directory: PathLike) -> bool:
+    """
+    Whether names in directory are matched case-insensitively by the filesystem.
+    """
+    path = os.path.abspath(directory)
+    other = path.swapcase()
+    if other == path:
+        return sys.platform in ('win32', 'darwin')
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+
+def check_plan(pairs: Iterable[Pair], existing: Optional[Iterable[PathLike]] = None,
+               case_insensitive: Optional[bool] = None, folders: bool = False) -> RenamePlan:
+    """
+    Checks (source, target) pairs in O(N). existing lists every path already on disk
+    in the target folders, in the same form as the targets (they are compared as
+    strings); without it each target is looked up on disk instead.
+    Unchanged pairs are dropped, and of several pairs with the same target the first wins.
+    With folders, target folders that do not exist are created when the plan runs;
+    otherwise renames into them fail.
+    """
+    with profile.span('check_plan'):
+        return _check_plan(pairs, existing, case_insensitive, folders)
+
+
+def _check_plan(pairs: Iterable[Pair], existing: Optional[Iterable[PathLike]],
+                case_insensitive: Optional[bool], folders: bool = False) -> RenamePlan:
+    # Names are compared as strings, each worked out once: parsing and formatting paths
+    # is most of the cost. Paths are only made for what the callers passed as strings.
+    pairs = list(pairs)
+    strings = [(os.fspath(source), os.fspath(target)) for source, target in pairs]
+    kept = [i for i, (source, target) in enumerate(strings) if source != target]
+    pairs = [(_path(pairs[i][0]), _path(pairs[i][1])) for i in kept]
+    strings = [strings[i] for i in kept]
+    if case_insensitive is None:
+        case_insensitive = bool(pairs) and is_case_insensitive(pairs[0][1].parent)
+
+    def key(path: str) -> str:
+        return path.casefold() if case_insensitive else path
+
+    source_keys = [key(source) for source, _ in strings]
+    target_keys = [key(target) for _, target in strings]
+    plan = RenamePlan()
+    dropped = [False] * len(pairs)
+    sources = {source: i for i, source in enumerate(source_keys)}
+    targets: dict[str, int] = {}
+    for i, target in enumerate(target_keys):
+        first = targets.setdefault(target, i)
+        if first != i:
+            dropped[i] = True
+            plan.conflicts.append(Conflict(*strings[i], f'same new name as {pairs[first][0].name}'))
+
+    if existing is None:
+        def exists(i: int) -> bool:
+            return os.path.lexists(strings[i][1])
+    else:
+        index = {key(os.fspath(path)) for path in existing}
+
+        def exists(i: int) -> bool:
+            return target_keys[i] in index
+
+    # Where a target is the source of another rename, that rename must move out of the way first.
+    depends = [-1] * len(pairs)
+    dependant = [-1] * len(pairs)
+    clashes = []
+    for i, target in enumerate(target_keys):
+        if dropped[i]:
+            continue
+        j = sources.get(target, i)
+        if j != i:
+            depends[i] = j
+            dependant[j] = i
+        elif target != source_keys[i] and exists(i):
+            clashes.append(i)
+
+    # A rename that is dropped leaves its source in place, which blocks whatever was waiting for it.
+    clashes.extend(dependant[j] for j in range(len(pairs)) if dropped[j] and dependant[j] != -1)
+    while clashes:
+        i = clashes.pop()
+        if dropped[i]:
+            continue
+        dropped[i] = True
+        plan.conflicts.append(Conflict(*strings[i], 'target already exists'))
+        if dependant[i] != -1:
+            clashes.append(dependant[i])
+
+    suffix = uuid.uuid4().hex[:8]
+    seen = [False] * len(pairs)
+    for i, (source, target) in enumerate(pairs):
+        if dropped[i]:
+            continue
+        if depends[i] == -1 and (dependant[i] == -1 or dropped[dependant[i]]):
+            plan.direct.append((source, target))
+            continue
+        plan.linked.append((source, target, source.with_name(f'.{source.name}.{suffix}-{i}.renaming')))
+        if not seen[i]:
+            plan.cycles += _is_cycle(i, depends, seen)
+    if folders:
+        # Each folder is looked up once, however many files move into it.
+        parents = {target.parent for source, target in plan.pairs() if target.parent != source.parent}
+        plan.folders = sorted(parent for parent in parents if not os.path.isdir(parent))
+    return plan
+
+
+def _path(path: PathLike) -> Path:
+    return path if isinstance(path, Path) else Path(path)
+
+
+def _is_cycle(start: int, depends: list[int], seen: list[bool]) -> bool:
+    i = start
+    while i != -1 and not seen[i]:
+        seen[i] = True
+        i = depends[i]
+    return i == start
+
+
+def execute_plan(plan: RenamePlan, progress: Optional[Callable[[RenameReport], None]] = None,
+                 between: Optional[Callable[[], None]] = None, **kwargs) -> tuple[RenameReport, set[str]]:
+    """
+    Runs a checked plan in two parallel phases, calling between() after the first one.
+    The report counts files, with the plan's conflicts included as failures.
+    Also returns the sources of every step that did not take effect, for the journal.
+    Keyword arguments go to execute_renames.
+    """
+    with profile.span('execute_plan', renames=len(plan)):
+        report, undone_steps = _execute_plan(plan, progress, between, **kwargs)
+    profile.count('rows_renamed', report.renamed)
+    return report, undone_steps
+
+
+def _execute_plan(plan: RenamePlan, progress: Optional[Callable[[RenameReport], None]],
+                  between: Optional[Callable[[], None]], **kwargs) -> tuple[RenameReport, set[str]]:
+    report = RenameReport(total=len(plan) + len(plan.conflicts))
+    report.failed = [(c.source, c.target, c.reason) for c in plan.conflicts]
+    undone_steps = set()
+    for folder in plan.folders:
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError:
+            # The renames into it fail and are reported one by one.
+            pass
+    finals = {str(temp): (str(source), str(target)) for source, target, temp in plan.linked}
+
+    def forward(base: int):
+        if progress is None:
+            return None
+
+        def update(phase: RenameReport):
+            report.renamed = base + phase.renamed
+            report.elapsed = phase.elapsed
+            progress(report)
+        return update
+
+    first = execute_renames(plan.direct + [(source, temp) for source, _, temp in plan.linked],
+                            progress=forward(0), **kwargs)
+    report.retries, report.latencies = first.retries, first.latencies
+    failed_temps = set()
+    for source, target, reason in first.failed:
+        undone_steps.add(source)
+        if target in finals:
+            # The second step of this rename never runs either.
+            failed_temps.add(target)
+            undone_steps.add(target)
+            target = finals[target][1]
+        report.failed.append((source, target, reason))
+    direct = first.renamed - (len(plan.linked) - len(failed_temps))
+    if not plan.linked:
+        report.renamed = direct
+        report.elapsed = first.elapsed
+        return report, undone_steps
+    if between is not None:
+        between()
+
+    second = execute_renames([(temp, target) for _, target, temp in plan.linked if str(temp) not in failed_temps],
+                             progress=forward(direct), **kwargs)
+    for temp, _, reason in second.failed:
+        source, target = finals[temp]
+        # Put the file back under its own name rather than leave it with a temporary one.
+        try:
+            rename_file(temp, source)
+            undone_steps.update([source, temp])
+        except OSError:
+            reason += f', left as {temp}'
+            undone_steps.add(temp)
+        report.failed.append((source, target, reason))
+
+    report.renamed = direct + second.renamed
+    report.elapsed = first.elapsed + second.elapsed
+    report.retries += second.retries
+    report.latencies.extend(second.latencies)
+    return report, undone_steps
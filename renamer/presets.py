@@ -0,0 +1,62 @@
+"""
+Saved rename presets.
+
+A preset is a RenameSpec saved under a name, as a JSON file in the presets folder
+of the data directory. The file has the same format --spec reads, holding only the
+options that differ from their defaults, so presets can be written by hand, picked
+in the GUI and used from the command line with --preset NAME.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from .engine import RenameSpec
+from .settings import data_dir
+
+SUFFIX = '.json'
+
+
+class Presets:
+    """
+    The presets kept in one directory.
+    """
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = Path(directory) if directory else data_dir() / 'presets'
+
+    def names(self) -> list[str]:
+        if not self.directory.is_dir():
+            return []
+        return sorted((path.stem for path in self.directory.glob(f'*{SUFFIX}')), key=str.lower)
+
+    def path(self, name: str) -> Path:
+        name = name.strip()
+        if not name or name.startswith('.') or '/' in name or os.sep in name:
+            raise ValueError(f'Invalid preset name: {name!r}')
+        return self.directory / f'{name}{SUFFIX}'
+
+    def load(self, name: str) -> RenameSpec:
+        """
+        Reads a preset. Raises FileNotFoundError for unknown names and ValueError for broken files.
+        """
+        with open(self.path(name), encoding='utf-8') as f:
+            return RenameSpec.from_dict(json.load(f))
+
+    def save(self, name: str, spec: RenameSpec) -> Path:
+        """
+        Writes a preset, replacing any preset of the same name in one step.
+        """
+        path = self.path(name)
+        defaults = RenameSpec().to_dict()
+        data = {key: value for key, value in spec.to_dict().items() if value != defaults[key]}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f'.{path.name}.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+        os.replace(temp, path)
+        return path
+
+    def delete(self, name: str) -> None:
+        self.path(name).unlink(missing_ok=True)
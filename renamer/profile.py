@@ -0,0 +1,149 @@
+"""
+Built-in instrumentation of the rename phases.
+
+Phases are timed with span() and work is counted with count(). Both do nothing
+but a flag check until profiling is enabled, with --profile FILE or the
+RENAMER_PROFILE environment variable. The collected data can be exported as JSON
+or, for a file name ending in .trace.json, as a Chrome trace (chrome://tracing or Perfetto).
+
+    with span('preview', rows=len(rows)):
+        ...
+    count('rows_previewed', len(rows))
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Optional, Union
+
+ENV = 'RENAMER_PROFILE'
+CHROME_SUFFIX = '.trace.json'
+# Spans kept in memory; past this only the totals keep growing.
+MAX_SPANS = 100_000
+
+
+class Profiler:
+    """
+    Collects timed spans and counters from any thread.
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.path: Optional[Path] = None
+        self.start = time.perf_counter()
+        self.spans: list[tuple[str, float, float, int, dict]] = []
+        self.totals: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def enable(self, path: Union[Path, str, None] = None) -> None:
+        """
+        Starts collecting. path, if given, is where export() writes to by default.
+        """
+        self.reset()
+        self.enabled = True
+        self.path = Path(path) if path else None
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self.lock:
+            self.start = time.perf_counter()
+            self.spans = []
+            self.totals = {}
+            self.counters = {}
+
+    def span(self, name: str, **args):
+        """
+        Context manager timing the code it wraps. Keyword arguments are kept with the span.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name: str, args: dict):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, begin, time.perf_counter() - begin, args)
+
+    def add_span(self, name: str, begin: float, duration: float, args: Optional[dict] = None) -> None:
+        with self.lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append((name, begin - self.start, duration, threading.get_ident(), args or {}))
+            total = self.totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> dict:
+        """
+        Per span name its count, total and longest time in seconds, plus the counters.
+        """
+        with self.lock:
+            spans = {name: {'count': n, 'total': round(total, 6), 'max': round(longest, 6)}
+                     for name, (n, total, longest) in self.totals.items()}
+            return {'spans': spans, 'counters': dict(self.counters)}
+
+    def to_json(self) -> dict:
+        data = self.summary()
+        with self.lock:
+            data['events'] = [{'name': name, 'start': round(begin, 6), 'duration': round(duration, 6),
+                               'thread': thread, **({'args': args} if args else {})}
+                              for name, begin, duration, thread, args in self.spans]
+        return data
+
+    def to_chrome_trace(self) -> dict:
+        """
+        The spans as complete ('X') events and the counters as one counter ('C') event,
+        in the Trace Event Format that chrome://tracing and Perfetto load.
+        """
+        pid = os.getpid()
+        with self.lock:
+            events = [{'name': name, 'ph': 'X', 'ts': begin * 1e6, 'dur': duration * 1e6,
+                       'pid': pid, 'tid': thread, 'args': args}
+                      for name, begin, duration, thread, args in self.spans]
+            end = max((begin + duration for _, begin, duration, _, _ in self.spans), default=0.0)
+            if self.counters:
+                events.append({'name': 'counters', 'ph': 'C', 'ts': end * 1e6, 'pid': pid, 'tid': 0,
+                               'args': dict(self.counters)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path: Union[Path, str, None] = None) -> Optional[Path]:
+        """
+        Writes the profile to path (or the path it was enabled with), as a Chrome trace
+        if the name ends in .trace.json and as JSON otherwise. Returns the path written.
+        """
+        path = Path(path) if path else self.path
+        if path is None:
+            return None
+        data = self.to_chrome_trace() if path.name.endswith(CHROME_SUFFIX) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return path
+
+
+profiler = Profiler()
+span = profiler.span
+count = profiler.count
+
+
+def enable_from_env(path: Union[Path, str, None] = None) -> bool:
+    """
+    Enables profiling if a path is given or RENAMER_PROFILE is set. Returns whether it is on.
+    """
+    path = path or os.environ.get(ENV)
+    if path:
+        profiler.enable(path)
+    return profiler.enabled
@@ -1,50 +1,549 @@
+"""
+Headless command line renamer.
+
+Streams a directory with os.scandir, runs each chunk of names through a compiled
+rename pipeline and writes one JSON Lines record per planned or executed rename.
+Memory use stays constant however large the directory is (apart from remembering
+what has already been renamed), and Qt is never imported. Given several
+directories, up to --jobs of them are renamed at once and one report covers all.
+
+    python -m renamer.renamer DIRECTORY [--spec FILE] [rename options] [--dry-run]
+    python -m renamer.renamer DIRECTORY... --preset NAME --jobs 8 --report report.json
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import MISSING, dataclass, field, fields
+from typing import Iterable, Iterator, Optional, TextIO, Union
 from pathlib import Path
 
+from . import profile
+from .engine import CASES, CROP_POSITIONS, Pipeline, RenameSpec, compile_spec
+from .executor import WORKERS, RenameReport, RetryPolicy, rename_file
+from .planner import check_plan, execute_plan
+from .journal import Journal
+from .metadata import MetadataCache, extract, find_duplicates
+from .presets import Presets
+from .scan import parse_extensions, scan_entries, walk
+
+CHUNK_SIZE = 5000
+# Directories renamed at the same time when several are given.
+JOBS = 4
+SORTS = ['none', 'name', 'mtime']
+
 
-def rename(loc):
-    old = input('Enter the old name: ')
-    new = input('Enter the new name:')
+def rename(loc: Path, old: str, new: str) -> list[str]:
+    """
+    Renames every file in loc named old (any extension) to new, keeping the extension.
+    Returns the names that could not be renamed.
+    """
     failed = []
     for f in loc.iterdir():
-        if f.is_file():
-            name = f.stem
-            ext = f.suffix
-            if name == old:
-                target = loc / f'{new}{ext}'
-                try:
-                    f.rename(target)
-                except PermissionError:
-                    failed.append(name)
-
-    return(failed)
-
-
-def remove(loc):
-    chars = input('Enter the characters to remove: ')
-    ext_in = input('Enter the filetype(s) (blank for all, comma separated): ')
-    ext_list = [f'.{val.strip().lower()}' for val in ext_in.split(',')]
+        if f.is_file() and f.stem == old:
+            try:
+                rename_file(f, loc / f'{new}{f.suffix}')
+            except OSError:
+                failed.append(f.stem)
+    return failed
+
+
+def remove(loc: Path, chars: str, extensions: Optional[list[str]] = None) -> list[str]:
+    """
+    Removes chars from the name of every file in loc, optionally only for some extensions.
+    Returns the names that could not be renamed.
+    """
+    ext_list = [f'.{ext.strip().lower().lstrip(".")}' for ext in extensions or [] if ext.strip()]
     failed = []
     for f in loc.iterdir():
-        if f.is_file():
-            name = f.stem
-            ext = f.suffix.lower()
-            target = loc / f'{name.replace(chars, "")}{ext}'
-            if ext in ext_list or not ext_list:
-                try:
-                    f.rename(target)
-                except PermissionError:
-                    failed.append(name)
-
+        if f.is_file() and (not ext_list or f.suffix.lower() in ext_list):
+            name = f.stem.replace(chars, '')
+            if name == f.stem:
+                continue
+            try:
+                rename_file(f, loc / f'{name}{f.suffix}')
+            except OSError:
+                failed.append(f.stem)
     return failed
 
 
+def select(listing: Iterable[tuple[str, str, bool, float]], extensions: Optional[set[str]] = None,
+           dirs: bool = False, sort: str = 'none') -> Iterator[tuple[str, str]]:
+    """
+    Picks the (stem, suffix) of the entries to rename from a directory listing.
+    Sorting needs the whole listing in memory; 'none' keeps directory order and streams.
+    """
+    selected = ((stem, suffix, mtime) for stem, suffix, is_dir, mtime in listing
+                if (dirs or not is_dir) and (not extensions or suffix.lower() in extensions))
+    if sort == 'name':
+        selected = sorted(selected, key=lambda entry: (entry[0].lower(), entry[1].lower()))
+    elif sort == 'mtime':
+        selected = sorted(selected, key=lambda entry: entry[2])
+    for stem, suffix, _ in selected:
+        yield stem, suffix
+
+
+def entries(directory: Union[Path, str], **kwargs) -> Iterator[tuple[str, str]]:
+    """
+    Streams the (stem, suffix) of every entry to rename in a directory, see select().
+    """
+    return select(scan_entries(directory), **kwargs)
+
+
+def plan(directory: Union[Path, str], pipeline: Pipeline, chunk_size: int = CHUNK_SIZE,
+         skip: Optional[set[str]] = None, cache: Optional[MetadataCache] = None,
+         listing: Optional[Iterable[tuple[str, str, bool, float]]] = None,
+         **kwargs) -> Iterator[list[tuple[Path, Path]]]:
+    """
+    Yields chunks of (source, target) paths for every entry whose name changes.
+    Entries whose path is in skip are passed over: the directory may still be being
+    listed while earlier chunks are renamed, and a renamed file must not be renamed again.
+    If the pipeline uses tokens, metadata is read through cache. listing, if given, is
+    used instead of listing the directory. Other keyword arguments select the entries,
+    see entries().
+    """
+    directory = Path(directory)
+    offset = 0
+    chunk = []
+    selected = entries(directory, **kwargs) if listing is None else select(listing, **kwargs)
+    for entry in selected:
+        if skip and str(directory / f'{entry[0]}{entry[1]}') in skip:
+            continue
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield _plan_chunk(directory, pipeline, chunk, offset, cache)
+            offset += len(chunk)
+            chunk = []
+    if chunk:
+        yield _plan_chunk(directory, pipeline, chunk, offset, cache)
+
+
+def plan_tree(root: Union[Path, str], pipeline: Pipeline, chunk_size: int = CHUNK_SIZE,
+              workers: int = WORKERS, onerror=None, cache: Optional[MetadataCache] = None,
+              **kwargs) -> Iterator[list[tuple[Path, Path]]]:
+    """
+    Plans renames for root and every folder below it, walking folders in parallel.
+    Numbering restarts in every folder. Chunks come deepest folders first and never
+    mix depths, so renaming a folder can not invalidate a path that is still pending.
+    Unlike plan() this holds the planned renames of the whole tree in memory.
+    """
+    by_depth: dict[int, list[tuple[Path, list[tuple[Path, Path]]]]] = {}
+    for folder, depth, listing in walk(root, workers, onerror):
+        chosen = list(select(listing, **kwargs))
+        pairs = _plan_chunk(folder, pipeline, chosen, 0, cache)
+        if pairs:
+            by_depth.setdefault(depth, []).append((folder, pairs))
+
+    for depth in sorted(by_depth, reverse=True):
+        chunk = []
+        # Folders in path order so the output does not depend on which worker was fastest.
+        for _, pairs in sorted(by_depth.pop(depth)):
+            chunk.extend(pairs)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _plan_chunk(directory: Path, pipeline: Pipeline, chunk: list[tuple[str, str]],
+                offset: int, cache: Optional[MetadataCache] = None) -> list[tuple[Path, Path]]:
+    metadata = None
+    if pipeline.uses_metadata:
+        metadata = extract([directory / f'{stem}{suffix}' for stem, suffix in chunk], cache=cache,
+                           hashes='hash' in pipeline.tokens)
+    stems = [stem for stem, _ in chunk]
+    new_names = pipeline.apply(stems, offset, metadata)
+    if pipeline.destination is None:
+        return [(directory / f'{stem}{suffix}', directory / f'{new}{suffix}')
+                for (stem, suffix), new in zip(chunk, new_names) if new != stem]
+    folders = pipeline.destination.folders(directory, stems, metadata)
+    return [(directory / f'{stem}{suffix}', folder / f'{new}{suffix}')
+            for (stem, suffix), new, folder in zip(chunk, new_names, folders)
+            if new != stem or folder != directory]
+
+
+def duplicates(directories: Iterable[Union[Path, str]], recursive: bool = False, workers: int = WORKERS,
+               cache: Optional[MetadataCache] = None, onerror=None, **kwargs) -> list[list[Path]]:
+    """
+    Groups of files in the directories (and below them, if recursive) with the same content.
+    Other keyword arguments select the entries, see entries().
+    """
+    paths = []
+    for directory in map(Path, directories):
+        if recursive:
+            paths.extend(folder / f'{stem}{suffix}' for folder, _, listing in walk(directory, workers, onerror)
+                         for stem, suffix in select(listing, **kwargs))
+        else:
+            paths.extend(directory / f'{stem}{suffix}' for stem, suffix in entries(directory, **kwargs))
+    return find_duplicates(paths, workers, cache)
+
+
+def run(pairs_chunks: Iterator[list[tuple[Path, Path]]], output: TextIO, dry_run: bool = False,
+        workers: int = WORKERS, journal: Optional[Journal] = None,
+        renamed: Optional[set[str]] = None, folders: bool = False,
+        retry: Optional[RetryPolicy] = None) -> RenameReport:
+    """
+    Writes a JSON Lines record for every planned rename and, unless dry_run, executes
+    the plan chunk by chunk. Each chunk is checked for collisions and journalled before
+    it runs. The new paths of renamed files are added to renamed, if given. With
+    folders, missing target folders are created, for pipelines that move files. With
+    retry, renames run on asyncio and transient errors are retried, see RetryPolicy.
+    """
+    total = RenameReport()
+    batch = journal.open() if journal is not None and not dry_run else None
+    try:
+        for pairs in pairs_chunks:
+            plan = check_plan(pairs, folders=folders)
+            conflicts = {conflict.source: conflict.reason for conflict in plan.conflicts}
+            total.total += len(pairs)
+            if dry_run:
+                for source, target in pairs:
+                    reason = conflicts.get(str(source))
+                    _write(output, source, target, 'planned' if reason is None else 'conflict', reason)
+                total.failed.extend((c.source, c.target, c.reason) for c in plan.conflicts)
+                output.flush()
+                continue
+            if batch is not None:
+                batch.plan(plan.steps())
+            report, undone = execute_plan(plan, workers=workers, retry=retry,
+                                          between=batch.second_phase if batch is not None else None)
+            if batch is not None:
+                batch.failed(undone)
+            failed = {source: reason for source, _, reason in report.failed}
+            for source, target in pairs:
+                reason = failed.get(str(source))
+                if reason is None:
+                    _write(output, source, target, 'renamed')
+                    if renamed is not None:
+                        renamed.add(str(target))
+                else:
+                    _write(output, source, target, 'conflict' if str(source) in conflicts else 'failed', reason)
+            output.flush()
+            total.renamed += report.renamed
+            total.failed.extend(report.failed)
+            total.retries += report.retries
+            total.latencies.extend(report.latencies)
+            total.elapsed += report.elapsed
+    finally:
+        if batch is not None:
+            batch.finish()
+            journal.prune()
+    return total
+
+
+@dataclass
+class JobResult:
+    """
+    Outcome of renaming one directory of a job queue. errors lists the folders
+    that could not be listed.
+    """
+    directory: str
+    report: RenameReport = field(default_factory=RenameReport)
+    elapsed: float = 0.0
+    errors: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        report = self.report
+        data = {'directory': self.directory, 'total': report.total, 'renamed': report.renamed,
+                'seconds': round(self.elapsed, 6), 'errors': self.errors,
+                'failed': [{'source': source, 'target': target, 'error': reason}
+                           for source, target, reason in report.failed]}
+        if report.latencies:
+            data['retries'] = report.retries
+            data['latency'] = {name: round(seconds, 6) for name, seconds in report.percentiles().items()}
+        return data
+
+
+@dataclass
+class JobsReport:
+    """
+    Outcome of a job queue, one result per directory in the order they were given.
+    """
+    results: list[JobResult]
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(result.report.total for result in self.results)
+
+    @property
+    def renamed(self) -> int:
+        return sum(result.report.renamed for result in self.results)
+
+    @property
+    def failed(self) -> int:
+        return sum(len(result.report.failed) for result in self.results)
+
+    @property
+    def errors(self) -> int:
+        return sum(len(result.errors) for result in self.results)
+
+    def summary(self) -> str:
+        text = (f'Renamed {self.renamed} of {self.total} in {len(self.results)} directories '
+                f'in {self.elapsed:.2f}s')
+        if self.failed:
+            text += f', {self.failed} failed'
+        if self.errors:
+            text += f', {self.errors} folders could not be listed'
+        return text
+
+    def to_dict(self) -> dict:
+        return {'directories': len(self.results), 'total': self.total, 'renamed': self.renamed,
+                'failed': self.failed, 'seconds': round(self.elapsed, 6),
+                'results': [result.to_dict() for result in self.results]}
+
+
+class SharedOutput:
+    """
+    Lets several jobs write records to one output without tearing lines.
+    """
+    def __init__(self, output: TextIO) -> None:
+        self.output = output
+        self.lock = threading.Lock()
+
+    def write(self, text: str) -> None:
+        with self.lock:
+            self.output.write(text)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.output.flush()
+
+
+def run_jobs(directories: Iterable[Union[Path, str]], pipeline: Pipeline, output: TextIO, jobs: int = JOBS,
+             dry_run: bool = False, workers: int = WORKERS, journal: Optional[Journal] = None,
+             recursive: bool = False, retry: Optional[RetryPolicy] = None, **kwargs) -> JobsReport:
+    """
+    Renames every directory with the same pipeline, up to jobs directories at a time.
+    Each directory is planned, journalled and renamed as its own batch, like a single
+    run(), and its records go to the shared output. Other keyword arguments select
+    the entries, see entries().
+    """
+    shared = SharedOutput(output)
+
+    def job(directory: Union[Path, str]) -> JobResult:
+        result = JobResult(str(directory))
+        begin = time.perf_counter()
+
+        def onerror(folder, error):
+            result.errors.append(f'{folder}: {error.strerror or error}')
+        # SQLite connections stay on the thread that made them.
+        cache = MetadataCache() if pipeline.uses_metadata else None
+        try:
+            with profile.span('job', directory=result.directory):
+                renamed = set()
+                if recursive:
+                    chunks = plan_tree(directory, pipeline, workers=workers, onerror=onerror, cache=cache, **kwargs)
+                else:
+                    chunks = plan(directory, pipeline, skip=renamed, cache=cache, **kwargs)
+                result.report = run(chunks, shared, dry_run=dry_run, workers=workers, journal=journal,
+                                    renamed=renamed, folders=pipeline.destination is not None, retry=retry)
+        except OSError as e:
+            onerror(directory, e)
+        finally:
+            if cache is not None:
+                cache.close()
+            result.elapsed = time.perf_counter() - begin
+        return result
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(job, directories))
+    return JobsReport(results, time.perf_counter() - begin)
+
+
+def _write(output: TextIO, source: Path, target: Path, status: str, error: Optional[str] = None) -> None:
+    record = {'source': str(source), 'target': str(target), 'status': status}
+    if error is not None:
+        record['error'] = error
+    output.write(json.dumps(record) + '\n')
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Rename files in a directory without the GUI. '
+                                                 'Writes one JSON line per rename.')
+    parser.add_argument('directories', metavar='directory', nargs='+',
+                        help='Directory to rename files in; several are renamed as a job queue')
+    parser.add_argument('-p', '--preset', help='Saved preset of rename options to start from')
+    parser.add_argument('-s', '--spec', help='JSON file of rename options; options given here override it')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only write the plan, rename nothing')
+    parser.add_argument('-o', '--output', help='File for the JSON Lines records (default stdout)')
+    parser.add_argument('-e', '--ext', help='Only rename these file types (comma separated)')
+    parser.add_argument('--dirs', action='store_true', help='Rename folders as well as files')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Rename in every folder below the directory too, numbering each folder separately')
+    parser.add_argument('--sort', choices=SORTS, default='none',
+                        help='Order used for auto-numbering; sorting holds the listing in memory')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help='Parallel renames')
+    parser.add_argument('--retries', type=int, default=0,
+                        help='Retry renames failing with a transient error such as EBUSY or EACCES up to this '
+                             'many times, with jittered backoff (renames then run on asyncio)')
+    parser.add_argument('--deadline', type=float, default=RetryPolicy.deadline,
+                        help='Seconds after which a failing rename is no longer retried')
+    parser.add_argument('-j', '--jobs', type=int, default=JOBS,
+                        help='Directories renamed at the same time when several are given')
+    parser.add_argument('--report', metavar='FILE',
+                        help='Write a JSON report with the timings and failures of each directory to FILE')
+    parser.add_argument('--duplicates', action='store_true',
+                        help='Only write one JSON line per group of files with the same content, rename nothing')
+    parser.add_argument('--no-journal', action='store_true', help='Do not journal the renames for undo')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not print a summary to stderr')
+    parser.add_argument('--profile', metavar='FILE',
+                        help=f'Time each phase and write the profile to FILE, as a Chrome trace '
+                             f'if FILE ends in {profile.CHROME_SUFFIX} (also enabled by {profile.ENV}=FILE)')
+
+    # One option per RenameSpec field, e.g. --replace-search or --num-prefix.
+    options = parser.add_argument_group('rename options')
+    for field in fields(RenameSpec):
+        flag = f'--{field.name.replace("_", "-")}'
+        if field.type is bool:
+            options.add_argument(flag, action='store_true', default=argparse.SUPPRESS)
+        elif field.name == 'case':
+            options.add_argument(flag, choices=CASES, default=argparse.SUPPRESS)
+        elif field.name == 'remove_crop_pos':
+            options.add_argument(flag, choices=CROP_POSITIONS, default=argparse.SUPPRESS)
+        else:
+            default = field.default if field.default is not MISSING else None
+            options.add_argument(flag, type=field.type, default=argparse.SUPPRESS,
+                                 help=f'(default: {default!r})')
+    return parser.parse_args(argv)
+
+
+def spec_from_args(args) -> RenameSpec:
+    data = {}
+    if args.preset:
+        data = Presets().load(args.preset).to_dict()
+    if args.spec:
+        with open(args.spec, encoding='utf-8') as f:
+            data.update(json.load(f))
+    for field in fields(RenameSpec):
+        if hasattr(args, field.name):
+            data[field.name] = getattr(args, field.name)
+    return RenameSpec.from_dict(data)
+
+
+def extensions_from_args(args) -> Optional[set[str]]:
+    return parse_extensions(args.ext)
+
+
+def retry_from_args(args) -> Optional[RetryPolicy]:
+    return RetryPolicy(retries=args.retries, deadline=args.deadline) if args.retries > 0 else None
+
+
+def main(argv=None) -> int:
+    args = get_args(argv)
+    if profile.enable_from_env(args.profile):
+        try:
+            return _main(args)
+        finally:
+            profile.profiler.export()
+            profile.profiler.disable()
+    return _main(args)
+
+
+def _main(args) -> int:
+    if args.duplicates:
+        return _duplicates(args)
+    try:
+        pipeline = compile_spec(spec_from_args(args))
+    except (OSError, ValueError, TypeError) as e:
+        print(f'Invalid rename options: {e}', file=sys.stderr)
+        return 2
+    if len(args.directories) > 1 or args.report:
+        return _jobs(args, pipeline)
+    directory = args.directories[0]
+    extensions = extensions_from_args(args)
+    renamed = set()
+    cache = MetadataCache() if pipeline.uses_metadata else None
+    if args.recursive:
+        def onerror(folder, error):
+            print(f'Could not list {folder}: {error.strerror or error}', file=sys.stderr)
+        chunks = plan_tree(directory, pipeline, workers=args.workers, onerror=onerror, cache=cache,
+                           extensions=extensions, dirs=args.dirs, sort=args.sort)
+    else:
+        chunks = plan(directory, pipeline, skip=renamed, cache=cache,
+                      extensions=extensions, dirs=args.dirs, sort=args.sort)
+    journal = None if args.no_journal else Journal()
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        report = run(chunks, output, dry_run=args.dry_run, workers=args.workers, journal=journal,
+                     renamed=renamed, folders=pipeline.destination is not None, retry=retry_from_args(args))
+    except OSError as e:
+        print(f'Could not rename in {directory}: {e}', file=sys.stderr)
+        return 2
+    finally:
+        if args.output:
+            output.close()
+        if cache is not None:
+            cache.close()
+
+    if not args.quiet:
+        if args.dry_run:
+            print(f'Planned {report.total} renames, {len(report.failed)} conflicts', file=sys.stderr)
+        else:
+            print(report.summary(), file=sys.stderr)
+    return 1 if report.failed else 0
+
+
+def _jobs(args, pipeline: Pipeline) -> int:
+    journal = None if args.no_journal else Journal()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        report = run_jobs(args.directories, pipeline, output, jobs=args.jobs, dry_run=args.dry_run,
+                          workers=args.workers, journal=journal, recursive=args.recursive,
+                          retry=retry_from_args(args), extensions=extensions_from_args(args), dirs=args.dirs,
+                          sort=args.sort)
+    finally:
+        if args.output:
+            output.close()
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report.to_dict(), f, indent=2)
+    if not args.quiet:
+        for result in report.results:
+            for error in result.errors:
+                print(f'Could not list {error}', file=sys.stderr)
+            if args.dry_run:
+                print(f'{result.directory}: planned {result.report.total} renames, '
+                      f'{len(result.report.failed)} conflicts', file=sys.stderr)
+            else:
+                print(f'{result.directory}: {result.report.summary()}', file=sys.stderr)
+        if args.dry_run:
+            print(f'Planned {report.total} renames in {len(report.results)} directories, '
+                  f'{report.failed} conflicts', file=sys.stderr)
+        else:
+            print(report.summary(), file=sys.stderr)
+    if report.errors:
+        return 2
+    return 1 if report.failed else 0
+
+
+def _duplicates(args) -> int:
+    extensions = extensions_from_args(args)
+    cache = MetadataCache()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        groups = duplicates(args.directories, args.recursive, args.workers, cache, extensions=extensions,
+                            sort=args.sort)
+        for group in groups:
+            output.write(json.dumps({'duplicates': [str(path) for path in group],
+                                     'size': group[0].stat().st_size}) + '\n')
+    except OSError as e:
+        print(f'Could not list {e.filename}: {e.strerror or e}', file=sys.stderr)
+        return 2
+    finally:
+        if args.output:
+            output.close()
+        cache.close()
+    if not args.quiet:
+        print(f'Found {len(groups)} groups of duplicates, {sum(map(len, groups))} files', file=sys.stderr)
+    return 0
+
+
 if __name__ == "__main__":
-    opts = [rename, remove]
-    for i, opt in enumerate(opts):
-        print(f'{i}: {opt.__name__}')
-    val = int(input('Select a function: '))
-    loc = Path(input('Enter the directory path: '))
-
-    fn = opts[val]
-    errors = fn(loc)
-    [print(fail) for fail in errors]
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, Optional, Union
+from pathlib import Path
+
+from . import profile
+
+# Column lists for a batch of entries: stems, suffixes, folder flags and mtimes.
+Chunk = tuple[list[str], list[str], list[bool], list[float]]
+
+
+def split_name(name: str) -> tuple[str, str]:
+    """
+    Splits a file name into stem and suffix the same way pathlib does.
+    """
+    i = name.rfind('.')
+    if 0 < i < len(name) - 1:
+        return name[:i], name[i:]
+    return name, ''
+
+
+def parse_extensions(text: Optional[str]) -> Optional[set[str]]:
+    """
+    Turns 'jpg, .PNG' into {'.jpg', '.png'}, or None if no extensions are given.
+    """
+    if not text or not text.strip(', '):
+        return None
+    return {f'.{ext.strip().lower().lstrip(".")}' for ext in text.split(',') if ext.strip()}
+
+
+def scan_entries(path: Union[Path, str]) -> Iterator[tuple[str, str, bool, float]]:
+    """
+    Streams (stem, suffix, is_dir, mtime) for each entry of a directory using os.scandir.
+    Folders keep their full name as the stem.
+    """
+    scanned = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                listed = entry_tuple(entry)
+                if listed is not None:
+                    scanned += 1
+                    yield listed
+    finally:
+        profile.count('rows_scanned', scanned)
+
+
+def entry_tuple(entry: os.DirEntry) -> Optional[tuple[str, str, bool, float]]:
+    """
+    The (stem, suffix, is_dir, mtime) of a scandir entry, or None if it has gone.
+    """
+    try:
+        folder = entry.is_dir()
+        mtime = entry.stat().st_mtime
+    except OSError:
+        # Broken links and entries removed mid-scan fall back to the link itself.
+        try:
+            folder = False
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+        except OSError:
+            return None
+    if folder:
+        return entry.name, '', True, mtime
+    stem, suffix = split_name(entry.name)
+    return stem, suffix, False, mtime
+
+
+def scan_changes(path: Union[Path, str], known: set[str]
+                 ) -> tuple[list[tuple[str, str, bool, float]], set[str]]:
+    """
+    Compares a directory with the names already known to be in it. Returns the
+    entries of names that are new, stat-ing only those, and the known names that are gone.
+    """
+    gone = set(known)
+    added = []
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if name in gone:
+                gone.discard(name)
+            elif name not in known:
+                listed = entry_tuple(entry)
+                if listed is not None:
+                    added.append(listed)
+    return added, gone
+
+
+def scan_chunks(path: Union[Path, str], size: int = 5000, first: int = 250,
+                cancelled: Optional[Callable[[], bool]] = None) -> Iterator[Chunk]:
+    """
+    Groups scan_entries into column chunks. The first chunk is small so something
+    can be shown straight away, later chunks double up to size.
+    Stops early once cancelled() returns True.
+    """
+    chunk: Chunk = ([], [], [], [])
+    names, suffixes, is_dir, mtimes = chunk
+    limit = min(first, size)
+    for stem, suffix, folder, mtime in scan_entries(path):
+        if cancelled is not None and cancelled():
+            return
+        names.append(stem)
+        suffixes.append(suffix)
+        is_dir.append(folder)
+        mtimes.append(mtime)
+        if len(names) >= limit:
+            yield chunk
+            chunk = ([], [], [], [])
+            names, suffixes, is_dir, mtimes = chunk
+            limit = min(limit * 2, size)
+    if names:
+        yield chunk
+
+
+def walk(root: Union[Path, str], workers: int = 8,
+         onerror: Optional[Callable[[Path, OSError], None]] = None
+         ) -> Iterator[tuple[Path, int, list[tuple[str, str, bool, float]]]]:
+    """
+    Lists root and every folder below it, several folders at a time on a thread pool.
+    Yields (folder, depth, entries) as each listing completes, so folders arrive in no
+    fixed order. Symlinked folders are listed as entries but not walked into.
+    """
+    root = Path(root)
+    pending = set()
+
+    def listing(folder: Path, depth: int):
+        return folder, depth, list(scan_entries(folder))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending.add(pool.submit(listing, root, 0))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    folder, depth, entries = future.result()
+                except OSError as e:
+                    if onerror is not None:
+                        onerror(Path(e.filename) if e.filename else root, e)
+                    continue
+                for stem, _, is_dir, _ in entries:
+                    child = folder / stem
+                    if is_dir and not child.is_symlink():
+                        pending.add(pool.submit(listing, child, depth + 1))
+                yield folder, depth, entries
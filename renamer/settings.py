@@ -0,0 +1,10 @@
+import os
+from pathlib import Path
+
+
+def data_dir() -> Path:
+    """
+    Directory for the renamer's own files (journal, caches, presets).
+    Defaults to ~/.bulk-renamer and can be moved with the RENAMER_HOME environment variable.
+    """
+    return Path(os.environ.get('RENAMER_HOME') or Path.home() / '.bulk-renamer')
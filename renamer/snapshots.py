@@ -0,0 +1,141 @@
+"""
+Persistent snapshots of directory listings.
+
+Opening a large folder again lists it from a snapshot saved the last time it was
+scanned, as long as the folder's device, inode and mtime are unchanged: adding,
+removing or renaming an entry updates the folder's mtime and so invalidates it.
+Files changed in place do not touch the folder, so their mtimes are shown as they
+were when the snapshot was taken until the folder itself changes.
+
+Snapshots are kept in an SQLite file next to the journal, one row per folder with
+each column of the listing packed into a blob, and the least recently opened ones
+are dropped once they add up to more than SNAPSHOT_BYTES.
+
+    cache = SnapshotCache()
+    for chunk in cached_chunks(path, cache):
+        model.append_chunk(chunk)
+"""
+
+import os
+import sqlite3
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Union
+
+from . import profile
+from .scan import Chunk, scan_chunks
+from .settings import data_dir
+
+# Total size of the saved snapshots; the least recently opened are dropped beyond it.
+SNAPSHOT_BYTES = 64 * 1024 * 1024
+# Folders with fewer entries are quicker to scan than to save.
+MIN_ENTRIES = 1000
+# A listing taken this soon after its directory changed is not kept: filesystems
+# stamp mtimes with a coarse clock, so a change in the same tick would go unnoticed.
+RACY_NS = 50_000_000
+
+PathLike = Union[Path, str]
+
+
+def pack_names(names: list[str]) -> bytes:
+    # File names never contain NUL; surrogateescape keeps undecodable bytes intact.
+    return zlib.compress('\0'.join(names).encode('utf-8', 'surrogateescape'), 1)
+
+
+def unpack_names(blob: bytes, count: int) -> list[str]:
+    if not count:
+        return []
+    return zlib.decompress(blob).decode('utf-8', 'surrogateescape').split('\0')
+
+
+class SnapshotCache:
+    """
+    Listings by folder path, each used while the folder's device, inode and mtime are unchanged.
+    """
+    def __init__(self, path: Optional[PathLike] = None, limit: int = SNAPSHOT_BYTES) -> None:
+        self.path = Path(path) if path else data_dir() / 'snapshots.sqlite'
+        self.limit = limit
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS snapshots (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, '
+                        'mtime INTEGER, used REAL, bytes INTEGER, count INTEGER, '
+                        'names BLOB, suffixes BLOB, is_dir BLOB, mtimes BLOB)')
+
+    def get(self, directory: PathLike, st: Optional[os.stat_result] = None) -> Optional[Chunk]:
+        """
+        The saved (names, suffixes, is_dir, mtimes) of a folder, or None if there is
+        none or the folder changed since. st is the folder's stat, if already taken.
+        """
+        key = os.path.abspath(directory)
+        st = st or os.stat(key)
+        row = self.db.execute('SELECT count, names, suffixes, is_dir, mtimes FROM snapshots '
+                              'WHERE path = ? AND dev = ? AND ino = ? AND mtime = ?',
+                              (key, st.st_dev, st.st_ino, st.st_mtime_ns)).fetchone()
+        if row is None:
+            return None
+        count, names, suffixes, is_dir, mtimes = row
+        with self.db:
+            self.db.execute('UPDATE snapshots SET used = ? WHERE path = ?', (time.time(), key))
+        times = array('d')
+        times.frombytes(mtimes)
+        return unpack_names(names, count), unpack_names(suffixes, count), list(map(bool, is_dir)), times.tolist()
+
+    def put(self, directory: PathLike, st: os.stat_result, chunk: Chunk) -> bool:
+        """
+        Saves the listing of a folder as of its stat st, dropping the least recently
+        opened snapshots to stay within the limit. Returns whether it was kept.
+        """
+        key = os.path.abspath(directory)
+        names, suffixes, is_dir, mtimes = chunk
+        blobs = (pack_names(names), pack_names(suffixes), bytes(is_dir), array('d', mtimes).tobytes())
+        size = sum(map(len, blobs))
+        with self.db:
+            self.db.execute('DELETE FROM snapshots WHERE path = ?', (key,))
+            if size > self.limit:
+                return False
+            self.db.execute('INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (key, st.st_dev, st.st_ino, st.st_mtime_ns, time.time(), size, len(names), *blobs))
+            total = 0
+            stale = []
+            for path, length in self.db.execute('SELECT path, bytes FROM snapshots ORDER BY used DESC'):
+                total += length
+                if total > self.limit:
+                    stale.append((path,))
+            self.db.executemany('DELETE FROM snapshots WHERE path = ?', stale)
+        return True
+
+    def forget(self, directory: PathLike) -> None:
+        with self.db:
+            self.db.execute('DELETE FROM snapshots WHERE path = ?', (os.path.abspath(directory),))
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def cached_chunks(path: PathLike, cache: SnapshotCache, cancelled: Optional[Callable[[], bool]] = None
+                  ) -> Iterator[Chunk]:
+    """
+    Like scan.scan_chunks, but yields the whole saved listing as one chunk when the
+    folder is unchanged since it was saved, and saves a complete scan of a large folder.
+    """
+    st = os.stat(path)
+    with profile.span('snapshot_load'):
+        snapshot = cache.get(path, st)
+    if snapshot is not None:
+        profile.count('snapshot_hits')
+        yield snapshot
+        return
+    started = time.time_ns()
+    listing: Chunk = ([], [], [], [])
+    for chunk in scan_chunks(path, cancelled=cancelled):
+        for column, values in zip(listing, chunk):
+            column.extend(values)
+        yield chunk
+    if cancelled is not None and cancelled() or len(listing[0]) < MIN_ENTRIES:
+        return
+    after = os.stat(path)
+    if after.st_mtime_ns == st.st_mtime_ns and st.st_mtime_ns < started - RACY_NS:
+        with profile.span('snapshot_save', rows=len(listing[0])):
+            cache.put(path, st, listing)
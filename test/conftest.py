@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    QApplication = pytest.importorskip('PySide6.QtWidgets').QApplication
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture(autouse=True)
+def renamer_home(tmp_path_factory, monkeypatch):
+    home = tmp_path_factory.mktemp('renamer_home')
+    monkeypatch.setenv('RENAMER_HOME', str(home))
+    return home
@@ -0,0 +1,22 @@
+import os
+
+from benchmarks.bench import compare, run_benchmarks
+
+
+def test_small_run(qapp, renamer_home):
+    results = run_benchmarks([200], qt=True)
+    phases = results['results']['200']
+    assert {'scan', 'preview', 'plan', 'rename', 'qt_files', 'qt_reopen', 'qt_preview', 'qt_finalize'} <= set(phases)
+    assert all(phase['seconds'] >= 0 for phase in phases.values())
+    # The benchmark journals elsewhere and leaves the environment as it found it.
+    assert os.environ['RENAMER_HOME'] == str(renamer_home)
+    assert not (renamer_home / 'journal').exists()
+
+
+def test_compare():
+    baseline = {'results': {'1000': {'scan': {'seconds': 1.0}, 'plan': {'seconds': 0.001}}}}
+    current = {'results': {'1000': {'scan': {'seconds': 1.5}, 'plan': {'seconds': 0.003}},
+                           '5000': {'scan': {'seconds': 9.0}}}}
+    # plan is 3x slower but only by 2ms, and 5000 has no baseline.
+    assert compare(current, baseline) == ['1000 scan: 1.000s -> 1.500s (1.50x)']
+    assert compare(current, baseline, tolerance=0.6) == []
@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from renamer.daemon import ListingCache, RenameDaemon, submit
+from renamer.presets import Presets
+from renamer.engine import RenameSpec
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    server = RenameDaemon(tmp_path / 'd.sock')
+    server.bind()
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def make_files(directory, names):
+    directory.mkdir()
+    for name in names:
+        (directory / name).touch()
+    # Age the directory past the racy window, so its listing can be cached.
+    old = time.time() - 10
+    os.utime(directory, (old, old))
+    return directory
+
+
+def test_daemon_streams_records(daemon, tmp_path):
+    files = make_files(tmp_path / 'files', ['a.txt', 'b.txt', 'c.pdf'])
+    job = {'id': 7, 'directory': str(files), 'spec': {'name': 'x', 'num_suffix': True},
+           'ext': 'txt', 'sort': 'name', 'dry_run': True}
+    records = list(submit(job, daemon.path))
+    assert [(r['source'], r['target'], r['status']) for r in records[:-1]] == [
+        (str(files / 'a.txt'), str(files / 'x1.txt'), 'planned'),
+        (str(files / 'b.txt'), str(files / 'x2.txt'), 'planned')]
+    assert records[-1] == {'id': 7, 'done': True, 'total': 2, 'renamed': 0, 'failed': 0, 'seconds': 0.0}
+
+    # The second job reuses the listing.
+    list(submit(job, daemon.path))
+    assert (daemon.listings.hits, daemon.listings.misses) == (1, 1)
+
+    Presets().save('upper', RenameSpec(case='upper'))
+    records = list(submit({'directory': str(files), 'preset': 'upper'}, daemon.path))
+    assert records[-1]['renamed'] == 3
+    assert sorted(p.name for p in files.iterdir()) == ['A.txt', 'B.txt', 'C.pdf']
+    # Renaming drops the cached listing.
+    assert str(files) not in daemon.listings.listings
+
+
+def test_daemon_many_jobs_on_one_connection(daemon, tmp_path):
+    directories = [make_files(tmp_path / f'd{i}', ['a.txt']) for i in range(20)]
+    with socket.socket(socket.AF_UNIX) as client:
+        client.connect(str(daemon.path))
+        jobs = ''.join(json.dumps({'id': i, 'directory': str(d), 'spec': {'add_prefix': 'x'}}) + '\n'
+                       for i, d in enumerate(directories))
+        client.sendall(jobs.encode() + b'not json\n' + b'{"directory": "relative"}\n')
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile('r') as replies:
+            records = [json.loads(line) for line in replies]
+    done = [record for record in records if 'done' in record]
+    assert [record['id'] for record in done] == list(range(20))
+    assert all(record['renamed'] == 1 for record in done)
+    errors = [record for record in records if 'error' in record]
+    assert len(errors) == 2 and 'absolute' in errors[1]['error']
+    assert all((d / 'xa.txt').exists() for d in directories)
+
+
+def test_daemon_replaces_stale_socket(tmp_path):
+    path = tmp_path / 'd.sock'
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(str(path))
+    stale.close()
+    server = RenameDaemon(path)
+    server.bind()
+    assert oct(path.stat().st_mode & 0o777) == '0o600'
+    with pytest.raises(OSError):
+        RenameDaemon(path).bind()
+    server.server.server_close()
+
+
+def test_listing_cache(tmp_path, monkeypatch):
+    directory = make_files(tmp_path / 'files', ['a.txt'])
+    cache = ListingCache(size=1)
+    assert [entry[0] for entry in cache.get(directory)] == ['a']
+    cache.get(directory)
+    assert cache.hits == 1
+    (directory / 'b.txt').touch()
+    # Changed just now, so the new listing is read but not kept.
+    assert sorted(entry[0] for entry in cache.get(directory)) == ['a', 'b']
+    assert str(directory) not in cache.listings
+    other = make_files(tmp_path / 'other', [])
+    old = time.time() - 10
+    os.utime(directory, (old, old))
+    cache.get(directory)
+    cache.get(other)
+    assert list(cache.listings) == [str(other)]
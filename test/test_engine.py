@@ -0,0 +1,175 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import renamer.engine
+
+from renamer.engine import PatternError, PreviewCache, RenameSpec, compile_pattern, compile_spec, preview
+
+
+NAMES = ['file1', 'File Two', 'third_file']
+
+
+def test_default_spec_is_identity():
+    assert len(compile_spec(RenameSpec())) == 0
+    assert preview(RenameSpec(), NAMES) == NAMES
+
+
+def test_name_and_number():
+    spec = RenameSpec(name='photo', num_suffix=True, num_start=9, num_pad=3, num_sep='_')
+    assert preview(spec, NAMES) == ['photo_009', 'photo_010', 'photo_011']
+
+
+def test_replace_case_add():
+    spec = RenameSpec(replace_search='file', replace_with='doc', case='upper', case_except='doc',
+                      add_prefix='x-', add_insert='!', add_insert_pos=3, add_suffix='-y')
+    assert preview(spec, NAMES) == ['x-d!oc1-y', 'x-F!ILE TWO-y', 'x-T!HIRD_doc-y']
+
+
+def test_case_same_keeps_exceptions_untouched():
+    spec = RenameSpec(case='same', case_except='file')
+    assert preview(spec, NAMES) == NAMES
+
+
+def test_literal_mode_escapes():
+    names = ['a.b', 'axb', 'A.B (1)']
+    assert preview(RenameSpec(replace_search='.', replace_with='-'), names) == ['a-b', 'axb', 'A-B (1)']
+    # The exception is matched as text, so '.' does not keep 'x' lower case.
+    spec = RenameSpec(case='upper', case_except='a.b')
+    assert preview(spec, names) == ['a.b', 'AXB', 'A.B (1)']
+    assert preview(RenameSpec(remove_words='(1)'), names) == names[:2] + ['A.B ']
+
+
+def test_regex_mode():
+    names = ['IMG_2020-01-05', 'scan 7 of 12', 'notes']
+    spec = RenameSpec(replace_search=r'(\d{4})-(\d\d)-(\d\d)', replace_with=r'\3.\2.\1', replace_regex=True)
+    assert preview(spec, names) == ['IMG_05.01.2020', 'scan 7 of 12', 'notes']
+    spec = RenameSpec(case='upper', case_except=r'\bof\b|o', case_regex=True)
+    assert preview(spec, names) == ['IMG_2020-01-05', 'SCAN 7 of 12', 'NoTES']
+    spec = RenameSpec(remove_words=r'\s*\d+', remove_crop=r'[a-z]+', remove_crop_pos='after', remove_regex=True)
+    assert preview(spec, names) == ['IMG_--', 'scan', 'notes']
+
+
+def test_invalid_patterns():
+    with pytest.raises(PatternError, match='Replace'):
+        compile_spec(RenameSpec(replace_search='(', replace_regex=True))
+    with pytest.raises(PatternError, match='Case'):
+        compile_spec(RenameSpec(case='upper', case_except='[a-', case_regex=True))
+    # Not a pattern at all in literal mode.
+    assert preview(RenameSpec(replace_search='(', replace_with=')'), ['(x']) == [')x']
+    with pytest.raises(PatternError, match='invalid group reference'):
+        compile_spec(RenameSpec(replace_search='(x)', replace_with=r'\2', replace_regex=True))
+
+
+def test_patterns_are_cached():
+    compile_pattern.cache_clear()
+    spec = RenameSpec(replace_search='a+', replace_with='b', replace_regex=True)
+    for _ in range(3):
+        compile_spec(spec)
+    assert compile_pattern.cache_info().misses == 1
+
+
+def test_remove():
+    spec = RenameSpec(remove_first=1, remove_last=1, remove_chars='_', remove_words='ir')
+    assert preview(spec, NAMES) == ['ile', 'ile Tw', 'hdfil']
+    spec = RenameSpec(remove_from=2, remove_to=3)
+    assert preview(spec, NAMES) == ['fi1', 'Fi Two', 'thd_file']
+    spec = RenameSpec(remove_crop='_', remove_crop_pos='after')
+    assert preview(spec, NAMES) == ['file1', 'File Two', 'third_']
+    spec = RenameSpec(remove_crop='_', remove_crop_pos='before')
+    assert preview(spec, NAMES) == ['file1', 'File Two', '_file']
+
+
+def test_number_insert():
+    spec = RenameSpec(num_insert=True, num_pos=2, num_incr=2, num_sep='-')
+    assert preview(spec, NAMES[:2]) == ['fi-1-le1', 'Fi-3-le Two']
+
+
+def test_spec_from_dict():
+    spec = RenameSpec.from_dict({'name': 'a', 'case': 'lower'})
+    assert spec == RenameSpec(name='a', case='lower')
+    assert RenameSpec.from_dict(spec.to_dict()) == spec
+    with pytest.raises(ValueError):
+        RenameSpec.from_dict({'colour': 'red'})
+    with pytest.raises(ValueError):
+        RenameSpec.from_dict({'case': 'shout'})
+    for data in [{'remove_first': '1'}, {'num_prefix': 'no'}, {'num_pad': 'x'}, {'num_pad': True}, {'name': 3}]:
+        with pytest.raises(ValueError, match=next(iter(data))):
+            RenameSpec.from_dict(data)
+
+
+def test_move_stage(tmp_path):
+    pipeline = compile_spec(RenameSpec(move_to=' sorted/{artist} '))
+    assert pipeline.tokens == {'artist'} and len(pipeline) == 0
+    folders = pipeline.destination.folders(tmp_path, ['a', 'b', 'c'], [{'artist': 'AC/DC'}, {}, {'artist': 'X'}])
+    assert folders == [tmp_path / 'sorted' / 'AC_DC', tmp_path / 'sorted', tmp_path / 'sorted' / 'X']
+    assert compile_spec(RenameSpec(move_to='/a/../b')).destination.folders(tmp_path, ['a']) == [Path('/b')]
+    assert compile_spec(RenameSpec(move_to='  ')).destination is None
+
+
+def test_engine_does_not_import_qt():
+    code = 'import sys, renamer.engine; sys.exit("PySide6" in sys.modules)'
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
+
+
+def test_throughput():
+    count = 200_000
+    names = [f'IMG_{i:07d} holiday' for i in range(count)]
+    spec = RenameSpec(replace_search='IMG', replace_with='photo', case='lower',
+                      add_suffix='_x', remove_words='holiday', num_prefix=True, num_pad=7, num_sep=' ')
+    pipeline = compile_spec(spec)
+    begin = time.perf_counter()
+    new_names = pipeline.apply(names)
+    elapsed = time.perf_counter() - begin
+    assert new_names[0] == '0000001 photo_0000000 _x'
+    # 1M names should comfortably fit in a few seconds.
+    assert count / elapsed > 100_000, f'{count / elapsed:,.0f} names/s'
+
+
+def test_preview_cache_survives_pattern_errors():
+    cache = PreviewCache()
+    spec = RenameSpec(replace_search='e', replace_with='E')
+    assert cache.apply(spec, NAMES) == ['filE1', 'FilE Two', 'third_filE']
+    spec.replace_regex = True
+    spec.replace_search = '(e'
+    with pytest.raises(PatternError):
+        cache.apply(spec, NAMES)
+    spec.replace_search = '(e)'
+    spec.replace_with = r'[\1]'
+    assert cache.apply(spec, NAMES) == ['fil[e]1', 'Fil[e] Two', 'third_fil[e]']
+
+
+def test_preview_cache_reruns_from_changed_box():
+    cache = PreviewCache()
+    spec = RenameSpec(replace_search='file', replace_with='doc', num_suffix=True)
+    assert cache.apply(spec, NAMES) == ['doc11', 'File Two2', 'third_doc3']
+    assert cache.last_start == 0
+
+    spec.num_sep = '-'
+    assert cache.apply(spec, NAMES) == ['doc1-1', 'File Two-2', 'third_doc-3']
+    assert cache.last_start == 5
+
+    spec.case = 'upper'
+    assert cache.apply(spec, NAMES) == ['DOC1-1', 'FILE TWO-2', 'THIRD_DOC-3']
+    assert cache.last_start == 2
+
+    assert cache.apply(spec, NAMES[:2]) == ['DOC1-1', 'FILE TWO-2']
+    assert cache.last_start == 0
+
+
+def test_preview_cache_cancels_between_chunks(monkeypatch):
+    monkeypatch.setattr(renamer.engine, 'CANCEL_CHUNK', 2)
+    names = [f'file {i}' for i in range(7)]
+    metadata = [{'size': str(i)} for i in range(7)]
+    spec = RenameSpec(name='{size}', add_suffix='_x', num_prefix=True, num_start=10)
+    cache = PreviewCache()
+    assert cache.apply(spec, names, metadata, cancelled=lambda: False) == preview(spec, names, metadata)
+
+    checks = []
+    cache = PreviewCache()
+    assert cache.apply(spec, names, metadata, cancelled=lambda: checks.append(1) or len(checks) > 3) is None
+    # Nothing is kept from the cancelled run.
+    assert cache.names is None and len(checks) == 4
@@ -0,0 +1,180 @@
+import errno
+import os
+import threading
+import time
+
+import pytest
+
+import renamer.executor
+from renamer.executor import RetryPolicy, copy_fd, execute_renames, execute_renames_async, rename_file, transfer_file
+
+
+def test_execute_renames(tmp_path):
+    pairs = []
+    for i in range(300):
+        (tmp_path / f'{i}.txt').touch()
+        pairs.append((tmp_path / f'{i}.txt', tmp_path / f'new_{i}.txt'))
+    updates = []
+    report = execute_renames(pairs, workers=4, batch_size=16, progress=lambda r: updates.append(r.renamed))
+    assert report.renamed == report.total == 300
+    assert not report.failed
+    assert updates[-1] == 300 and 1 <= len(updates) <= 19
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f'new_{i}.txt' for i in range(300))
+    assert report.rate > 0
+
+
+def test_failures_are_collected(tmp_path):
+    for name in ['a.txt', 'b.txt', 'c.txt']:
+        (tmp_path / name).touch()
+    pairs = [(tmp_path / 'a.txt', tmp_path / 'b.txt'),
+             (tmp_path / 'missing.txt', tmp_path / 'd.txt'),
+             (tmp_path / 'c.txt', tmp_path / 'e.txt')]
+    report = execute_renames(pairs)
+    assert report.renamed == 1
+    assert [reason for _, _, reason in report.failed] == ['target already exists', 'No such file or directory']
+    assert (tmp_path / 'a.txt').exists() and (tmp_path / 'e.txt').exists()
+    assert '2 failed' in report.summary()
+    assert 'b.txt: target already exists' in report.failures()
+
+
+def test_rename_file_never_overwrites(tmp_path):
+    (tmp_path / 'a').write_text('a')
+    (tmp_path / 'b').write_text('b')
+    with pytest.raises(FileExistsError):
+        rename_file(tmp_path / 'a', tmp_path / 'b')
+    assert (tmp_path / 'b').read_text() == 'b'
+
+
+def test_cancelled(tmp_path):
+    (tmp_path / 'a').touch()
+    report = execute_renames([(tmp_path / 'a', tmp_path / 'b')], cancelled=lambda: True)
+    assert report.total == 0 and (tmp_path / 'a').exists()
+
+
+def other_filesystem(monkeypatch, folder):
+    # Renames from elsewhere into folder fail as they would across mounts.
+    real = os.rename
+
+    def rename(source, target):
+        if os.path.dirname(os.fspath(target)) == os.fspath(folder) != os.path.dirname(os.fspath(source)):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        real(source, target)
+    monkeypatch.setattr(os, 'rename', rename)
+
+
+def test_moves_across_filesystems(tmp_path, monkeypatch):
+    source, other = tmp_path / 'source', tmp_path / 'other'
+    source.mkdir()
+    other.mkdir()
+    data = os.urandom(3 << 20)
+    (source / 'big.bin').write_bytes(data)
+    (source / 'small.txt').write_text('small')
+    os.utime(source / 'small.txt', ns=(1_000_000_000, 1_000_000_000))
+    os.symlink('small.txt', source / 'link')
+    (source / 'folder').mkdir()
+    (other / 'taken.txt').touch()
+    (source / 'taken.txt').touch()
+    other_filesystem(monkeypatch, other)
+
+    names = ['big.bin', 'small.txt', 'link', 'folder', 'taken.txt']
+    report = execute_renames([(source / name, other / name) for name in names], batch_size=2)
+    assert report.renamed == 3
+    assert sorted((os.path.basename(s), reason) for s, _, reason in report.failed) == [
+        ('folder', 'Only files can be moved to another filesystem'), ('taken.txt', 'target already exists')]
+    assert (other / 'big.bin').read_bytes() == data
+    assert (other / 'small.txt').stat().st_mtime_ns == 1_000_000_000
+    assert os.readlink(other / 'link') == 'small.txt'
+    assert sorted(os.listdir(source)) == ['folder', 'taken.txt']
+    assert sorted(os.listdir(other)) == ['big.bin', 'link', 'small.txt', 'taken.txt']
+    with pytest.raises(FileExistsError):
+        transfer_file(source / 'taken.txt', other / 'taken.txt')
+
+
+@pytest.mark.parametrize('copy', renamer.executor._COPIES, ids=lambda copy: copy.__name__)
+def test_copy_fd_falls_back(tmp_path, monkeypatch, copy):
+    def unsupported(*args):
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+    monkeypatch.setattr(renamer.executor, '_COPIES', [unsupported, copy])
+    monkeypatch.setattr(renamer.executor, 'COPY_BLOCK', 1 << 16)
+    data = os.urandom(300_000)
+    (tmp_path / 'a').write_bytes(data)
+    with open(tmp_path / 'a', 'rb') as source, open(tmp_path / 'b', 'wb') as target:
+        assert copy_fd(source.fileno(), target.fileno(), len(data)) == len(data)
+    assert (tmp_path / 'b').read_bytes() == data
+
+
+def test_async_retries_transient_errors(tmp_path, monkeypatch):
+    for i in range(40):
+        (tmp_path / f'{i}').touch()
+    (tmp_path / 'locked').touch()
+    attempts = {}
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+    real = renamer.executor.rename_file
+
+    def flaky(source, target):
+        with lock:
+            running.append(source)
+            peak[0] = max(peak[0], len(running))
+            n = attempts[source] = attempts.get(source, 0) + 1
+        try:
+            time.sleep(0.002)
+            # Every third file is busy twice before it goes through; 'locked' never does.
+            if source.name == 'locked' or int(source.name) % 3 == 0 and n <= 2:
+                raise OSError(errno.EBUSY if source.name != 'locked' else errno.EACCES, 'busy')
+            real(source, target)
+        finally:
+            with lock:
+                running.remove(source)
+    monkeypatch.setattr(renamer.executor, 'rename_file', flaky)
+
+    pairs = [(tmp_path / f'{i}', tmp_path / f'new_{i}') for i in range(40)] + [(tmp_path / 'locked', tmp_path / 'x')]
+    updates = []
+    report = execute_renames(pairs, workers=4, progress=lambda r: updates.append(r.renamed),
+                             retry=RetryPolicy(retries=3, base=0.001))
+    assert report.renamed == 40 and report.total == 41
+    assert report.failed == [(str(tmp_path / 'locked'), str(tmp_path / 'x'), 'busy')]
+    assert attempts[tmp_path / 'locked'] == 4 and attempts[tmp_path / '3'] == 3 and attempts[tmp_path / '1'] == 1
+    assert report.retries == 14 * 2 + 3
+    assert peak[0] <= 4
+    assert updates[-1] == 40
+    assert len(report.latencies) == 41
+    percentiles = report.percentiles()
+    assert list(percentiles) == ['p50', 'p90', 'p99', 'max']
+    assert 0 < percentiles['p50'] <= percentiles['p99'] <= percentiles['max']
+    assert '31 retries, latency p50' in report.summary()
+
+
+def test_async_deadline_and_permanent_errors(tmp_path):
+    (tmp_path / 'a').touch()
+    (tmp_path / 'taken').touch()
+    begin = time.perf_counter()
+    report = execute_renames_async([(tmp_path / 'missing', tmp_path / 'b'), (tmp_path / 'a', tmp_path / 'taken')],
+                                   RetryPolicy(retries=10, base=60, cap=60, deadline=0.01))
+    # Neither error is transient, so nothing waits.
+    assert time.perf_counter() - begin < 1
+    assert sorted(reason for _, _, reason in report.failed) == ['No such file or directory', 'target already exists']
+    assert report.retries == 0
+
+
+def test_async_gives_up_at_the_deadline(tmp_path, monkeypatch):
+    def busy(source, target):
+        raise OSError(errno.EBUSY, 'busy')
+    monkeypatch.setattr(renamer.executor, 'rename_file', busy)
+    monkeypatch.setattr(renamer.executor.random, 'uniform', lambda low, high: high)
+    begin = time.perf_counter()
+    report = execute_renames_async([(tmp_path / 'a', tmp_path / 'b')], RetryPolicy(retries=10, base=0.02, deadline=0.1))
+    assert time.perf_counter() - begin < 1
+    # Waits of 0.02 and 0.04 fit in the deadline, the next one of 0.08 does not.
+    assert report.retries == 2
+    assert report.failed[0][2] == 'busy (gave up after 0.1s)'
+
+
+def test_async_moves_across_filesystems(tmp_path, monkeypatch):
+    other = tmp_path / 'other'
+    other.mkdir()
+    (tmp_path / 'a').write_text('a')
+    other_filesystem(monkeypatch, other)
+    report = execute_renames_async([(tmp_path / 'a', other / 'a')])
+    assert report.renamed == 1 and (other / 'a').read_text() == 'a' and not (tmp_path / 'a').exists()
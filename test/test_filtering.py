@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from renamer.filtering import FilterError, FilterIndex, compile_filter
+
+
+def make_index():
+    index = FilterIndex()
+    index.extend(['IMG_001', 'img_002', 'notes', 'Photos', 'holiday'], ['.JPG', '.png', '.txt', '', '.jpg'],
+                 [False, False, False, True, False])
+    return index
+
+
+def test_compile_filter():
+    assert compile_filter('IMG')('img_001.jpg')
+    assert compile_filter('*.JPG')('img_001.jpg') and not compile_filter('*.jpg')('img_001.jpg.bak')
+    assert compile_filter(r'^img_\d+', 'regex')('img_001.jpg')
+    with pytest.raises(FilterError):
+        compile_filter('(', 'regex')
+    with pytest.raises(FilterError):
+        compile_filter('x', 'fuzzy')
+
+
+def test_match_modes():
+    index = make_index()
+    assert index.match('') is None and index.match('  ') is None
+    assert index.match('img') == [0, 1]
+    assert index.match('*.jpg') == [0, 4]
+    assert index.match('img_00?.*') == [0, 1]
+    assert index.match('O', 'regex') == [2, 3, 4]
+    assert index.match('jpg', 'ext') == [0, 4]
+    assert index.match('jpg, .PNG', 'ext') == [0, 1, 4]
+    assert index.match('', 'ext') is None and index.match(',', 'ext') == []
+
+
+def test_match_narrows_and_extends():
+    index = make_index()
+    assert index.match('o') == [2, 3, 4]
+    assert index.last == ('glob', 'o', [2, 3, 4])
+    assert index.match('ot') == [2, 3]
+    index.extend(['photo'], ['.jpg'], [False])
+    assert index.last is None
+    assert index.match('ot', start=5) == [5]
+    assert index.match('jpg', 'ext', start=5) == [5]
+    assert index.match('jpg', 'ext') == [0, 4, 5]
+
+
+def test_match_speed():
+    n = 500_000
+    index = FilterIndex()
+    started = time.perf_counter()
+    index.extend([f'IMG_{i:06d}' for i in range(n)], ['.jpg', '.png'] * (n // 2), [False] * n)
+    assert len(index.match('*.png')) == n // 2
+    assert len(index.match('img_0001')) == 100
+    assert len(index.match('jpg,png', 'ext')) == n
+    assert time.perf_counter() - started < 2
@@ -0,0 +1,109 @@
+import json
+
+from renamer.journal import Journal
+from renamer.planner import check_plan
+
+
+def make_files(path, names):
+    for name in names:
+        (path / name).touch()
+    return [(path / name, path / f'new_{name}') for name in names]
+
+
+def listing(path):
+    return sorted(p.name for p in path.iterdir())
+
+
+def test_run_and_undo(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    files = tmp_path / 'files'
+    files.mkdir()
+    pairs = make_files(files, ['a', 'b', 'c'])
+    (files / 'new_c').touch()
+    report = journal.run(pairs)
+    assert report.renamed == 2
+    assert listing(files) == ['c', 'new_a', 'new_b', 'new_c']
+
+    [batch] = journal.batches()
+    # The clash with new_c is caught up front and never journalled.
+    assert batch.complete and not batch.undone and batch.count == 2
+    assert journal.incomplete() == []
+
+    report = journal.undo(batch.id)
+    assert report.renamed == 2 and not report.failed
+    assert listing(files) == ['a', 'b', 'c', 'new_c']
+    assert journal.last() is None
+    assert [info.undo_of for info in journal.batches()] == [None, batch.id]
+
+
+def test_interrupted_batch_is_detected_and_undone(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    files = tmp_path / 'files'
+    files.mkdir()
+    pairs = make_files(files, ['a', 'b', 'c'])
+    batch = journal.begin(pairs)
+    # Simulate a crash after the first rename.
+    pairs[0][0].rename(pairs[0][1])
+    batch.file.close()
+
+    [info] = journal.incomplete()
+    report = journal.undo(info.id)
+    assert report.total == 1 and report.renamed == 1
+    assert listing(files) == ['a', 'b', 'c']
+    assert journal.incomplete() == []
+
+
+def test_undo_chain_and_swap(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    files = tmp_path / 'files'
+    files.mkdir()
+    for name in 'abxy':
+        (files / name).write_text(name)
+    pairs = [(files / 'a', files / 'b'), (files / 'b', files / 'c'),
+             (files / 'x', files / 'y'), (files / 'y', files / 'x')]
+    report = journal.run(pairs)
+    assert report.renamed == 4 and not report.failed
+    assert {p.name: p.read_text() for p in files.iterdir()} == {'b': 'a', 'c': 'b', 'x': 'y', 'y': 'x'}
+    report = journal.undo(journal.last().id)
+    assert report.renamed == 4 and not report.failed
+    assert {p.name: p.read_text() for p in files.iterdir()} == {'a': 'a', 'b': 'b', 'x': 'x', 'y': 'y'}
+
+
+def test_undo_interrupted_second_phase(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    for name in 'xy':
+        (tmp_path / name).write_text(name)
+    plan = check_plan([(tmp_path / 'x', tmp_path / 'y'), (tmp_path / 'y', tmp_path / 'x')])
+    batch = journal.begin(plan.steps())
+    # Crash after both files reached their temporary names and one moved on.
+    for source, _, temp in plan.linked:
+        source.rename(temp)
+    batch.second_phase()
+    _, target, temp = plan.linked[0]
+    temp.rename(target)
+    batch.file.close()
+    journal.undo(batch.id)
+    assert {p.name: p.read_text() for p in tmp_path.iterdir() if p.is_file()} == {'x': 'x', 'y': 'y'}
+
+
+def test_close_and_torn_lines(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    pairs = make_files(tmp_path, ['a'])
+    batch = journal.begin(pairs)
+    batch.file.write('["torn')
+    batch.file.close()
+    (journal.directory / 'empty.jsonl').touch()
+    [info] = journal.incomplete()
+    journal.close(info.id)
+    assert journal.incomplete() == []
+    assert journal.undo(info.id).total == 0
+
+
+def test_plan_is_on_disk_before_renaming(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    pairs = make_files(tmp_path, ['a', 'b'])
+    batch = journal.begin(pairs)
+    lines = batch.path.read_text().splitlines()
+    assert json.loads(lines[0])['count'] == 2
+    assert [json.loads(line) for line in lines[1:]] == [[str(s), str(t)] for s, t in pairs]
+    batch.file.close()
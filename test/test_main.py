@@ -0,0 +1,319 @@
+import os
+import subprocess
+import sys
+import time
+
+from PySide6.QtCore import QEventLoop, QItemSelectionModel, Qt, QTimer
+from PySide6.QtWidgets import QMessageBox
+
+import renamer.main
+from renamer.main import RenameOptions, StatsPanel, directory_table, files, get_args, main_window
+from renamer.model import FilterProxy
+from renamer.profile import profiler
+
+
+def make_options(tmp_path):
+    for name in ['a.txt', 'b.txt', 'c.pdf']:
+        (tmp_path / name).touch()
+    model = files(tmp_path)
+    view = directory_table(model)
+    view.sortByColumn(0, Qt.AscendingOrder)
+    return model, view, RenameOptions(model, view, str(tmp_path))
+
+
+def test_preview_follows_selection(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    opts.name_entry.setText('x')
+    opts.num_suffix.setChecked(True)
+    assert model.new_names == ['x1', 'x2', 'x3']
+
+    view.selectionModel().select(view.model().index(1, 0), QItemSelectionModel.Deselect | QItemSelectionModel.Rows)
+    assert model.new_names == ['x1', 'b', 'x2']
+
+    opts.name_entry.clear()
+    assert model.new_names == ['a1', 'b', 'c2']
+
+
+def test_preview_after_rows_removed(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    opts.add_suffix.setText('_x')
+    assert model.new_names == ['a_x', 'b_x', 'c_x']
+    model.remove_entries({'c.pdf'})
+    assert opts.previewed is None
+    opts.add_suffix.setText('_y')
+    assert model.new_names == ['a_y', 'b_y'] and opts.previewed == range(2)
+
+
+def test_invalid_pattern_is_reported(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    messages = []
+    opts.status.connect(messages.append)
+    view.selectAll()
+    opts.replace_regex.setChecked(True)
+    opts.replace_entry_text.setText('x')
+    opts.replace_entry_search.setText('.+')
+    assert model.new_names == ['x', 'x', 'x']
+    opts.replace_entry_search.setText('[')
+    assert model.new_names == ['a', 'b', 'c']
+    assert 'Invalid pattern' in messages[-1]
+    opts.replace_entry_search.setText('[ab]')
+    assert model.new_names == ['x', 'x', 'c']
+    assert messages[-1] == ''
+
+
+def test_metadata_tokens_preview_in_background(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    (tmp_path / 'b.txt').write_bytes(bytes(5))
+    view.selectAll()
+    opts.name_entry.setText('{size}')
+    assert wait_for(qapp, lambda: opts.metadata_loader is None)
+    assert model.new_names == ['0', '5', '0']
+    opts.name_entry.setText('{size}_{title}')
+    assert opts.metadata_loader is None
+    assert model.new_names == ['0_', '5_', '0_']
+
+
+def test_metadata_follows_a_change_of_folder(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    opts.name_entry.setText('{size}')
+    assert opts.metadata_loader is not None
+    other = tmp_path / 'other'
+    other.mkdir()
+    (other / 'd.txt').write_bytes(bytes(7))
+    other_model = files(other)
+    view.setModel(FilterProxy(other_model, view))
+    opts.change_dir(other_model, str(other))
+    view.selectAll()
+    # The loader still reading the old folder hands over to one for the new folder.
+    assert wait_for(qapp, lambda: opts.metadata_loader is None and other_model.new_names == ['7'])
+
+
+def test_presets_save_and_load(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    opts.replace_entry_search.setText('a')
+    opts.replace_entry_text.setText('z')
+    opts.case_select.setCurrentIndex(1)
+    opts.num_suffix.setChecked(True)
+    expected = list(model.new_names)
+    spec = opts.spec()
+    opts.save_preset('mine')
+    assert opts.preset_select.currentText() == 'mine'
+
+    opts.reset_all()
+    assert model.new_names == ['a', 'b', 'c']
+    opts.load_preset('mine')
+    assert opts.spec() == spec
+    assert model.new_names == expected
+    assert opts.preset_select.currentText() == 'mine'
+
+    opts.load_preset('missing')
+    opts.delete_preset()
+    assert opts.preset_select.count() == 0
+
+
+def test_finalize_renames_in_background(qapp, tmp_path, monkeypatch):
+    model, view, opts = make_options(tmp_path)
+    (tmp_path / 'x3.pdf').touch()
+    renamed = []
+    opts.change_signal.connect(renamed.append)
+    view.selectAll()
+    opts.name_entry.setText('x')
+    opts.num_suffix.setChecked(True)
+    failures = []
+    monkeypatch.setattr(QMessageBox, 'exec_', lambda box: failures.append(box.detailedText()), raising=False)
+    opts.finalize()
+    opts.worker.wait()
+    qapp.processEvents()
+    assert renamed == [True]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['c.pdf', 'x1.txt', 'x2.txt', 'x3.pdf']
+    # The rows are updated where they are instead of the directory being scanned again.
+    assert model.filenames() == ['x1.txt', 'x2.txt', 'c.pdf']
+    assert len(failures) == 1 and 'x3.pdf: target already exists' in failures[0]
+
+
+def test_undo_last_batch(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    opts.add_suffix.setText('_old')
+    opts.finalize()
+    opts.worker.wait()
+    qapp.processEvents()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a_old.txt', 'b_old.txt', 'c_old.pdf']
+    opts.undo_last()
+    opts.worker.wait()
+    qapp.processEvents()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.txt', 'b.txt', 'c.pdf']
+
+
+def test_rename_all_matching(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.model().set_filter('*.txt')
+    opts.set_all_matching(True)
+    opts.add_prefix.setText('new_')
+    assert model.new_names == ['new_a', 'new_b', 'c']
+    opts.finalize()
+    opts.worker.wait()
+    qapp.processEvents()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['c.pdf', 'new_a.txt', 'new_b.txt']
+
+
+def test_rename_reuses_the_preview(qapp, tmp_path, monkeypatch):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    assert opts.target_rows() == range(3)
+    opts.add_suffix.setText('_1')
+    previews = []
+    monkeypatch.setattr(opts, 'preview_now', lambda: previews.append(1))
+    opts.finalize()
+    assert previews == []
+    opts.worker.wait()
+    qapp.processEvents()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a_1.txt', 'b_1.txt', 'c_1.pdf']
+
+
+def test_large_preview_runs_in_background(qapp, tmp_path, monkeypatch):
+    monkeypatch.setattr(renamer.main, 'PREVIEW_ROWS', 0)
+    model, view, opts = make_options(tmp_path)
+    view.resize(600, 400)
+    view.show()
+    view.selectAll()
+    cache = opts.preview_cache
+    real = cache.apply
+    started = []
+
+    def apply(spec, names, metadata=None, cancelled=None):
+        started.append(spec.name)
+        if spec.name == 'slow':
+            # Runs until the next edit drops it.
+            while not cancelled():
+                time.sleep(0.01)
+            return None
+        return real(spec, names, metadata, cancelled)
+    monkeypatch.setattr(cache, 'apply', apply)
+
+    for text in ['s', 'sl', 'slo', 'slow']:
+        opts.name_entry.setText(text)
+    # Nothing is previewed until typing pauses, and then only the last edit.
+    assert model.new_names == ['a', 'b', 'c'] and opts.preview_timer.isActive()
+    assert wait_for(qapp, lambda: started == ['slow'])
+    # The rows on screen are shown before the rest is done.
+    assert wait_for(qapp, lambda: model.new_names == ['slow'] * 3)
+    assert opts.previewed is None
+
+    opts.name_entry.setText('x')
+    opts.num_suffix.setChecked(True)
+    assert wait_for(qapp, lambda: opts.preview_worker is None and not opts.preview_timer.isActive()
+                    and opts.previewed is not None)
+    assert started == ['slow', 'x'] and model.new_names == ['x1', 'x2', 'x3']
+
+    # Renaming catches up with an edit that has not been previewed yet.
+    opts.add_suffix.setText('_new')
+    opts.finalize()
+    opts.worker.wait()
+    qapp.processEvents()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['x_new1.txt', 'x_new2.txt', 'x_new3.pdf']
+    view.close()
+
+
+def test_move_to_folder(qapp, tmp_path):
+    model, view, opts = make_options(tmp_path)
+    view.selectAll()
+    opts.move_to.setText('{size}/done')
+    opts.add_prefix.setText('x_')
+    assert opts.spec().move_to == '{size}/done'
+    view.selectionModel().select(view.model().index(2, 0), QItemSelectionModel.Deselect | QItemSelectionModel.Rows)
+    # {size} is read in the background first.
+    assert wait_for(qapp, lambda: opts.metadata_loader is None)
+    opts.finalize()
+    opts.worker.wait()
+    qapp.processEvents()
+    assert sorted(p.name for p in (tmp_path / '0' / 'done').iterdir()) == ['x_a.txt', 'x_b.txt']
+    # Moved files leave the listing.
+    assert model.filenames() == ['c.pdf']
+
+
+def wait_for(qapp, condition, timeout=5000):
+    loop = QEventLoop()
+    timer = QTimer()
+    timer.timeout.connect(lambda: condition() and loop.quit())
+    timer.start(10)
+    QTimer.singleShot(timeout, loop.quit)
+    loop.exec()
+    timer.stop()
+    return condition()
+
+
+def test_window_follows_directory_changes(qapp, tmp_path):
+    for name in ['a.txt', 'b.txt']:
+        (tmp_path / name).touch()
+    window = main_window(tmp_path)
+    window.start()
+    try:
+        assert wait_for(qapp, lambda: window.scanner is None and window.files_model.rowCount() == 2)
+        model = window.files_model
+        window.files.selectRow(model.filenames().index('b.txt'))
+        (tmp_path / 'a.txt').rename(tmp_path / 'c.txt')
+        (tmp_path / 'd.txt').touch()
+        assert wait_for(qapp, lambda: sorted(model.filenames()) == ['b.txt', 'c.txt', 'd.txt'])
+        # Same model, changed in place, with the selection still on the same file.
+        assert window.files_model is model
+        rows = window.files.selectionModel().selectedRows()
+        assert [model.filename(index.row()) for index in rows] == ['b.txt']
+    finally:
+        window.close()
+
+
+def test_profiling_the_gui(qapp, tmp_path):
+    args = get_args(['some/dir', '--profile', 'out.trace.json', '-platform', 'offscreen'])
+    assert (args.path, args.profile) == ('some/dir', 'out.trace.json')
+    profiler.enable()
+    try:
+        model, view, opts = make_options(tmp_path)
+        view.selectAll()
+        opts.name_entry.setText('x')
+        panel = StatsPanel()
+        assert 'preview_changes' in panel.text() and 'box_changes 1' in panel.text()
+    finally:
+        profiler.disable()
+        profiler.reset()
+
+
+# Seconds from launching Python to the main window being on screen.
+COLD_START_BUDGET = 3.0
+
+
+def test_window_shows_before_touching_the_disk(qapp, tmp_path):
+    (tmp_path / 'a.txt').touch()
+    window = main_window(tmp_path)
+    try:
+        assert window.scanner is None and window.files_model.rowCount() == 0
+        assert window.tree_model.rootPath() in ('', '.')
+        window.start()
+        assert window.tree_model.rootPath() == str(tmp_path)
+        assert wait_for(qapp, lambda: window.files_model.rowCount() == 1)
+    finally:
+        window.close()
+
+
+def test_cold_start_budget(tmp_path):
+    for i in range(1000):
+        (tmp_path / f'{i}.txt').touch()
+    script = (
+        'import sys\n'
+        'from PySide6.QtWidgets import QApplication\n'
+        'from renamer.main import STYLE, main_window\n'
+        'app = QApplication(sys.argv[:1])\n'
+        'app.setStyleSheet(STYLE.read_text())\n'
+        'window = main_window(sys.argv[1])\n'
+        'window.show()\n'
+        'app.processEvents()\n'
+    )
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    begin = time.perf_counter()
+    subprocess.run([sys.executable, '-c', script, str(tmp_path)], env=env, check=True, capture_output=True)
+    elapsed = time.perf_counter() - begin
+    assert elapsed < COLD_START_BUDGET, f'{elapsed:.3f}s'
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import struct
+
+import renamer.hashing
+import renamer.metadata
+from renamer.hashing import hash_file
+from renamer.metadata import (MetadataCache, content_hashes, expand_tokens, extract, find_duplicates, has_tokens,
+                              read_metadata)
+
+
+def jpeg(stamp: bytes, width: int = 640, height: int = 480) -> bytes:
+    # Little endian TIFF: IFD0 with one pointer to the EXIF IFD holding DateTimeOriginal.
+    tiff = bytearray(b'II*\0' + struct.pack('<I', 8))
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, 26) + struct.pack('<I', 0)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x9003, 2, len(stamp), 44) + struct.pack('<I', 0)
+    tiff += stamp
+    app1 = b'Exif\0\0' + bytes(tiff)
+    sof = b'\x08' + struct.pack('>HH', height, width) + b'\x03' + bytes(9)
+    return (b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+            + b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof + b'\xff\xda')
+
+
+def id3(frames: dict[str, str]) -> bytes:
+    body = b''
+    for frame, text in frames.items():
+        data = b'\x03' + text.encode()
+        body += frame.encode() + struct.pack('>I', len(data)) + b'\0\0' + data
+    body += bytes(16)
+    size = bytes((len(body) >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b'ID3\x03\0\0' + size + body + b'\xff\xfb' + bytes(100)
+
+
+def test_tokens():
+    assert has_tokens('IMG {date}') and not has_tokens('{other}')
+    assert expand_tokens('{date} {title}{other}', {'date': '2024-01-02'}) == '2024-01-02 {other}'
+
+
+def test_read_jpeg(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(jpeg(b'2024:05:06 07:08:09\0'))
+    assert read_metadata(path) == {'date': '2024-05-06', 'time': '07-08-09', 'width': '640',
+                                   'height': '480', 'size': str(path.stat().st_size)}
+
+
+def test_read_png_and_gif(tmp_path):
+    png = tmp_path / 'a.png'
+    png.write_bytes(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 32, 16) + bytes(5))
+    gif = tmp_path / 'a.gif'
+    gif.write_bytes(b'GIF89a' + struct.pack('<HH', 8, 4) + bytes(10))
+    assert read_metadata(png)['width'] == '32' and read_metadata(png)['height'] == '16'
+    assert read_metadata(gif)['width'] == '8' and read_metadata(gif)['height'] == '4'
+
+
+def test_read_id3(tmp_path):
+    path = tmp_path / 'song.mp3'
+    path.write_bytes(id3({'TPE1': 'Artist', 'TIT2': 'Song', 'TRCK': '3/12'}))
+    metadata = read_metadata(path)
+    assert (metadata['artist'], metadata['title'], metadata['track']) == ('Artist', 'Song', '03')
+    assert 'album' not in metadata
+
+    v1 = tmp_path / 'old.mp3'
+    tag = b'TAG' + b'Title'.ljust(30, b'\0') + b'Band'.ljust(30, b'\0') + bytes(30 + 4 + 28) + b'\0\x07\xff'
+    v1.write_bytes(bytes(500) + tag)
+    assert read_metadata(v1) == {'title': 'Title', 'artist': 'Band', 'track': '07', 'size': '628'}
+
+
+def test_extract_uses_cache(tmp_path, monkeypatch):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f'{i}.jpg'
+        path.write_bytes(jpeg(f'2024:01:0{i + 1} 00:00:00'.encode() + b'\0'))
+        paths.append(path)
+    cache = MetadataCache(tmp_path / 'cache.sqlite')
+    found = extract(paths + [tmp_path / 'missing.jpg'], cache=cache)
+    assert [metadata.get('date') for metadata in found] == [f'2024-01-0{i}' for i in range(1, 6)] + [None]
+
+    parsed = []
+    monkeypatch.setattr(renamer.metadata, 'read_metadata', lambda path, size: parsed.append(path) or {})
+    assert extract(paths, cache=cache) == found[:5]
+    assert parsed == []
+
+    # A file that changed is parsed again.
+    st = paths[2].stat()
+    os.utime(paths[2], ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    extract(paths, cache=cache)
+    assert parsed == [paths[2]]
+    cache.close()
+
+
+def test_hash_file(tmp_path, monkeypatch):
+    data = os.urandom(5000)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    assert hash_file(path) == hashlib.sha256(data).hexdigest()
+    monkeypatch.setattr(renamer.hashing, 'MMAP_SIZE', 1024)
+    assert hash_file(path) == hashlib.sha256(data).hexdigest()
+    (tmp_path / 'empty').touch()
+    assert hash_file(tmp_path / 'empty') == hashlib.sha256().hexdigest()
+
+
+def test_hash_token(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_bytes(b'content')
+    assert extract([path])[0].get('hash') is None
+    assert extract([path], hashes=True)[0]['hash'] == hashlib.sha256(b'content').hexdigest()[:16]
+
+
+def test_content_hashes_use_cache(tmp_path, monkeypatch):
+    paths = [tmp_path / f'{i}.txt' for i in range(3)]
+    for i, path in enumerate(paths):
+        path.write_bytes(b'x' * i)
+    cache = MetadataCache(tmp_path / 'cache.sqlite')
+    digests = content_hashes(paths + [tmp_path / 'missing'], cache=cache)
+    assert digests[:3] == [hashlib.sha256(b'x' * i).hexdigest() for i in range(3)] and digests[3] is None
+
+    hashed = []
+    real = renamer.metadata.hash_files
+    monkeypatch.setattr(renamer.metadata, 'hash_files', lambda paths, *args: hashed.extend(paths) or real(paths))
+    assert content_hashes(paths, cache=cache) == digests[:3]
+    assert hashed == []
+    paths[1].write_bytes(b'yy')
+    assert content_hashes(paths, cache=cache)[1] == hashlib.sha256(b'yy').hexdigest()
+    assert hashed == [paths[1]]
+    cache.close()
+
+
+def test_find_duplicates(tmp_path, monkeypatch):
+    for name, data in [('a', b'same'), ('b', b'same'), ('c', b'diff'), ('d', b'unique size'), ('e', b'same!'),
+                       ('f', b''), ('g', b'')]:
+        (tmp_path / name).write_bytes(data)
+    os.link(tmp_path / 'a', tmp_path / 'link')
+    (tmp_path / 'sub').mkdir()
+    hashed = []
+    real = renamer.metadata.hash_files
+    monkeypatch.setattr(renamer.metadata, 'hash_files', lambda paths, *args: hashed.extend(paths) or real(paths))
+    paths = sorted(tmp_path.iterdir())
+    assert find_duplicates(paths) == [[tmp_path / 'a', tmp_path / 'b']]
+    # Only files sharing a size are hashed.
+    assert sorted(path.name for path in hashed) == ['a', 'b', 'c']
@@ -0,0 +1,191 @@
+import random
+import time
+
+from PySide6.QtCore import QItemSelectionModel, Qt
+from PySide6.QtWidgets import QTableView
+
+from renamer.main import files
+from renamer.model import FOLDER, SORT_ROLE, FilesModel, FilterProxy, RowRanges, display_mtime, format_mtime
+
+
+def make_model():
+    model = FilesModel()
+    model.append_rows(['b', 'a', 'docs'], ['.txt', '.pdf', ''], [False, False, True], [30.0, 10.0, 20.0])
+    return model
+
+
+def test_cells_on_demand(qapp):
+    model = make_model()
+    assert model.rowCount() == 3
+    assert model.columnCount() == 4
+    assert model.data(model.index(0, 0)) == 'b'
+    assert model.data(model.index(2, 2)) == FOLDER
+    assert model.data(model.index(1, 2)) == '.pdf'
+    assert model.data(model.index(0, 3), Qt.TextAlignmentRole) == Qt.AlignCenter
+    assert model.headerData(1, Qt.Horizontal) == 'New Name'
+
+
+def test_new_names(qapp):
+    model = make_model()
+    changed = []
+    model.dataChanged.connect(lambda first, last, roles: changed.append((first.row(), last.row())))
+    model.set_new_names([0, 1], ['x', 'y'])
+    assert model.new_filename(0) == 'x.txt'
+    assert model.new_filename(2) == 'docs'
+    model.reset_new_names()
+    assert model.new_names == model.names
+    assert changed == [(0, 1), (0, 1)]
+
+
+def test_unchanged_rows_are_not_reported(qapp):
+    model = make_model()
+    changed = []
+    model.dataChanged.connect(lambda first, last, roles: changed.append((first.row(), last.row())))
+    model.set_new_names([0, 1, 2], ['b', 'y', 'docs'])
+    model.set_new_names([2, 0], ['z', 'x'])
+    assert changed == [(1, 1), (0, 0), (2, 2)]
+
+
+def test_sort_keeps_columns_together(qapp):
+    model = make_model()
+    model.sort(0)
+    assert model.names == ['a', 'b', 'docs']
+    assert model.filename(0) == 'a.pdf'
+    model.sort(3, Qt.DescendingOrder)
+    assert model.names == ['b', 'docs', 'a']
+    assert list(model.mtimes) == [30.0, 20.0, 10.0]
+
+
+def test_modified_sorts_by_time(qapp):
+    model = FilesModel()
+    october = time.mktime((2020, 10, 1, 12, 0, 0, 0, 0, -1))
+    september = time.mktime((2020, 9, 5, 12, 0, 0, 0, 0, -1))
+    model.append_rows(['october', 'september'], ['', ''], [False, False], [october, september])
+    # As text '10/1/2020' would sort before '9/5/2020'.
+    assert model.data(model.index(0, 3)) == '10/1/2020 12:00:00 PM'
+    assert model.data(model.index(1, 3)) == '9/5/2020 12:00:00 PM'
+    assert model.data(model.index(0, 3), SORT_ROLE) == october
+    assert model.data(model.index(0, 0), SORT_ROLE) == 'october'
+    model.sort(3)
+    assert model.names == ['september', 'october']
+
+
+def test_modified_is_formatted_once(qapp):
+    model = make_model()
+    display_mtime.cache_clear()
+    for _ in range(3):
+        model.data(model.index(0, 3))
+    assert display_mtime.cache_info().hits == 2
+    assert format_mtime(time.mktime((2021, 1, 2, 3, 4, 5, 0, 0, -1))) == '1/2/2021 03:04:05 AM'
+
+
+def test_entries_change_in_place(qapp):
+    model = make_model()
+    removed = []
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+    model.set_new_names([0], ['preview'])
+    assert model.rename_entries({'b.txt': 'b2.md', 'docs': 'docs.old', 'missing': 'x'}) == 2
+    assert model.filenames() == ['b2.md', 'a.pdf', 'docs.old']
+    assert model.new_names[0] == 'b2'
+    assert model.type(2) == FOLDER
+    assert model.add_entries([('c', '.txt', False, 5.0), ('a', '.pdf', False, 1.0)]) == 1
+    assert model.remove_entries({'b2.md', 'docs.old', 'nothing'}) == 2
+    assert model.filenames() == ['a.pdf', 'c.txt']
+    assert removed == [(2, 2), (0, 0)]
+
+
+def test_sort_speed(qapp):
+    count = 200_000
+    model = FilesModel()
+    mtimes = [random.uniform(1e9, 1.7e9) for _ in range(count)]
+    model.append_rows([f'IMG_{random.randrange(10 ** 7):07d}' for _ in range(count)], ['.jpg'] * count,
+                      [False] * count, mtimes)
+    begin = time.perf_counter()
+    model.sort(3)
+    model.sort(0, Qt.DescendingOrder)
+    elapsed = time.perf_counter() - begin
+    assert sorted(model.mtimes) == sorted(mtimes)
+    assert model.names == sorted(model.names, reverse=True)
+    # 500k rows should sort well under a second.
+    assert elapsed < 1, f'{elapsed:.3f}s'
+
+
+def test_files(qapp, tmp_path):
+    (tmp_path / 'report.final.txt').touch()
+    (tmp_path / 'folder.v2').mkdir()
+    model = files(tmp_path)
+    model.sort(0)
+    assert model.names == ['folder.v2', 'report.final']
+    assert model.type(0) == FOLDER
+    assert model.filename(1) == 'report.final.txt'
+
+
+def test_filter_proxy(qapp):
+    model = make_model()
+    proxy = FilterProxy(model)
+    assert proxy.rowCount() == 3 and proxy.rows is None
+    proxy.set_filter('*.pdf')
+    assert proxy.rowCount() == 1
+    assert proxy.data(proxy.index(0, 0)) == 'a'
+    assert proxy.mapToSource(proxy.index(0, 2)).row() == 1
+    assert not proxy.mapFromSource(model.index(0, 0)).isValid()
+
+    # Appended rows are tested against the filter, removed rows shift the rest.
+    model.append_rows(['c', 'd'], ['.pdf', '.txt'], [False, False], [1.0, 2.0])
+    assert proxy.matching_rows() == [1, 3]
+    model.remove_entries({'b.txt'})
+    assert proxy.matching_rows() == [0, 2]
+    assert [proxy.data(proxy.index(row, 0)) for row in range(proxy.rowCount())] == ['a', 'c']
+
+    # Sorting goes to the model and the filter follows the rows.
+    proxy.sort(0, Qt.DescendingOrder)
+    assert model.names == ['docs', 'd', 'c', 'a']
+    assert proxy.matching_rows() == [2, 3]
+    proxy.set_filter('^D', 'regex')
+    assert proxy.matching_rows() == [0, 1]
+    proxy.set_filter('')
+    assert proxy.rows is None and proxy.rowCount() == 4
+
+
+def test_filter_after_rows_removed(qapp):
+    model = make_model()
+    proxy = FilterProxy(model)
+    proxy.set_filter('*.jpg')
+    assert proxy.rowCount() == 0
+    model.remove_entries({'b.txt'})
+    # The removal dropped the filter index; appending rebuilds it instead of failing.
+    model.add_entries([('photo', '.jpg', False, 1.0)])
+    assert proxy.matching_rows() == [2] and proxy.rowCount() == 1
+    assert proxy.data(proxy.index(0, 0)) == 'photo'
+
+
+def test_filter_keeps_selection(qapp):
+    model = make_model()
+    view = QTableView()
+    view.setModel(FilterProxy(model, view))
+    proxy = view.model()
+    view.selectAll()
+    proxy.set_filter('txt,pdf', 'ext')
+    rows = sorted({index.row() for index in view.selectionModel().selectedIndexes()})
+    assert proxy.source_rows(rows) == [0, 1]
+    view.selectionModel().select(proxy.index(0, 0), QItemSelectionModel.Deselect | QItemSelectionModel.Rows)
+    proxy.set_filter('')
+    assert sorted({index.row() for index in view.selectionModel().selectedIndexes()}) == [1]
+
+
+def test_row_ranges(qapp):
+    ranges = RowRanges([(5, 8), (0, 2), (1, 3), (8, 9), (4, 4)])
+    assert ranges.ranges == [(0, 3), (5, 9)] and len(ranges) == 7
+    assert list(ranges) == [0, 1, 2, 5, 6, 7, 8]
+    assert 2 in ranges and 3 not in ranges and 8 in ranges and 9 not in ranges and -1 not in ranges
+
+    model = make_model()
+    view = QTableView()
+    view.setModel(FilterProxy(model, view))
+    view.selectAll()
+    selected = RowRanges.from_selection(view.selectionModel().selection())
+    assert selected == RowRanges([(0, 3)])
+    # Every row of an unfiltered table stays a range; filtered rows are mapped.
+    assert view.model().source_ranges(selected) == range(3)
+    view.model().set_filter('*.*')
+    assert view.model().source_ranges(RowRanges([(1, 2)])) == [1]
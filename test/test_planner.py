@@ -0,0 +1,61 @@
+from renamer.planner import check_plan, execute_plan
+
+
+def test_duplicates_and_clashes(tmp_path):
+    pairs = [(tmp_path / 'a', tmp_path / 'x'), (tmp_path / 'b', tmp_path / 'x'),
+             (tmp_path / 'c', tmp_path / 'keep'), (tmp_path / 'd', tmp_path / 'c'),
+             (tmp_path / 'e', tmp_path / 'e')]
+    existing = [tmp_path / name for name in 'abcde'] + [tmp_path / 'keep']
+    plan = check_plan(pairs, existing, case_insensitive=False)
+    assert plan.direct == [(tmp_path / 'a', tmp_path / 'x')]
+    assert plan.linked == []
+    # c clashes with keep, so c stays put and d can not take its name either.
+    assert [(c.source, c.reason) for c in plan.conflicts] == [
+        (str(tmp_path / 'b'), 'same new name as a'),
+        (str(tmp_path / 'c'), 'target already exists'),
+        (str(tmp_path / 'd'), 'target already exists')]
+
+
+def test_string_paths(tmp_path):
+    base = f'{tmp_path}/'
+    pairs = [(base + 'a', base + 'b'), (base + 'b', base + 'c'), (base + 'd', base + 'keep'), (base + 'e', base + 'e')]
+    plan = check_plan(pairs, [base + name for name in ['a', 'b', 'd', 'e', 'keep']], case_insensitive=False)
+    assert plan.direct == [] and [(source, target) for source, target, _ in plan.linked] == [
+        (tmp_path / 'a', tmp_path / 'b'), (tmp_path / 'b', tmp_path / 'c')]
+    assert [(c.source, c.target, c.reason) for c in plan.conflicts] == [
+        (base + 'd', base + 'keep', 'target already exists')]
+
+
+def test_chains_and_cycles(tmp_path):
+    pairs = [(tmp_path / 'a', tmp_path / 'b'), (tmp_path / 'b', tmp_path / 'c'),
+             (tmp_path / 'x', tmp_path / 'y'), (tmp_path / 'y', tmp_path / 'x'),
+             (tmp_path / 'm', tmp_path / 'n')]
+    plan = check_plan(pairs, [tmp_path / name for name in 'abxym'], case_insensitive=False)
+    assert plan.direct == [(tmp_path / 'm', tmp_path / 'n')]
+    assert [(source.name, target.name) for source, target, _ in plan.linked] == [
+        ('a', 'b'), ('b', 'c'), ('x', 'y'), ('y', 'x')]
+    assert plan.cycles == 1
+    assert not plan.conflicts
+    assert len(plan.steps()) == len(plan.direct) + 2 * len(plan.linked)
+
+
+def test_case_insensitive_index(tmp_path):
+    pairs = [(tmp_path / 'a', tmp_path / 'Doc'), (tmp_path / 'b', tmp_path / 'doc'),
+             (tmp_path / 'c', tmp_path / 'C')]
+    plan = check_plan(pairs, [tmp_path / 'a', tmp_path / 'b', tmp_path / 'c'], case_insensitive=True)
+    assert [c.source for c in plan.conflicts] == [str(tmp_path / 'b')]
+    # A case-only rename is not a clash with itself.
+    assert (tmp_path / 'c', tmp_path / 'C') in plan.direct
+
+
+def test_execute_swap(tmp_path):
+    for name in 'xyz':
+        (tmp_path / name).write_text(name)
+    plan = check_plan([(tmp_path / 'x', tmp_path / 'y'), (tmp_path / 'y', tmp_path / 'z'),
+                       (tmp_path / 'z', tmp_path / 'x')])
+    assert plan.cycles == 1 and len(plan.linked) == 3
+    calls = []
+    report, undone = execute_plan(plan, between=lambda: calls.append('between'))
+    assert report.renamed == report.total == 3 and not undone
+    assert calls == ['between']
+    assert {p.name: p.read_text() for p in tmp_path.iterdir()} == {'x': 'z', 'y': 'x', 'z': 'y'}
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from renamer.engine import RenameSpec
+from renamer.presets import Presets
+
+
+def test_presets_round_trip(tmp_path):
+    presets = Presets(tmp_path / 'presets')
+    assert presets.names() == []
+    spec = RenameSpec(replace_search='IMG', replace_with='photo', case='lower', num_suffix=True, num_start=5)
+    path = presets.save('Photos', spec)
+    # Only what differs from the defaults is written, in the format --spec reads.
+    assert json.loads(path.read_text()) == {'replace_search': 'IMG', 'replace_with': 'photo', 'case': 'lower',
+                                            'num_suffix': True, 'num_start': 5}
+    presets.save('archive', RenameSpec(add_prefix='old_'))
+    assert presets.names() == ['archive', 'Photos']
+    assert presets.load('Photos') == spec
+    presets.delete('archive')
+    assert presets.names() == ['Photos']
+
+
+def test_presets_reject_bad_names_and_files(tmp_path):
+    presets = Presets(tmp_path)
+    for name in ['', ' ', '../x', '.hidden']:
+        with pytest.raises(ValueError):
+            presets.save(name, RenameSpec())
+    (tmp_path / 'broken.json').write_text('{"colour": "red"}')
+    with pytest.raises(ValueError):
+        presets.load('broken')
+    with pytest.raises(FileNotFoundError):
+        presets.load('missing')
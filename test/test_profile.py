@@ -0,0 +1,75 @@
+import json
+import threading
+
+import pytest
+
+from renamer.engine import PreviewCache, RenameSpec
+from renamer.profile import Profiler, enable_from_env, profiler
+
+
+@pytest.fixture
+def enabled(tmp_path):
+    profiler.enable(tmp_path / 'profile.json')
+    yield profiler
+    profiler.disable()
+    profiler.reset()
+
+
+def test_disabled_does_nothing():
+    p = Profiler()
+    with p.span('phase'):
+        p.count('rows', 5)
+    assert p.summary() == {'spans': {}, 'counters': {}}
+    assert p.export() is None
+
+
+def test_spans_and_counters_from_threads():
+    p = Profiler()
+    p.enable()
+
+    def work():
+        for _ in range(10):
+            with p.span('phase', rows=1):
+                p.count('rows')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = p.summary()
+    assert summary['spans']['phase']['count'] == 40
+    assert summary['counters'] == {'rows': 40}
+    assert len({event['thread'] for event in p.to_json()['events']}) > 1
+
+
+def test_export_formats(tmp_path):
+    p = Profiler()
+    p.enable()
+    with p.span('scan', path='x'):
+        p.count('rows_scanned', 3)
+    p.export(tmp_path / 'run.json')
+    data = json.loads((tmp_path / 'run.json').read_text())
+    assert data['counters'] == {'rows_scanned': 3}
+    assert data['events'][0]['name'] == 'scan' and data['events'][0]['args'] == {'path': 'x'}
+
+    p.export(tmp_path / 'run.trace.json')
+    events = json.loads((tmp_path / 'run.trace.json').read_text())['traceEvents']
+    assert [(event['name'], event['ph']) for event in events] == [('scan', 'X'), ('counters', 'C')]
+    assert events[1]['args'] == {'rows_scanned': 3}
+
+
+def test_enable_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('RENAMER_PROFILE', str(tmp_path / 'env.json'))
+    try:
+        assert enable_from_env()
+        assert profiler.path == tmp_path / 'env.json'
+    finally:
+        profiler.disable()
+
+
+def test_engine_is_instrumented(enabled):
+    PreviewCache().apply(RenameSpec(name='x'), ['a', 'b'])
+    summary = enabled.summary()
+    assert summary['spans']['preview']['count'] == 1
+    assert summary['counters']['rows_previewed'] == 2
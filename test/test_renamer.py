@@ -1,6 +1,14 @@
+import io
+import json
+import subprocess
+import sys
 import unittest
+from pathlib import Path
 from unittest.mock import patch
 from renamer import renamer
+from renamer.engine import RenameSpec, compile_spec
+from renamer.journal import KEEP, Journal
+from renamer.presets import Presets
 
 
 @patch('renamer.loc.iterdir')
@@ -12,4 +20,208 @@ def test(mock_loc):
     # Output
     correct = ['newfile1.dwg', 'newfile1.pdf', 'file2.pdf']
 
-    # test
\ No newline at end of file
+    # test
+
+
+def run_cli(tmp_path, capsys, *args):
+    code = renamer.main([str(tmp_path), *args])
+    out = capsys.readouterr().out
+    return code, [json.loads(line) for line in out.splitlines()]
+
+
+def make_files(tmp_path, names):
+    for name in names:
+        (tmp_path / name).touch()
+
+
+def test_cli_dry_run(tmp_path, capsys):
+    make_files(tmp_path, ['b.txt', 'a.txt', 'c.pdf'])
+    code, records = run_cli(tmp_path, capsys, '--dry-run', '--sort', 'name', '--name', 'doc',
+                            '--num-suffix', '--num-pad', '2', '--ext', 'txt')
+    assert code == 0
+    assert [(Path(r['source']).name, Path(r['target']).name, r['status']) for r in records] == [
+        ('a.txt', 'doc01.txt', 'planned'), ('b.txt', 'doc02.txt', 'planned')]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.txt', 'b.txt', 'c.pdf']
+
+
+def test_cli_retries(tmp_path, capsys):
+    make_files(tmp_path, ['a.txt', 'b.txt'])
+    code, records = run_cli(tmp_path, capsys, '--name', 'doc', '--num-suffix', '--sort', 'name', '--retries', '2')
+    assert code == 0
+    assert [(Path(r['target']).name, r['status']) for r in records] == [('doc1.txt', 'renamed'), ('doc2.txt', 'renamed')]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['doc1.txt', 'doc2.txt']
+
+
+def test_run_prunes_the_journal(tmp_path):
+    journal = Journal(tmp_path / 'journal')
+    for _ in range(KEEP):
+        journal.begin([]).finish()
+    make_files(tmp_path, ['a.txt'])
+    report = renamer.run(iter([[(tmp_path / 'a.txt', tmp_path / 'b.txt')]]), io.StringIO(), journal=journal)
+    assert report.renamed == 1
+    batches = sorted((tmp_path / 'journal').glob('*.jsonl'))
+    assert len(batches) == KEEP and journal.last().count == 1
+
+
+def test_cli_rejects_invalid_patterns(tmp_path, capsys):
+    make_files(tmp_path, ['a.txt'])
+    code = renamer.main([str(tmp_path), '--replace-search', '(', '--replace-regex'])
+    assert code == 2
+    assert 'Invalid pattern' in capsys.readouterr().err
+    assert [p.name for p in tmp_path.iterdir()] == ['a.txt']
+
+
+def test_cli_profile(tmp_path, capsys):
+    make_files(tmp_path, ['a.txt', 'b.txt'])
+    trace = tmp_path.parent / f'{tmp_path.name}.trace.json'
+    code, _ = run_cli(tmp_path, capsys, '--name', 'x', '--num-suffix', '--profile', str(trace))
+    assert code == 0
+    events = json.loads(trace.read_text())['traceEvents']
+    names = {event['name'] for event in events}
+    assert {'pipeline', 'check_plan', 'journal', 'execute_plan'} <= names
+    counters = next(event['args'] for event in events if event['ph'] == 'C')
+    assert counters['rows_scanned'] == 2 and counters['rows_renamed'] == 2
+
+
+def test_cli_metadata_tokens(tmp_path, capsys):
+    (tmp_path / 'a.txt').write_bytes(bytes(12))
+    (tmp_path / 'b.txt').write_bytes(bytes(3))
+    code, records = run_cli(tmp_path, capsys, '--add-prefix', '{size}_')
+    assert code == 0
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['12_a.txt', '3_b.txt']
+
+
+def test_cli_move_to(tmp_path, capsys):
+    (tmp_path / 'a.txt').write_bytes(bytes(12))
+    (tmp_path / 'b.txt').write_bytes(bytes(3))
+    (tmp_path / 'c.txt').write_bytes(bytes(3))
+    (tmp_path / '3').mkdir()
+    (tmp_path / '3' / 'c.txt').touch()
+    code, records = run_cli(tmp_path, capsys, '--move-to', '{size}', '--dry-run')
+    assert code == 1 and not (tmp_path / '12').exists()
+    assert {record['target']: record['status'] for record in records} == {
+        str(tmp_path / '12' / 'a.txt'): 'planned', str(tmp_path / '3' / 'b.txt'): 'planned',
+        str(tmp_path / '3' / 'c.txt'): 'conflict'}
+    code, records = run_cli(tmp_path, capsys, '--move-to', '{size}')
+    assert code == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['12', '3', 'c.txt']
+    assert sorted(p.name for p in (tmp_path / '3').iterdir()) == ['b.txt', 'c.txt']
+
+    journal = Journal()
+    journal.undo(journal.last().id)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['12', '3', 'a.txt', 'b.txt', 'c.txt']
+
+
+def test_cli_duplicates(tmp_path, capsys):
+    (tmp_path / 'sub').mkdir()
+    for name in ['a.txt', 'b.txt', 'sub/c.txt']:
+        (tmp_path / name).write_text('same')
+    (tmp_path / 'd.txt').write_text('diff')
+    code, records = run_cli(tmp_path, capsys, '--duplicates', '--sort', 'name')
+    assert code == 0
+    assert records == [{'duplicates': [str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')], 'size': 4}]
+    code, records = run_cli(tmp_path, capsys, '--duplicates', '--recursive', '--sort', 'name')
+    assert sorted(records[0]['duplicates']) == sorted(str(tmp_path / name) for name in ['a.txt', 'b.txt', 'sub/c.txt'])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.txt', 'b.txt', 'd.txt', 'sub']
+
+
+def test_cli_hash_token(tmp_path, capsys):
+    (tmp_path / 'a.txt').write_text('content')
+    code, _ = run_cli(tmp_path, capsys, '--name', '{hash}')
+    assert code == 0
+    assert [p.name for p in tmp_path.iterdir()] == ['ed7002b439e9ac84.txt']
+
+
+def test_cli_job_queue(tmp_path, capsys):
+    directories = []
+    for i in range(5):
+        directory = tmp_path / f'dir{i}'
+        directory.mkdir()
+        make_files(directory, ['a.txt', 'b.txt'])
+        directories.append(str(directory))
+    Presets().save('numbered', RenameSpec(name='file', num_suffix=True))
+    report = tmp_path / 'report.json'
+    code = renamer.main([*directories, str(tmp_path / 'missing'), '--preset', 'numbered', '--sort', 'name',
+                         '--jobs', '3', '--report', str(report)])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert code == 2
+    assert len(records) == 10 and all(record['status'] == 'renamed' for record in records)
+    for directory in directories:
+        assert sorted(p.name for p in Path(directory).iterdir()) == ['file1.txt', 'file2.txt']
+    data = json.loads(report.read_text())
+    assert (data['directories'], data['total'], data['renamed'], data['failed']) == (6, 10, 10, 0)
+    assert [result['directory'] for result in data['results']] == directories + [str(tmp_path / 'missing')]
+    assert all(result['seconds'] >= 0 for result in data['results'])
+    assert data['results'][-1]['errors'] and not data['results'][0]['errors']
+
+
+def test_cli_renames_with_spec_file(tmp_path, capsys):
+    files = tmp_path / 'files'
+    files.mkdir()
+    make_files(files, ['one.txt', 'two.txt', 'ONE_X.txt'])
+    spec = tmp_path / 'spec.json'
+    spec.write_text(json.dumps({'case': 'upper', 'add_suffix': '_x'}))
+    code, records = run_cli(files, capsys, '--spec', str(spec), '--add-suffix', '_X', '--sort', 'name',
+                            '--workers', '1')
+    # one -> ONE_X only works because ONE_X -> ONE_X_X moves out of the way first.
+    assert code == 0
+    assert [(Path(r['target']).name, r['status']) for r in records] == [
+        ('ONE_X.txt', 'renamed'), ('ONE_X_X.txt', 'renamed'), ('TWO_X.txt', 'renamed')]
+    assert sorted(p.name for p in files.iterdir()) == ['ONE_X.txt', 'ONE_X_X.txt', 'TWO_X.txt']
+
+
+def test_cli_rejects_mistyped_spec_values(tmp_path, capsys):
+    make_files(tmp_path, ['a.txt'])
+    spec = tmp_path / 'spec.json'
+    spec.write_text(json.dumps({'remove_first': '1'}))
+    assert renamer.main([str(tmp_path), '--spec', str(spec)]) == 2
+    assert 'Invalid rename options: remove_first must be int' in capsys.readouterr().err
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.txt', 'spec.json']
+
+
+def test_cli_reports_conflicts_up_front(tmp_path, capsys):
+    make_files(tmp_path, ['a.txt', 'b.txt', 'x.txt'])
+    code, records = run_cli(tmp_path, capsys, '--dry-run', '--sort', 'name', '--name', 'x')
+    assert [(Path(r['source']).name, r['status']) for r in records] == [
+        ('a.txt', 'conflict'), ('b.txt', 'conflict')]
+    assert records[0]['error'] == 'target already exists'
+
+
+def test_cli_never_renames_twice(tmp_path, capsys):
+    make_files(tmp_path, [f'{i}.txt' for i in range(50)])
+    code, records = run_cli(tmp_path, capsys, '--add-prefix', 'x')
+    assert code == 0 and len(records) == 50
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f'x{i}.txt' for i in range(50))
+
+
+def test_cli_streams_in_chunks(tmp_path):
+    make_files(tmp_path, [f'{i}.txt' for i in range(25)])
+    pipeline = compile_spec(RenameSpec(name='n', num_prefix=True))
+    chunks = list(renamer.plan(tmp_path, pipeline, chunk_size=10, sort='name'))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    targets = [target.name for chunk in chunks for _, target in chunk]
+    assert targets == [f'{i}n.txt' for i in range(1, 26)]
+
+
+def test_cli_does_not_import_qt():
+    code = 'import sys, renamer.renamer; sys.exit("PySide6" in sys.modules)'
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
+
+
+def test_remove(tmp_path):
+    make_files(tmp_path, ['a-b.txt', 'c-d.pdf'])
+    assert renamer.remove(tmp_path, '-', ['txt']) == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['ab.txt', 'c-d.pdf']
+
+
+def test_cli_recursive_bottom_up(tmp_path, capsys):
+    for folder in ['x', 'x/y', 'z']:
+        (tmp_path / folder).mkdir()
+    make_files(tmp_path, ['x/b.txt', 'x/a.txt', 'x/y/c.txt', 'z/d.txt'])
+    code, records = run_cli(tmp_path, capsys, '--recursive', '--dirs', '--sort', 'name',
+                            '--add-prefix', 'n', '--num-suffix')
+    assert code == 0
+    renamed = [Path(r['target']).relative_to(tmp_path).as_posix() for r in records]
+    assert renamed == ['x/y/nc1.txt', 'x/na1.txt', 'x/nb2.txt', 'x/ny3', 'z/nd1.txt', 'nx1', 'nz2']
+    found = sorted(p.relative_to(tmp_path).as_posix() for p in tmp_path.rglob('*'))
+    assert found == ['nx1', 'nx1/na1.txt', 'nx1/nb2.txt', 'nx1/ny3', 'nx1/ny3/nc1.txt', 'nz2', 'nz2/nd1.txt']
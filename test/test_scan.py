@@ -0,0 +1,70 @@
+from PySide6.QtCore import QEventLoop, QTimer
+
+from renamer.main import DirectoryScanner
+from renamer.model import FilesModel
+from renamer.scan import scan_changes, scan_chunks, split_name, walk
+
+
+def test_split_name():
+    assert split_name('report.final.txt') == ('report.final', '.txt')
+    assert split_name('.bashrc') == ('.bashrc', '')
+    assert split_name('trailing.') == ('trailing.', '')
+
+
+def test_scan_chunks_grow(tmp_path):
+    for i in range(40):
+        (tmp_path / f'{i}.txt').touch()
+    (tmp_path / 'sub').mkdir()
+    chunks = list(scan_chunks(tmp_path, size=16, first=4))
+    assert [len(chunk[0]) for chunk in chunks] == [4, 8, 16, 13]
+    names = sorted(name for chunk in chunks for name in chunk[0])
+    assert 'sub' in names and len(names) == 41
+
+
+def test_scan_chunks_cancel(tmp_path):
+    for i in range(10):
+        (tmp_path / f'{i}.txt').touch()
+    assert list(scan_chunks(tmp_path, first=2, cancelled=lambda: True)) == []
+
+
+def test_scan_changes(tmp_path):
+    for name in ['kept.txt', 'new.txt']:
+        (tmp_path / name).touch()
+    (tmp_path / 'folder').mkdir()
+    added, gone = scan_changes(tmp_path, {'kept.txt', 'old.txt'})
+    assert sorted(added)[0][:3] == ('folder', '', True)
+    assert sorted(entry[:2] for entry in added) == [('folder', ''), ('new', '.txt')]
+    assert gone == {'old.txt'}
+
+
+def test_scanner_streams_into_model(qapp, tmp_path):
+    for i in range(600):
+        (tmp_path / f'{i}.txt').touch()
+    model = FilesModel()
+    scanner = DirectoryScanner(str(tmp_path))
+    scanner.chunk.connect(model.append_chunk)
+    loop = QEventLoop()
+    scanner.finished.connect(loop.quit)
+    QTimer.singleShot(5000, loop.quit)
+    scanner.start()
+    loop.exec()
+    scanner.wait()
+    qapp.processEvents()
+    assert scanner.error is None
+    assert model.rowCount() == 600 == scanner.count
+
+
+def test_walk(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'b' / 'deep.txt').touch()
+    (tmp_path / 'top.txt').touch()
+    (tmp_path / 'link').symlink_to(tmp_path / 'a')
+    found = {folder.relative_to(tmp_path).as_posix(): (depth, sorted(entry[0] for entry in entries))
+             for folder, depth, entries in walk(tmp_path, workers=3)}
+    assert found == {'.': (0, ['a', 'link', 'top']), 'a': (1, ['b']), 'a/b': (2, ['deep'])}
+
+
+def test_walk_reports_errors(tmp_path):
+    errors = []
+    assert list(walk(tmp_path / 'missing', onerror=lambda folder, e: errors.append(folder))) == []
+    assert errors == [tmp_path / 'missing']
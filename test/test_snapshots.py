@@ -0,0 +1,81 @@
+import os
+import time
+
+import renamer.snapshots
+from renamer.snapshots import SnapshotCache, cached_chunks
+
+
+def make_folder(path, count, mtime=None):
+    path.mkdir()
+    for i in range(count):
+        (path / f'IMG_{i:04d}.jpg').touch()
+    (path / 'sub').mkdir()
+    mtime = mtime or time.time() - 60
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def listing(path, cache, **kwargs):
+    names, suffixes, is_dir, mtimes = ([], [], [], [])
+    for chunk in cached_chunks(path, cache, **kwargs):
+        names += chunk[0]
+        suffixes += chunk[1]
+        is_dir += chunk[2]
+        mtimes += chunk[3]
+    return sorted(zip(names, suffixes, is_dir, mtimes))
+
+
+def test_reopen_from_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(renamer.snapshots, 'MIN_ENTRIES', 10)
+    folder = make_folder(tmp_path / 'photos', 20)
+    (folder / b'caf\xe9.txt'.decode('utf-8', 'surrogateescape')).touch()
+    os.utime(folder, (1_000_000, 1_000_000))
+    cache = SnapshotCache(tmp_path / 'snapshots.sqlite')
+    scanned = listing(folder, cache)
+    assert len(scanned) == 22 and ('sub', '', True, scanned[-1][3]) in scanned
+
+    def no_scan(*args, **kwargs):
+        raise AssertionError('scanned')
+    monkeypatch.setattr(renamer.snapshots, 'scan_chunks', no_scan)
+    assert listing(folder, cache) == scanned
+
+    # Adding an entry changes the folder's mtime, so it is scanned again.
+    monkeypatch.undo()
+    monkeypatch.setattr(renamer.snapshots, 'MIN_ENTRIES', 10)
+    (folder / 'new.png').touch()
+    os.utime(folder, (2_000_000, 2_000_000))
+    assert ('new', '.png', False) in [entry[:3] for entry in listing(folder, cache)]
+    cache.close()
+
+
+def test_snapshots_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(renamer.snapshots, 'MIN_ENTRIES', 10)
+    cache = SnapshotCache(tmp_path / 'snapshots.sqlite')
+    small = make_folder(tmp_path / 'small', 5)
+    # Changed too recently to trust its mtime.
+    racy = make_folder(tmp_path / 'racy', 20, mtime=time.time())
+    cancelled = make_folder(tmp_path / 'cancelled', 20)
+    listing(small, cache)
+    listing(racy, cache)
+    assert listing(cancelled, cache, cancelled=lambda: True) == []
+    assert cache.get(small) is None and cache.get(racy) is None and cache.get(cancelled) is None
+    cache.close()
+
+
+def test_least_recently_opened_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(renamer.snapshots, 'MIN_ENTRIES', 10)
+    folders = [make_folder(tmp_path / f'{i}', 200) for i in range(3)]
+    cache = SnapshotCache(tmp_path / 'snapshots.sqlite')
+    listing(folders[0], cache)
+    size = cache.db.execute('SELECT bytes FROM snapshots').fetchone()[0]
+    cache.limit = size * 2 + size // 2
+    listing(folders[1], cache)
+    assert cache.get(folders[0]) is not None
+    listing(folders[2], cache)
+    assert cache.get(folders[1]) is None
+    assert cache.get(folders[0]) is not None and cache.get(folders[2]) is not None
+
+    cache.limit = size // 2
+    assert not cache.put(folders[0], os.stat(folders[0]), cache.get(folders[0]))
+    assert cache.get(folders[0]) is None
+    cache.close()